@@ -1,66 +1,90 @@
-
-
 # parse log file of success jobs
-# 1. grab molecule formula
-# 2. grab time for opt
-# 3. grab time for opt and freq
-# 4. get freq time
-# 5. get number of heavy atoms in mol
-# 6. plot
+# 1. stream success jobs from registration table
+# 2. grab molecule formula and heavy atom count
+# 3. grab time for opt and for freq from log tail
+# 4. save timings as a columnar npz dataset
+# 5. plot
 
 import os
 import re
+import array
+import numpy as np
 import matplotlib.pyplot as plt
 
+import autoqm.utils
+import autoqm.packer
+import autoqm.indexer
+
 def select_targets(registration_table,
-					success_data_path):
+					success_data_path,
+					batch_size=1000):
 	"""
-	This method is to inform job analyzer which targets 
-	to fix, which need meet two requirements:
+	This method is to inform job analyzer which targets
+	to analyze, which need meet two requirements:
 	1. status is job_success
-	2. job files (.log) located as expected
+	2. job files (.log) located as expected,
+	   either in job folder or in its container
 
-	Returns a list of targets with necessary meta data
+	Targets are streamed from a server-side cursor
+	batch_size documents at a time.
+
+	Yields targets with necessary meta data
 	"""
 
 	reg_query = {"status":"job_success"}
+	reg_projection = {"aug_inchi": 1, "level_of_theory": 1}
 
-	targets = list(registration_table.find(reg_query).limit(1000))
+	cursor = registration_table.find(reg_query, reg_projection).batch_size(batch_size)
 
-	selected_targets = []
-	for target in targets:
+	job_index = autoqm.indexer.JobIndex(success_data_path)
+	for target in cursor:
 		aug_inchi = str(target['aug_inchi'])
 		spec_name = aug_inchi.replace('/', '_slash_')
-		spec_path = os.path.join(success_data_path, spec_name)
-		log_path = os.path.join(spec_path, 'input.log')
-		if os.path.exists(log_path):
-			selected_targets.append(target)
-	return selected_targets
+		if job_index.has_job_files(spec_name, ['input.log']):
+			yield target
 
 def analyze_jobs(registration_table, success_data_path):
+	"""
+	This method collects formula, heavy atom count,
+	opt and freq hours, and level of theory of every
+	success job in one pass.
 
-	# select targets
-	selected_targets = select_targets(registration_table, success_data_path)
-
-	# create a dictonary consisting
-	# of all the needed info for each
-	# success job
-	job_info_dict = {}
-	for target in selected_targets:
+	Returns a dictionary of columns as numpy arrays
+	"""
+	aug_inchis = []
+	formulas = []
+	levels_of_theory = []
+	heavy_atom_counts = array.array('i')
+	opt_times = array.array('d')
+	freq_times = array.array('d')
+
+	for target in select_targets(registration_table, success_data_path):
 		aug_inchi = str(target['aug_inchi'])
 		spec_name = aug_inchi.replace('/', '_slash_')
 		spec_path = os.path.join(success_data_path, spec_name)
-		log_path = os.path.join(spec_path, 'input.log')
 
-		molecule_formula = get_mol_formula_from_aug_inchi(aug_inchi)
-		time_for_opt, time_for_freq = get_opt_freq_times(log_path)
-		heavy_atom_count = get_heavy_atom_count(molecule_formula)
-		job_info_dict[aug_inchi] = [molecule_formula, 
-									time_for_opt, 
-									time_for_freq, 
-									heavy_atom_count]
+		times = get_opt_freq_times(spec_path)
+		if times is None:
+			continue
 
-	return job_info_dict
+		molecule_formula = get_mol_formula_from_aug_inchi(aug_inchi)
+		aug_inchis.append(aug_inchi)
+		formulas.append(molecule_formula)
+		levels_of_theory.append(str(target.get('level_of_theory', '')))
+		heavy_atom_counts.append(autoqm.utils.get_heavy_atom_count_from_formula(molecule_formula))
+		opt_times.append(times[0])
+		freq_times.append(times[1])
+
+	job_info = {
+		'aug_inchi': np.array(aug_inchis, dtype=str),
+		'formula': np.array(formulas, dtype=str),
+		'level_of_theory': np.array(levels_of_theory, dtype=str),
+		'heavy_atom_count': np.frombuffer(heavy_atom_counts, dtype=np.int32),
+		'opt_time': np.frombuffer(opt_times, dtype=np.float64),
+		'freq_time': np.frombuffer(freq_times, dtype=np.float64)
+	}
+
+	return job_info
 
 # helper methods
 def get_mol_formula_from_aug_inchi(aug_inchi):
@@ -68,75 +92,74 @@ def get_mol_formula_from_aug_inchi(aug_inchi):
 	tokens = aug_inchi.split('/')
 	return tokens[1]
 
-def get_heavy_atom_count(molecule_formula):
-
-	matches = re.findall('[A-GI-Z]\d*', molecule_formula)
-	
-	count = 0
-	for match in matches:
-		if len(match) == 1:
-			count += 1
-		else:
-			count += int(match[1:])
-
-	return count
-
-def get_opt_freq_times(log_path):
-
-	time_report_lines = []
-	with open(log_path, 'r') as f_in:
-
-		for line in f_in.readlines():
-			if 'Job cpu time:' in line:
-				time_report_lines.append(line)
+def get_opt_freq_times(spec_path):
+	"""
+	This method returns opt and freq cpu hours of a job,
+	read from the tail of its log through mmap if the job
+	folder is there, otherwise streamed from its container.
 
-	times = []
-	for line in time_report_lines:
-		matched_times = re.findall('\d\d*', line)
-		days = int(matched_times[0])
-		hours = int(matched_times[1])
-		minutes = int(matched_times[2])
+	Returns (opt hours, freq hours) or None if the log
+	does not report both
+	"""
+	log_path = os.path.join(spec_path, 'input.log')
+	if os.path.exists(log_path):
+		times = autoqm.utils.get_job_cpu_times(log_path)
+	else:
+		times = []
+		f_in = autoqm.packer.open_job_file(spec_path, 'input.log')
+		try:
+			for line in f_in:
+				if b'Job cpu time:' in line:
+					times.append(parse_cpu_time(line.decode('ascii', 'ignore')))
+		finally:
+			f_in.close()
+		times = times[-2:]
+
+	if len(times) < 2:
+		return None
+	return times[0], times[1]
 
-		total_hours = round(days*24 + hours + minutes/60.0, 2)
-		times.append(total_hours)
+def parse_cpu_time(line):
 
-	return times[0], times[1]
+	matched_times = re.findall('\d+\.?\d*', line)
+	days = float(matched_times[0])
+	hours = float(matched_times[1])
+	minutes = float(matched_times[2])
+	seconds = float(matched_times[3])
 
-def analysis_plot(job_info_dict):
+	return days*24 + hours + minutes/60.0 + seconds/3600.0
 
-	heavy_atom_counts = []
-	freq_times = []
-	for aug_inchi, data in job_info_dict.iteritems():
+def save_job_info(job_info, dataset_path):
+	"""
+	This method saves the columns of job_info
+	as a compressed npz dataset.
+	"""
+	np.savez_compressed(dataset_path, **job_info)
 
-		freq_times.append(data[2])
-		heavy_atom_counts.append(data[3])
+def analysis_plot(job_info):
 
 	plt.figure()
-	plt.scatter(heavy_atom_counts, freq_times)
+	plt.scatter(job_info['heavy_atom_count'], job_info['freq_time'])
 	plt.xlabel('Heavy atom count')
 	plt.ylabel('Frequency calculation time (hour)')
 	plt.savefig('success_job_analysis.png')
 
 def run():
 
-	import autoqm.utils
 	import autoqm.connector
 
 	# get config info
 	config = autoqm.utils.read_config()
 
-	# connect to thermo central db
-	auth_info = autoqm.utils.get_TCD_authentication_info()
-	tcdi = autoqm.connector.ThermoCentralDatabaseInterface(*auth_info)
-	tcd =  getattr(tcdi.client, 'thermoCentralDB')
-
-	# get registration table
+	# get registration table from thermo central db
 	# and specify success job data path
-	reg_table = getattr(tcd, 'saturated_ringcore_table')
+	reg_table = autoqm.connector.get_collection('saturated_ringcore_table')
 	success_data_path = os.path.join(config['QuantumMechanicJob']['scratch_data_path'],
 									'success')
 
-	job_info_dict = analyze_jobs(reg_table, success_data_path)
-	analysis_plot(job_info_dict)
+	job_info = analyze_jobs(reg_table, success_data_path)
+	save_job_info(job_info, 'success_job_timings.npz')
+	analysis_plot(job_info)
 
-run()
\ No newline at end of file
+if __name__ == '__main__':
+	run()
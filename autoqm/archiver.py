@@ -1,7 +1,14 @@
 import os
 import shutil
+import hashlib
+from multiprocessing.pool import ThreadPool
 
 import autoqm.utils
+import autoqm.packer
+import autoqm.indexer
+import autoqm.metrics
+import autoqm.outbox
+from autoqm.writer import BulkUpdateWriter
 from autoqm.connector import saturated_ringcore_table
 
 config = autoqm.utils.read_config()
@@ -23,18 +30,140 @@ def select_archive_target():
 				},
 			"archived": "No"
 			}
+	projection = {"aug_inchi": 1, "status": 1}
 
-	targets = list(saturated_ringcore_table.find(query))
+	targets = list(saturated_ringcore_table.find(query, projection))
 	print("Selected {0} potential jobs to archive.".format(len(targets)))
 
 	return targets
 
-def archive_jobs():
+def get_file_checksum(file_path, chunk_size=1048576):
+	"""
+	This method returns md5 checksum of a file, 
+	reading it in chunks.
+	"""
+	checksum = hashlib.md5()
+	with open(file_path, 'rb') as f_in:
+		for chunk in iter(lambda: f_in.read(chunk_size), b''):
+			checksum.update(chunk)
+
+	return checksum.hexdigest()
+
+def copy_file(src_file, dest_file, chunk_size=1048576):
+	"""
+	This method copies a file in chunks and returns
+	md5 checksum of the content it read.
+	"""
+	checksum = hashlib.md5()
+	with open(src_file, 'rb') as f_in:
+		with open(dest_file, 'wb') as f_out:
+			for chunk in iter(lambda: f_in.read(chunk_size), b''):
+				checksum.update(chunk)
+				f_out.write(chunk)
+	shutil.copystat(src_file, dest_file)
+
+	return checksum.hexdigest()
+
+def copy_job_folder(spec_path, scratch_spec_path):
+	"""
+	This method copies a job folder to scratch path and
+	removes the source only after every copied file
+	matches its source checksum. Files are copied into
+	a .partial folder first, which is renamed when complete.
+	"""
+	partial_path = scratch_spec_path + '.partial'
+	if os.path.exists(partial_path):
+		shutil.rmtree(partial_path)
+
+	for root, dirs, files in os.walk(spec_path):
+		relative_root = os.path.relpath(root, spec_path)
+		dest_root = os.path.normpath(os.path.join(partial_path, relative_root))
+		os.makedirs(dest_root)
+		for file_name in files:
+			src_file = os.path.join(root, file_name)
+			dest_file = os.path.join(dest_root, file_name)
+			src_checksum = copy_file(src_file, dest_file)
+			if get_file_checksum(dest_file) != src_checksum:
+				raise IOError('Checksum mismatch when copying {0}.'.format(src_file))
+
+	os.rename(partial_path, scratch_spec_path)
+	shutil.rmtree(spec_path)
+
+def get_versioned_path(path):
+	"""
+	Returns the first path.<version> not taken yet
+	"""
+	version = 1
+	while os.path.exists('{0}.{1}'.format(path, version)):
+		version += 1
+
+	return '{0}.{1}'.format(path, version)
+
+def set_aside(path):
+	"""
+	This method renames an existing archive, e.g., of an
+	earlier run of a species reset to pending, to a versioned
+	name, so the latest run is archived where stages expect it.
+	"""
+	versioned_path = get_versioned_path(path)
+	os.rename(path, versioned_path)
+	print('Existing {0} is kept as {1}.'.format(path, versioned_path))
+
+def move_job_folder(spec_path, scratch_spec_path):
+	"""
+	This method moves a job folder to scratch path, as an 
+	atomic rename if both are on the same filesystem, or
+	as a verified copy otherwise. An existing folder at
+	scratch path is set aside first.
+	"""
+	if os.path.exists(scratch_spec_path):
+		set_aside(scratch_spec_path)
+
+	scratch_parent_path = os.path.dirname(scratch_spec_path)
+	if os.stat(spec_path).st_dev == os.stat(scratch_parent_path).st_dev:
+		os.rename(spec_path, scratch_spec_path)
+	else:
+		copy_job_folder(spec_path, scratch_spec_path)
+
+def pack_job_folder(spec_path, scratch_spec_path):
+	"""
+	This method packs a job folder into a compressed
+	container next to scratch path and removes the folder.
+	An existing container is set aside first.
+	"""
+	container_path = autoqm.packer.get_container_path(scratch_spec_path)
+	if os.path.exists(container_path):
+		set_aside(container_path)
+
+	autoqm.packer.pack_job_folder(spec_path, container_path)
+	shutil.rmtree(spec_path)
+
+def archive_job(move_task):
+	"""
+	This method moves or packs one job folder, it's 
+	used as the worker of archiver thread pool.
+
+	Returns aug_inchi of the job and error message
+	if the move fails
+	"""
+	aug_inchi, spec_path, scratch_spec_path, archive_format = move_task
+	try:
+		if archive_format == 'container':
+			pack_job_folder(spec_path, scratch_spec_path)
+		else:
+			move_job_folder(spec_path, scratch_spec_path)
+		return aug_inchi, None
+	except (IOError, OSError) as e:
+		return aug_inchi, str(e)
+
+def archive_jobs(threads=4, archive_format='folder'):
 	"""
 	This method archives jobs with following steps:
 	1. select jobs to archive
 	2. check if expected path exists
-	3. move job folders
+	3. move job folders, or pack them into containers if
+	   archive_format is container, in a pool of threads
+	4. mark moved jobs as archived in batches
 	"""
 	# 1. select jobs to archive
 	targets = select_archive_target()
@@ -55,13 +184,14 @@ def archive_jobs():
 	if not os.path.exists(failed_isomorphism_data_path):
 		os.mkdir(failed_isomorphism_data_path)
 
-	archive_count = 0
+	move_tasks = []
+	job_index = autoqm.indexer.JobIndex(data_path)
 	for target in targets:
 		aug_inchi = str(target['aug_inchi'])
 		spec_name = aug_inchi.replace('/', '_slash_')
 		spec_path = os.path.join(data_path, spec_name)
 
-		if not os.path.exists(spec_path):
+		if not job_index.has_job_folder(spec_name):
 			continue
 
 		status = str(target['status'])
@@ -75,17 +205,42 @@ def archive_jobs():
 			print("Unrecognized job status {0} for {1}.".format(status, aug_inchi))
 			continue
 
-		shutil.move(spec_path, scratch_spec_path)
-		archive_count += 1
+		move_tasks.append((aug_inchi, spec_path, scratch_spec_path, archive_format))
 
-		query = {"aug_inchi": aug_inchi}
-		update_field = {
-				'archived': "Yes"
-		}
-
-		saturated_ringcore_table.update_one(query, {"$set": update_field}, True)
+	# 3. move job folders
+	archive_count = 0
+	pool = ThreadPool(threads)
+	try:
+		with BulkUpdateWriter(saturated_ringcore_table,
+							outbox_table=autoqm.outbox.get_outbox_table()) as writer:
+			for aug_inchi, error in pool.imap_unordered(archive_job, move_tasks):
+				if error is not None:
+					print("Archiving fails for {0}: {1}".format(aug_inchi, error))
+					continue
+
+				archive_count += 1
+
+				# 4. mark moved jobs as archived
+				query = {"aug_inchi": aug_inchi}
+				update_field = {
+						'archived': "Yes"
+				}
+
+				writer.update(query, update_field)
+	finally:
+		pool.close()
+		pool.join()
 
 	print("Archived {0} jobs.".format(archive_count))
+	autoqm.metrics.add_processed(archive_count)
+
+def run():
+
+	threads = int(config['QuantumMechanicJob'].get('archiver_threads', 4))
+	archive_format = config['QuantumMechanicJob'].get('archive_format', 'folder')
+	with autoqm.metrics.stage_run('archiver'):
+		archive_jobs(threads=threads, archive_format=archive_format)
 
-archive_jobs()
+if __name__ == '__main__':
+	run()
 
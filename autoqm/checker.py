@@ -21,22 +21,30 @@
 # update status accordingly
 import os
 import pybel
-import subprocess
 
 from rmgpy.molecule import Molecule
 from rmgpy.species import Species
 
 import autoqm.utils
+import autoqm.lease
+import autoqm.metrics
+import autoqm.outbox
+import autoqm.scheduler
+from autoqm.writer import BulkUpdateWriter
+from autoqm.predictor import ResourcePredictor
 from autoqm.connector import saturated_ringcore_table
 
 config = autoqm.utils.read_config()
 
-def select_check_target():
+def select_check_target(claim=None):
 	"""
 	This method is to inform job checker which targets 
 	to check, which need meet one requirement:
 	1. status is job_launched or job_running
 
+	If a LeaseClaim is given, targets are leased to this
+	worker, so other checkers don't select them.
+
 	Returns a list of targe
 	"""
 	query = {"status":
@@ -44,37 +52,34 @@ def select_check_target():
 					["job_launched", "job_running"] 
 				}
 			}
-	targets = list(saturated_ringcore_table.find(query))
+	projection = {"aug_inchi": 1, "status": 1, "job_id": 1}
+	if claim is not None:
+		return claim.claim(query, projection)
+
+	targets = list(saturated_ringcore_table.find(query, projection))
 
 	return targets
 
 def check_slurm_status(job_id):
 	"""
-	This method checks slurm status of a job given job_id
+	This method checks slurm status of a job given job_id,
+	which can also be an array task, e.g., 5037088_3
 
 	Returns off_queue or job_launched or job_running
 	"""
+	return autoqm.scheduler.SlurmBackend(polling='per_job').get_status(job_id)
 
-	commands = ['scontrol', 'show', 'jobid', job_id]
-	process = subprocess.Popen(commands,
-								stdout=subprocess.PIPE,
-								stderr=subprocess.PIPE)
-	stdout, stderr = process.communicate()
-
-	if "Invalid job id specified" in stderr:
-		return "off_queue"
+def check_slurm_statuses(job_ids, chunk_size=500):
+	"""
+	This method checks slurm status of many jobs at once
+	by calling "squeue" once per chunk of job_ids.
 
-	assert "JobId={0}".format(job_id) in stdout, 'Slurm cannot show details for job_id {0}'.format(job_id)
-	for stdout_line in stdout.splitlines():
-		if "JobState=" in stdout_line:
-			tokens = [token.strip() for token in stdout_line.split() if "JobState=" in token]
-			status = tokens[0].replace('JobState=', '').lower()
-			if status == "running":
-				return "job_running"
-			else:
-				return "job_launched"
+	Returns a dictionary mapping each job_id to off_queue
+	or job_launched or job_running
+	"""
+	return autoqm.scheduler.SlurmBackend(chunk_size=chunk_size).get_queue_statuses(job_ids)
 
-def check_content_status(data_path, aug_inchi):
+def check_content_status(data_path, aug_inchi, resonance_cache_path=None):
 	"""
 	This method checks the content (log file) 
 	for an off_queue job.
@@ -84,74 +89,173 @@ def check_content_status(data_path, aug_inchi):
 
 	Note: when checking convergence, this method assumes
 	it's a gaussian opt freq calculation, it will check if there's
-	two "Normal termination" in the log file.
+	two "Normal termination" at the end of the log file, or one
+	if the job is a freq only restart by job fixer. The log
+	is scanned from its tail only, which also gives the final
+	geometry for the isomorphism check.
 	"""
-	spec_name = aug_inchi.replace('/', '_slash_')
-	log_path = os.path.join(data_path, spec_name, 'input.log')
+	log_path = get_log_path(data_path, aug_inchi)
 	if not os.path.exists(log_path):
 		return "job_aborted"
 
 	# check job convergence
-	commands = ['grep', 'Normal', log_path]
-	process = subprocess.Popen(commands,
-								stdout=subprocess.PIPE,
-								stderr=subprocess.PIPE)
-	stdout, stderr = process.communicate()
-
-	normal_termination_count = 0
-	for stdout_line in stdout.splitlines():
-		if "Normal termination" in stdout_line:
-			normal_termination_count += 1
-
-	if normal_termination_count < 2:
+	normal_termination_count, coordinates = autoqm.utils.scan_gaussian_log(log_path)
+	expected_termination_count = get_expected_termination_count(os.path.dirname(log_path))
+
+	if normal_termination_count < expected_termination_count or not coordinates:
 		return "job_failed_convergence"
 
 	# check job isomorphism
-	bel_mol_after = pybel.readfile("g09", log_path).next()
+	if not check_isomorphism(aug_inchi, coordinates, resonance_cache_path):
+		return "job_failed_isomorphism"
+	else:
+		return "job_success"
+
+def get_expected_termination_count(spec_path):
+	"""
+	This method returns the number of gaussian jobs in
+	input.inp, i.e., 2 for opt freq and 1 for freq only.
+	"""
+	inp_path = os.path.join(spec_path, 'input.inp')
+	if not os.path.exists(inp_path):
+		return 2
+
+	with open(inp_path, 'r') as f_in:
+		for line in f_in:
+			if line.startswith('#'):
+				return 2 if ' opt' in line else 1
+	return 2
+
+def get_log_path(data_path, aug_inchi):
+
+	spec_name = aug_inchi.replace('/', '_slash_')
+	return os.path.join(data_path, spec_name, 'input.log')
+
+def observe_job_resources(predictor, data_path, aug_inchi):
+	"""
+	This method feeds cpu time of a success job, opt
+	and freq together, to the resource predictor.
+	"""
+	cpu_times = autoqm.utils.get_job_cpu_times(get_log_path(data_path, aug_inchi))
+	if not cpu_times:
+		return
+
+	formula = aug_inchi.split('/')[1]
+	heavy_atom_count = autoqm.utils.get_heavy_atom_count_from_formula(formula)
+	predictor.observe(heavy_atom_count, sum(cpu_times))
+
+def check_isomorphism(aug_inchi, coordinates, resonance_cache_path=None):
+	"""
+	This method checks if the output geometry of a job
+	is still the molecule given by aug_inchi, in tiers:
+	1. different formula: not isomorphic
+	2. same InChI of output geometry, without stereo
+	   layers: isomorphic
+	3. otherwise, RMG isomorphism against resonance isomers
+	   memoized in resonance_cache_path
+
+	Returns True or False
+	"""
+	# 1. compare formula
+	formula_before = aug_inchi.split('/')[1]
+	formula_after = autoqm.utils.get_formula_from_coordinates(coordinates)
+	if formula_before != formula_after:
+		return False
+
+	# 2. compare InChI
+	xyz_string = autoqm.utils.get_xyz_string(coordinates)
+	bel_mol_after = pybel.readstring("xyz", xyz_string)
+	try:
+		inchi_after = bel_mol_after.write(format='inchi').split()[0]
+	except (IOError, ValueError, IndexError):
+		inchi_after = None
+	# InChI from 3D geometry has stereo layers
+	# which aug_inchi doesn't have
+	if inchi_after is not None and \
+		autoqm.utils.remove_inchi_stereo_layers(inchi_after) == autoqm.utils.remove_inchi_stereo_layers(aug_inchi):
+		return True
+
+	# 3. full isomorphism check
 	smi_after = bel_mol_after.write(format='smi').split('\t')[0]
 	rmg_mol_after = Molecule().fromSMILES(smi_after)
 
-	rmg_mol_before = Molecule().fromAugmentedInChI(aug_inchi)
-	rmg_spec_before = Species(molecule=[rmg_mol_before])
-	rmg_spec_before.generateResonanceIsomers()
+	rmg_mols_before = autoqm.utils.get_resonance_isomers(aug_inchi, resonance_cache_path)
+	rmg_spec_before = Species(molecule=rmg_mols_before)
 
-	if not rmg_spec_before.isIsomorphic(rmg_mol_after):
-		return "job_failed_isomorphism"
-	else:
-		return "job_success"
+	return rmg_spec_before.isIsomorphic(rmg_mol_after)
 
-def check_jobs():
+def check_jobs(claim=None):
 	"""
 	This method checks job with following steps:
 	1. select jobs to check
 	2. check the job slurm_status, e.g., scontrol show jobid 5037088
 	3. check job content
 	4s. update with new status
+
+	Job statuses come from the scheduler backend set in config.
+	With slurm, they're polled in batch by default; set
+	slurm_polling to per_job in config to fall back to one
+	"scontrol" call per job.
+
+	If resource_model_path is set in config, cpu time of
+	every new success job refits the resource predictor
+	used by job creator.
+
+	If a LeaseClaim is given, jobs are claimed with it
+	so several checkers can run at the same time.
 	"""
 	# 1. select jobs to check
-	targets = select_check_target()
+	targets = select_check_target(claim)
 
 	# 2. check the job slurm-status
 	data_path = config['QuantumMechanicJob']['data_path']
-	for target in targets:
-		aug_inchi = str(target['aug_inchi'])
-		job_id = str(target['job_id']).strip()
-		# 2. check the job slurm_status
-		new_status = check_slurm_status(job_id)
-		if new_status == "off_queue":
-			# 3. check job content
-			new_status = check_content_status(data_path, aug_inchi)
+	resonance_cache_path = config['QuantumMechanicJob'].get('resonance_cache_path', 
+						os.path.join(config['QuantumMechanicJob']['scratch_data_path'], 'resonance_cache'))
+	resource_model_path = config['QuantumMechanicJob'].get('resource_model_path', None)
+	predictor = None
+	if resource_model_path:
+		predictor = ResourcePredictor(resource_model_path)
+	observed_count = 0
+	job_ids = [str(target['job_id']).strip() for target in targets]
+	slurm_status_map = autoqm.scheduler.get_backend().get_statuses(job_ids)
+
+	with BulkUpdateWriter(saturated_ringcore_table,
+						outbox_table=autoqm.outbox.get_outbox_table()) as writer:
+		for target in targets:
+			aug_inchi = str(target['aug_inchi'])
+			job_id = str(target['job_id']).strip()
+			# 2. check the job slurm_status
+			new_status = slurm_status_map[job_id]
+			if new_status == "off_queue":
+				# 3. check job content
+				new_status = check_content_status(data_path, aug_inchi, resonance_cache_path)
+				if new_status == "job_success" and predictor is not None:
+					observe_job_resources(predictor, data_path, aug_inchi)
+					observed_count += 1
 		
-		# 4. check with original status which
-		# should be job_launched or job_running
-		# if any difference update status
-		orig_status = str(target['status'])
-		if orig_status != new_status:
-			query = {"aug_inchi": aug_inchi}
-			update_field = {
-					'status': new_status
-			}
+			# 4. check with original status which
+			# should be job_launched or job_running
+			# if any difference update status
+			orig_status = str(target['status'])
+			if orig_status != new_status:
+				query = {"aug_inchi": aug_inchi}
+				update_field = {
+						'status': new_status
+				}
+
+				writer.update(query, update_field)
+
+	autoqm.metrics.add_processed(len(targets))
+
+	if observed_count > 0:
+		predictor.save()
+
+def run():
+
+	with autoqm.metrics.stage_run('checker'), \
+		autoqm.lease.get_claim(saturated_ringcore_table) as claim:
+		check_jobs(claim)
 
-			saturated_ringcore_table.update_one(query, {"$set": update_field}, True)
+if __name__ == '__main__':
+	run()
 
-check_jobs()
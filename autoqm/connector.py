@@ -1,33 +1,80 @@
 
+import threading
+
 import autoqm.utils
 
 class ThermoCentralDatabaseInterface(object):
     """
     A class for interfacing with thermo central database.
+
+    The client is created lazily on first use of `client` and
+    cached process-wide, so interfaces with same address and
+    options share one warm connection pool.
     """
 
-    def __init__(self, host, port, username, password):
+    clients = {}
+
+    def __init__(self, host, port, username, password,
+                 max_pool_size=100,
+                 server_selection_timeout_ms=2000,
+                 connect_timeout_ms=20000,
+                 socket_timeout_ms=None,
+                 retry_writes=True,
+                 retry_reads=True):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
-        self.client = self.connect()
+        self.max_pool_size = max_pool_size
+        self.server_selection_timeout_ms = server_selection_timeout_ms
+        self.connect_timeout_ms = connect_timeout_ms
+        self.socket_timeout_ms = socket_timeout_ms
+        self.retry_writes = retry_writes
+        self.retry_reads = retry_reads
+        self.connected = False
+        self._client = None
+
+    @property
+    def client(self):
+
+        if not self.connected:
+            self._client = self.connect()
+            self.connected = True
+        return self._client
 
     def connect(self):
-        
+
         import pymongo
+        import autoqm.metrics
+
+        client_key = (self.host, self.port, self.username, self.password,
+                      self.max_pool_size,
+                      self.server_selection_timeout_ms,
+                      self.connect_timeout_ms,
+                      self.socket_timeout_ms,
+                      self.retry_writes,
+                      self.retry_reads)
+        if client_key in self.clients:
+            return self.clients[client_key]
 
-        remote_address = 'mongodb://{0}:{1}@{2}/thermoCentralDB'.format(self.username, 
+        remote_address = 'mongodb://{0}:{1}@{2}/thermoCentralDB'.format(self.username,
                                                             self.password,
                                                             self.host)
-        client = pymongo.MongoClient(remote_address, 
-                                    self.port, 
-                                    serverSelectionTimeoutMS=2000)
+        client = pymongo.MongoClient(remote_address,
+                                    self.port,
+                                    maxPoolSize=self.max_pool_size,
+                                    serverSelectionTimeoutMS=self.server_selection_timeout_ms,
+                                    connectTimeoutMS=self.connect_timeout_ms,
+                                    socketTimeoutMS=self.socket_timeout_ms,
+                                    retryWrites=self.retry_writes,
+                                    retryReads=self.retry_reads,
+                                    event_listeners=[autoqm.metrics.DatabaseListener()])
         try:
             client.server_info()
             print("\nConnection success to Thermo Central Database!\n")
+            self.clients[client_key] = client
             return client
-        
+
         except (pymongo.errors.ServerSelectionTimeoutError,
                 pymongo.errors.OperationFailure):
             print("\nConnection failure to Thermo Central Database...")
@@ -40,8 +87,103 @@ def connectToTestCentralDatabase():
     tcdi = ThermoCentralDatabaseInterface(host, port, username, password)
     return tcdi
 
-# connect to central database registration table
-auth_info = autoqm.utils.get_TCD_authentication_info()
-tcdi = ThermoCentralDatabaseInterface(*auth_info)
-tcd =  getattr(tcdi.client, 'thermoCentralDB')
-saturated_ringcore_table = getattr(tcd, 'saturated_ringcore_table')
\ No newline at end of file
+def ensure_indexes(registration_table, results_table=None):
+    """
+    Creates indexes for the queries of each stage, which
+    select on status and sort on count and _id, or select
+    on status and archived, look up by aug_inchi, and
+    release leases by lease_token.
+    Existing indexes are kept, so it's safe to call again.
+    """
+    import pymongo
+
+    registration_table.create_index([('aug_inchi', pymongo.ASCENDING)],
+                                    unique=True)
+    registration_table.create_index([('status', pymongo.ASCENDING),
+                                     ('count', pymongo.DESCENDING),
+                                     ('_id', pymongo.DESCENDING)])
+    registration_table.create_index([('status', pymongo.ASCENDING),
+                                     ('archived', pymongo.ASCENDING)])
+    registration_table.create_index([('lease_token', pymongo.ASCENDING)],
+                                    sparse=True)
+
+    if results_table is not None:
+        ensure_results_indexes(results_table)
+
+def ensure_outbox_indexes(outbox_table, ttl_days=7):
+    """
+    Creates the index of outbox table which expires
+    events ttl_days after they're appended. Events are
+    read in _id order, which has its own index.
+    """
+    import pymongo
+
+    outbox_table.create_index([('created', pymongo.ASCENDING)],
+                              expireAfterSeconds=int(ttl_days*24*3600))
+
+def ensure_results_indexes(results_table):
+    """
+    Creates the unique (aug_inchi, level_of_theory) index
+    of results table, which also rejects duplicate results.
+    """
+    import pymongo
+
+    results_table.create_index([('aug_inchi', pymongo.ASCENDING),
+                                ('level_of_theory', pymongo.ASCENDING)],
+                               unique=True)
+
+default_database = None
+default_database_lock = threading.Lock()
+
+def set_default_database(database):
+    """
+    Sets the database all tables of this module resolve to,
+    e.g., an in-memory stand-in for tests. Setting None makes
+    them connect to thermo central database on next use.
+    """
+    global default_database
+    default_database = database
+
+def get_default_database():
+    """
+    Returns the central database, connecting to it on first call
+    with authentication info and connection options in config.
+    """
+    global default_database
+    with default_database_lock:
+        if default_database is None:
+            auth_info = autoqm.utils.get_TCD_authentication_info()
+            connection_options = autoqm.utils.get_TCD_connection_options()
+            tcdi = ThermoCentralDatabaseInterface(*auth_info, **connection_options)
+            if tcdi.client is None:
+                raise Exception('Can not connect to Thermo Central Database.')
+            default_database = getattr(tcdi.client, 'thermoCentralDB')
+
+    return default_database
+
+def get_collection(name):
+
+    return getattr(get_default_database(), name)
+
+class LazyCollection(object):
+    """
+    A table of the central database which is resolved on
+    first use instead of at import.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        if attr == 'name':
+            raise AttributeError(attr)
+        return getattr(get_collection(self.name), attr)
+
+# central database registration table
+saturated_ringcore_table = LazyCollection('saturated_ringcore_table')
+# central database results table
+saturated_ringcore_res_table = LazyCollection('saturated_ringcore_res_table')
+# central database outbox of status transitions
+saturated_ringcore_outbox = LazyCollection('saturated_ringcore_outbox')
+# central database positions of outbox subscribers
+saturated_ringcore_outbox_cursors = LazyCollection('saturated_ringcore_outbox_cursors')
@@ -1,11 +1,18 @@
-import re
 import os
+import tempfile
+import multiprocessing
 from rdkit import Chem
 from rdkit.Chem import AllChem
 
 from rmgpy.molecule import Molecule
 
 import autoqm.utils
+import autoqm.lease
+import autoqm.metrics
+import autoqm.outbox
+from autoqm.writer import BulkUpdateWriter
+from autoqm.geometry_cache import GeometryCache, default_cache_path
+from autoqm.predictor import ResourcePredictor, format_walltime
 from autoqm.connector import saturated_ringcore_table
 
 config = autoqm.utils.read_config()
@@ -21,37 +28,98 @@ def should_create_more_jobs(threshold=150):
 	"""
 	query = {"status":"job_created"}
 
-	num_job_created = saturated_ringcore_table.find(query).count()
+	num_job_created = saturated_ringcore_table.find(query, {"_id": 1}).count()
 
 	return (num_job_created < threshold)
 
-def select_run_target(limit=100):
+def select_run_target(limit=100, claim=None):
 	"""
 	This method is to inform job creator which targets 
 	to run.
 
+	If a LeaseClaim is given, targets are leased to this
+	worker, so other creators don't select them.
+
 	Returns a list of targets with necessary meta data
 	"""
 	query = {"status":"pending"}
+	projection = {"aug_inchi": 1, "SMILES_input": 1}
 	sort_key = [('count', -1), ('_id', -1)]
 
-	top_ringcores = list(saturated_ringcore_table.find(query).sort(sort_key).limit(limit))
+	if claim is not None:
+		return claim.claim(query, projection, sort_key, limit)
+
+	top_ringcores = list(saturated_ringcore_table.find(query, projection).sort(sort_key).limit(limit))
 
 	return top_ringcores
 
-def generate_input_from_smiles(smiles, 
-								spec_name,
-								spec_path, 
-								memory='1500mb', 
-								procs_num='32', 
-								level_theory='um062x/cc-pvtz'):
+def has_same_connectivity(mol, conformer_id, tolerance=1.25):
 	"""
-	This method writes quantum mechanics input file, given
-	smiles and species name.
+	This method checks if atoms of a conformer bonded by
+	distance, i.e., closer than tolerance times the sum of
+	their covalent radii, are exactly the bonded atoms of mol.
+	"""
+	periodic_table = Chem.GetPeriodicTable()
+	radii = [periodic_table.GetRcovalent(atom.GetAtomicNum()) for atom in mol.GetAtoms()]
+	positions = mol.GetConformer(conformer_id).GetPositions()
 
-	Currently only support Gaussian format.
+	bonds = set()
+	for bond in mol.GetBonds():
+		bonds.add(tuple(sorted((bond.GetBeginAtomIdx(), bond.GetEndAtomIdx()))))
+
+	atom_count = mol.GetNumAtoms()
+	for i in range(atom_count):
+		for j in range(i + 1, atom_count):
+			distance = sum((positions[i][k] - positions[j][k])**2 for k in range(3))**0.5
+			bonded = distance < tolerance*(radii[i] + radii[j])
+			if bonded != ((i, j) in bonds):
+				return False
+
+	return True
+
+def search_conformers(mol3d, conformer_count, num_threads=0, random_seed=0xf00d):
+	"""
+	This method embeds conformer_count conformers with ETKDG
+	and optimizes them with MMFF, or UFF if MMFF has no
+	parameters for the molecule, both using num_threads
+	threads (0 means all cores).
+
+	Returns id of the lowest energy conformer keeping
+	the connectivity of mol3d, or None if there's no such one
+	"""
+	params = AllChem.ETKDG()
+	params.randomSeed = random_seed
+	params.numThreads = num_threads
+	conformer_ids = list(AllChem.EmbedMultipleConfs(mol3d, conformer_count, params))
+	if not conformer_ids:
+		return None
+
+	# results are (not converged flag, energy) per conformer
+	if AllChem.MMFFHasAllMoleculeParams(mol3d):
+		results = AllChem.MMFFOptimizeMoleculeConfs(mol3d, numThreads=num_threads)
+	else:
+		results = AllChem.UFFOptimizeMoleculeConfs(mol3d, numThreads=num_threads)
+
+	energies = sorted((energy, conformer_id) 
+					for conformer_id, (not_converged, energy) in zip(conformer_ids, results))
+	for energy, conformer_id in energies:
+		if has_same_connectivity(mol3d, conformer_id):
+			return conformer_id
+
+	return None
+
+def generate_geometry(smiles, conformer_count=1, conformer_threads=0):
+	"""
+	This method generates the input geometry given smiles.
+
+	If conformer_count is larger than 1, the geometry is
+	the lowest energy one of that many conformers which still
+	has the input connectivity, otherwise one UFF optimized
+	conformer.
+
+	Returns a dictionary with mol block of the geometry and
+	input body, i.e., charge, multiplicity and coordinates
 	"""
-	
 	input_string = ""
 	# calculate charge and multiplicity
 	rmg_mol = Molecule().fromSMILES(smiles)
@@ -63,26 +131,74 @@ def generate_input_from_smiles(smiles,
 
 	# optimze geometry a little bit
 	mol3d = Chem.AddHs(mol2d)
-	AllChem.EmbedMolecule(mol3d)
-	AllChem.UFFOptimizeMolecule(mol3d) 
+	conformer_id = None
+	if conformer_count > 1:
+		conformer_id = search_conformers(mol3d, conformer_count, conformer_threads)
 
-	# save mol files
-	mol_file_path = os.path.join(spec_path, 'input.mol')
-	with open(mol_file_path, 'w') as mol_file:
-		mol_file.write(Chem.MolToMolBlock(mol3d))
+	if conformer_id is None:
+		mol3d.RemoveAllConformers()
+		AllChem.EmbedMolecule(mol3d)
+		AllChem.UFFOptimizeMolecule(mol3d) 
+		conformer_id = -1
 
-	# parse the mol files to get xyz coordinates
+	mol_block = Chem.MolToMolBlock(mol3d, confId=conformer_id)
+
+	# get xyz coordinates from the conformer
 	xyz_coord = []
-	atomline = re.compile('\s*([\- ][0-9.]+\s+[\-0-9.]+\s+[\-0-9.]+)\s+([A-Za-z]+)')
-	with open(mol_file_path, 'r') as mol_file:
-		for line in mol_file:
-			match = atomline.match(line)
-			if match:
-				xyz_coord.append("{0:8s} {1}".format(match.group(2), match.group(1)))
+	conformer = mol3d.GetConformer(conformer_id)
+	for atom in mol3d.GetAtoms():
+		position = conformer.GetAtomPosition(atom.GetIdx())
+		xyz_coord.append("{0:8s} {1:10.4f}{2:10.4f}{3:10.4f}".format(atom.GetSymbol(), 
+																	position.x, 
+																	position.y, 
+																	position.z))
 
 	xyz_coord.append('')
 	input_string += '\n'.join(xyz_coord)
 
+	geometry = {
+		'mol_block': mol_block,
+		'input_body': input_string
+	}
+
+	return geometry
+
+def generate_input_from_smiles(smiles, 
+								spec_name,
+								spec_path, 
+								memory='1500mb', 
+								procs_num='32', 
+								level_theory='um062x/cc-pvtz',
+								conformer_count=1,
+								conformer_threads=0,
+								geometry_cache=None):
+	"""
+	This method writes quantum mechanics input file, given
+	smiles and species name, see generate_geometry for
+	how the geometry is generated.
+
+	If a GeometryCache is given, the geometry is read from
+	it when the species was generated before with the same
+	smiles and conformer_count, otherwise saved to it.
+
+	Currently only support Gaussian format.
+	"""
+	geometry = None
+	if geometry_cache is not None:
+		aug_inchi = spec_name.replace('_slash_', '/')
+		cache_key = geometry_cache.get_key(aug_inchi, smiles, conformer_count)
+		geometry = geometry_cache.load(cache_key)
+
+	if geometry is None:
+		geometry = generate_geometry(smiles, conformer_count, conformer_threads)
+		if geometry_cache is not None:
+			geometry_cache.save(cache_key, geometry)
+
+	# save mol files
+	mol_file_path = os.path.join(spec_path, 'input.mol')
+	with open(mol_file_path, 'w') as mol_file:
+		mol_file.write(geometry['mol_block'])
+
 	# start writing with qm input head
 	qm_input_head_string = """%%chk=check.chk
 %%mem=%s
@@ -94,7 +210,7 @@ def generate_input_from_smiles(smiles,
 	with open(inp_file, 'w+') as fout:
 		fout.write(qm_input_head_string)
 		fout.write('\n\n' + spec_name + '\n\n')
-		fout.writelines(input_string)
+		fout.writelines(geometry['input_body'])
 		fout.write('\n')
 
 def generate_submission_script(spec_name,
@@ -118,53 +234,309 @@ def generate_submission_script(spec_name,
 		fout.write('\nmodule load {0}\n\n'.format(software))
 		fout.write('{0} '.format(software) + 'input.inp' + '\n')
 
-def create_jobs(limit, partition):
+def generate_pack_script(pack_path,
+						spec_paths,
+						partition,
+						nodes_num='1',
+						walltime='2:00:00',
+						software='g09'):
+	"""
+	This method writes a submission script that runs
+	the jobs of several small molecules concurrently
+	in one allocation, each one in its own job folder
+	with output in out.log there, so the pack folder
+	isn't needed once the script is submitted.
+	"""
+	pack_name = os.path.basename(pack_path)
+	qm_submission_head_string = """#!/bin/bash -l
+#SBATCH -p %s
+#SBATCH -N %s
+#SBATCH -t %s
+#SBATCH -J %s
+#SBATCH -C haswell
+#SBATCH -o /dev/null\n""" % (partition, nodes_num, walltime, pack_name)
+
+	submission_script_path = os.path.join(pack_path, 'submit.sl')
+	with open(submission_script_path, 'w+') as fout:
+		fout.write(qm_submission_head_string)
+		fout.write('\nmodule load {0}\n\n'.format(software))
+		for spec_path in spec_paths:
+			fout.write('(cd "{0}" && {1} input.inp > out.log 2>&1) &\n'.format(os.path.abspath(spec_path), 
+																		software))
+		fout.write('wait\n')
+
+def create_job(job_args):
+	"""
+	This method creates input and submission files for
+	one target, it's used as the worker of parallel creation.
+
+	Returns aug_inchi of the target and whether the files
+	are created indeed
+	"""
+	(smiles, aug_inchi, data_path, partition, level_theory, 
+		memory, procs_num, walltime, conformer_count, conformer_threads, 
+		geometry_cache) = job_args
+	spec_name = aug_inchi.replace('/', '_slash_')
+	spec_path = os.path.join(data_path, spec_name)
+
+	if not os.path.exists(spec_path):
+		os.mkdir(spec_path)
+
+	# generate qm job input file
+	try:
+		generate_input_from_smiles(smiles, spec_name, spec_path, 
+									memory=memory,
+									procs_num=procs_num,
+									level_theory=level_theory,
+									conformer_count=conformer_count,
+									conformer_threads=conformer_threads,
+									geometry_cache=geometry_cache)
+	except RuntimeError:
+		print('RuntimeError when creating inputs for {}.'.format(smiles))
+		return aug_inchi, False
+
+	# generate qm job submission file
+	generate_submission_script(spec_name, spec_path, partition, walltime=walltime)
+
+	# check input and submission files 
+	# are created indeed
+	inp_file = os.path.join(spec_path, 'input.inp')
+	submission_script_path = os.path.join(spec_path, 'submit.sl')
+	created = os.path.exists(inp_file) and os.path.exists(submission_script_path)
+
+	return aug_inchi, created
+
+def get_heavy_atom_count(smiles):
 
+	mol = Chem.MolFromSmiles(smiles)
+	if mol is None:
+		return None
+	return mol.GetNumHeavyAtoms()
+
+def create_job_packs(packed_aug_inchis, data_path, partition, pack_size, walltime_hours=None):
+	"""
+	This method groups created jobs of small molecules into
+	packs of pack_size, and writes a pack submission script
+	under data_path/job_packs for each pack.
+
+	If walltime_hours of members are given by aug_inchi,
+	each pack asks for the longest of its members.
+
+	Returns a dictionary of pack_id by aug_inchi
+	"""
+	if not packed_aug_inchis:
+		return {}
+
+	packs_path = os.path.join(data_path, 'job_packs')
+	if not os.path.exists(packs_path):
+		os.mkdir(packs_path)
+
+	pack_ids = {}
+	for i in range(0, len(packed_aug_inchis), pack_size):
+		pack_aug_inchis = packed_aug_inchis[i:i+pack_size]
+		spec_paths = [os.path.join(data_path, aug_inchi.replace('/', '_slash_'))
+					for aug_inchi in pack_aug_inchis]
+
+		walltime = '2:00:00'
+		if walltime_hours:
+			walltime = format_walltime(max(walltime_hours[aug_inchi] 
+											for aug_inchi in pack_aug_inchis))
+
+		pack_path = tempfile.mkdtemp(prefix='pack_', dir=packs_path)
+		generate_pack_script(pack_path, spec_paths, partition, walltime=walltime)
+
+		pack_id = os.path.basename(pack_path)
+		with open(os.path.join(pack_path, 'members.txt'), 'w+') as fout:
+			for aug_inchi in pack_aug_inchis:
+				fout.write(aug_inchi + '\n')
+				pack_ids[aug_inchi] = pack_id
+
+	return pack_ids
+
+def create_jobs(limit, 
+				partition, 
+				processes=1, 
+				level_theory='um062x/cc-pvtz',
+				pack_size=1,
+				pack_max_heavy_atoms=8,
+				node_memory_mb=1500,
+				node_procs_num=32,
+				predictor=None,
+				conformer_count=1,
+				claim=None,
+				geometry_cache=None):
+	"""
+	This method creates jobs with following steps:
+	1. select targets to run
+	2. generate input and submission files, with a pool
+	   of worker processes if processes is not 1 (0 means
+	   one process per core)
+	3. change the status of created ones to job_created
+	   and keep their level of theory
+
+	If pack_size is larger than 1, molecules with at most
+	pack_max_heavy_atoms heavy atoms share one node pack_size
+	at a time, each with its share of cores and memory, and
+	are marked with the pack_id of their pack.
+
+	If a ResourcePredictor is given, walltime, processors and
+	memory of unpacked jobs are predicted from heavy atom count,
+	and so is walltime of packs, once it has fitted at least two
+	jobs; until then the fixed resources are used.
+
+	If conformer_count is larger than 1, input geometries
+	come from a conformer search of that many conformers,
+	using all cores unless jobs are created in parallel.
+
+	If a LeaseClaim is given, targets are claimed with it
+	so several creators can run at the same time.
+
+	If a GeometryCache is given, geometries generated before
+	are reused, and the cache is trimmed after each run.
+	"""
 	if not should_create_more_jobs(threshold=200):
 		return
 
 	# select target to run
-	targets = select_run_target(limit)
+	targets = select_run_target(limit, claim)
 
 	# generate qm jobs
 	data_path = config['QuantumMechanicJob']['data_path']
 	if not os.path.exists(data_path):
 		os.mkdir(data_path)
+
+	job_args_list = []
+	packed_aug_inchis = set()
+	walltime_hours = {}
 	for target in targets:
 		smiles = str(target['SMILES_input'])
 		aug_inchi = str(target['aug_inchi'])
-		spec_name = aug_inchi.replace('/', '_slash_')
-		spec_path = os.path.join(data_path, spec_name)
-
-		if not os.path.exists(spec_path):
-			os.mkdir(spec_path)
-
-		# generate qm job input file
-		try:
-			generate_input_from_smiles(smiles, spec_name, spec_path)
-		except RuntimeError:
-			print('RuntimeError when creating inputs for {}.'.format(smiles))
-			continue
-
-		# generate qm job submission file
-		generate_submission_script(spec_name, spec_path, partition)
-
-		# check input and submission files 
-		# are created indeed and
-		# change the status to job_created
-		inp_file = os.path.join(spec_path, 'input.inp')
-		submission_script_path = os.path.join(spec_path, 'submit.sl')
-		if os.path.exists(inp_file) and os.path.exists(submission_script_path):
-			print('Input and submission files are created for {}.'.format(aug_inchi))
-			query = {"aug_inchi": aug_inchi}
-			update_field = {
-				'status': "job_created"
-			}
-
-			saturated_ringcore_table.update_one(query, {"$set": update_field}, True)
-		else:
-			print('Input and submission file generation fails: {}.'.format(aug_inchi))
-
-limit = int(config['QuantumMechanicJob']['limit_per_creation'])
-create_jobs(limit=limit, partition='regularx')
-
+		memory = '{0}mb'.format(node_memory_mb)
+		procs_num = str(node_procs_num)
+		walltime = '2:00:00'
+
+		heavy_atom_count = None
+		if pack_size > 1 or predictor is not None:
+			heavy_atom_count = get_heavy_atom_count(smiles)
+
+		if pack_size > 1 and heavy_atom_count is not None and heavy_atom_count <= pack_max_heavy_atoms:
+			memory = '{0}mb'.format(node_memory_mb // pack_size)
+			procs_num = str(node_procs_num // pack_size)
+			packed_aug_inchis.add(aug_inchi)
+			if predictor is not None:
+				walltime_hours[aug_inchi] = predictor.predict_walltime_hours(heavy_atom_count, 
+																			node_procs_num // pack_size)
+		elif predictor is not None and heavy_atom_count is not None:
+			predicted_resources = predictor.predict_resources(heavy_atom_count)
+			if predicted_resources is not None:
+				walltime, procs_num, memory = predicted_resources
+
+		job_args_list.append((smiles, 
+							aug_inchi, 
+							data_path, 
+							partition,
+							level_theory,
+							memory,
+							procs_num,
+							walltime,
+							conformer_count,
+							0 if processes == 1 else 1,
+							geometry_cache))
+
+	level_of_theory = autoqm.utils.standardize_level_of_theory(level_theory)
+
+	pool = None
+	if processes == 1:
+		results = (create_job(job_args) for job_args in job_args_list)
+	else:
+		pool = multiprocessing.Pool(processes=(processes or None))
+		results = pool.imap_unordered(create_job, job_args_list)
+
+	try:
+		with BulkUpdateWriter(saturated_ringcore_table,
+							outbox_table=autoqm.outbox.get_outbox_table()) as writer:
+			created_packed_aug_inchis = []
+			for aug_inchi, created in results:
+				# change the status to job_created
+				if created:
+					print('Input and submission files are created for {}.'.format(aug_inchi))
+					autoqm.metrics.add_processed(1)
+					if aug_inchi in packed_aug_inchis:
+						# updated once its pack is ready
+						created_packed_aug_inchis.append(aug_inchi)
+						continue
+
+					# a molecule packed before and re-created
+					# unpacked is launched on its own
+					query = {"aug_inchi": aug_inchi}
+					update_field = {
+						'status': "job_created",
+						'level_of_theory': level_of_theory,
+						'pack_id': None
+					}
+
+					writer.update(query, update_field)
+				else:
+					print('Input and submission file generation fails: {}.'.format(aug_inchi))
+
+			pack_ids = create_job_packs(created_packed_aug_inchis, 
+										data_path, 
+										partition, 
+										pack_size,
+										walltime_hours)
+			for aug_inchi, pack_id in pack_ids.items():
+				query = {"aug_inchi": aug_inchi}
+				update_field = {
+					'status': "job_created",
+					'level_of_theory': level_of_theory,
+					'pack_id': pack_id
+				}
+
+				writer.update(query, update_field)
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	if geometry_cache is not None:
+		removed_count = geometry_cache.evict()
+		if removed_count:
+			print('Evicted {0} geometries from cache.'.format(removed_count))
+
+def run():
+
+	limit = int(config['QuantumMechanicJob']['limit_per_creation'])
+	processes = int(config['QuantumMechanicJob'].get('creator_processes', 1))
+	pack_size = int(config['QuantumMechanicJob'].get('pack_size', 1))
+	pack_max_heavy_atoms = int(config['QuantumMechanicJob'].get('pack_max_heavy_atoms', 8))
+	conformer_count = int(config['QuantumMechanicJob'].get('conformer_count', 1))
+
+	# predict job resources only if a model is configured,
+	# e.g., resource_model_path: /scratch/autoqm/resource_model.json
+	predictor = None
+	resource_model_path = config['QuantumMechanicJob'].get('resource_model_path', None)
+	if resource_model_path:
+		predictor = ResourcePredictor(resource_model_path)
+
+	# geometries are cached on local disk unless
+	# geometry_cache_path is set to none
+	geometry_cache = None
+	geometry_cache_path = config['QuantumMechanicJob'].get('geometry_cache_path', default_cache_path)
+	if geometry_cache_path.lower() != 'none':
+		geometry_cache_max_mb = float(config['QuantumMechanicJob'].get('geometry_cache_max_mb', 1024))
+		geometry_cache = GeometryCache(geometry_cache_path, max_size_mb=geometry_cache_max_mb)
+
+	with autoqm.metrics.stage_run('creator'), \
+		autoqm.lease.get_claim(saturated_ringcore_table) as claim:
+		create_jobs(limit=limit, 
+					partition='regularx', 
+					processes=processes,
+					pack_size=pack_size,
+					pack_max_heavy_atoms=pack_max_heavy_atoms,
+					predictor=predictor,
+					conformer_count=conformer_count,
+					claim=claim,
+					geometry_cache=geometry_cache)
+
+if __name__ == '__main__':
+	run()
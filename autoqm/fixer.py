@@ -1,42 +1,389 @@
-
 # connect to registration table
 
 # search targets to push
-# 1. get target jobs with "job_failed_convergence" 
+# 1. get target jobs with "job_failed_convergence"
 # 2. check if job files are in scratch archive
 # 3. move files to workspace
-# 4. rename old input file to *.bak, 
+# 4. rename old input file to *.bak,
 #    create new input file
-# 5. change job status to 
+# 5. change job status to
 #    "job_recreated_for_convergence"
 
 import os
+import re
+import mmap
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+import autoqm.utils
+import autoqm.packer
+import autoqm.indexer
+import autoqm.metrics
+import autoqm.outbox
+import autoqm.archiver
+from autoqm.writer import BulkUpdateWriter
+from autoqm.predictor import format_walltime
 
 def select_fixer_target(registration_table,
 						failed_convergence_data_path,
-						limit=100):
+						limit=100,
+						max_attempts=None):
 	"""
-	This method is to inform job fixer which targets 
+	This method is to inform job fixer which targets
 	to fix, which need meet two requirements:
 	1. status is job_failed_convergence
-	2. job files (.chk, .inp and .sl) located as expected
+	2. job files (.chk, .inp and .sl) located as expected,
+	   either in job folder or in its container
+
+	If max_attempts is given, jobs fixed that many
+	times already are left as they are.
 
 	Returns a list of targets with necessary meta data
 	"""
 
 	reg_query = {"status":"job_failed_convergence"}
+	if max_attempts is not None:
+		reg_query["fix_attempts"] = {"$not": {"$gte": max_attempts}}
+	reg_projection = {"aug_inchi": 1, "fix_attempts": 1}
 	sort_key = [('count', -1), ('_id', -1)]
 
-	targets = list(registration_table.find(reg_query).sort(sort_key).limit(limit))
+	targets = list(registration_table.find(reg_query, reg_projection).sort(sort_key).limit(limit))
 
 	selected_targets = []
+	job_index = autoqm.indexer.JobIndex(failed_convergence_data_path)
 	for target in targets:
 		aug_inchi = str(target['aug_inchi'])
 		spec_name = aug_inchi.replace('/', '_slash_')
-		spec_path = os.path.join(failed_convergence_data_path, spec_name)
-		chk_path = os.path.join(spec_path, 'check.chk')
-		inp_path = os.path.join(spec_path, 'input.inp')
-		submission_path = os.path.join(spec_path, 'submit.sl')
-		if os.path.exists(chk_path) and os.path.exists(inp_path) and os.path.exists(submission_path):
+		if job_index.has_job_files(spec_name, ['check.chk', 'input.inp', 'submit.sl']):
 			selected_targets.append(target)
 	return selected_targets
+
+def stage_job_folder(stage_task):
+	"""
+	This method moves one archived job, either a folder
+	or a container, back to the workspace, it's used as
+	the worker of fixer thread pool.
+
+	Returns aug_inchi of the job and error message
+	if the move fails
+	"""
+	aug_inchi, scratch_spec_path, spec_path = stage_task
+	try:
+		if os.path.exists(spec_path):
+			raise OSError('{0} already exists.'.format(spec_path))
+
+		if os.path.isdir(scratch_spec_path):
+			autoqm.archiver.move_job_folder(scratch_spec_path, spec_path)
+		else:
+			container_path = autoqm.packer.get_container_path(scratch_spec_path)
+			autoqm.packer.unpack_job_folder(container_path, spec_path)
+		return aug_inchi, None
+	except (IOError, OSError) as e:
+		return aug_inchi, str(e)
+
+def is_opt_converged(log_path):
+	"""
+	This method checks if the opt step of a gaussian
+	opt freq job has finished, i.e., the log has a
+	"Normal termination" anywhere, the first one
+	being written when opt finishes.
+	"""
+	if not os.path.exists(log_path) or os.path.getsize(log_path) == 0:
+		return False
+
+	with open(log_path, 'rb') as f_in:
+		log_map = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			return log_map.find(b'Normal termination') != -1
+		finally:
+			log_map.close()
+
+def get_backup_path(file_path, attempt):
+
+	return '{0}.{1}.bak'.format(file_path, attempt)
+
+def get_input_sections(lines):
+	"""
+	This method splits lines of a gaussian input into
+	sections separated by blank lines, i.e., link 0 and
+	route, title, and charge, multiplicity and geometry.
+
+	Returns a list of sections, each a list of lines
+	"""
+	sections = [[]]
+	for line in lines:
+		if line.strip():
+			sections[-1].append(line)
+		elif sections[-1]:
+			sections.append([])
+	return [section for section in sections if section]
+
+def parse_input(lines):
+	"""
+	This method parses lines of a gaussian input.
+
+	Returns link 0 lines, level of theory of the route,
+	title lines and the charge and multiplicity line
+	"""
+	sections = get_input_sections(lines)
+	if len(sections) < 3:
+		raise ValueError('Input has no title or charge and multiplicity section.')
+
+	# route may continue over several lines
+	link0_and_route = sections[0]
+	route_indices = [i for i, line in enumerate(link0_and_route) if line.startswith('#')]
+	if not route_indices:
+		raise ValueError('Input has no route.')
+	link0_lines = [line for line in link0_and_route[:route_indices[0]] if line.startswith('%')]
+	route_tokens = ' '.join(link0_and_route[route_indices[0]:]).split()
+	level_theory = route_tokens[-1]
+	for token in route_tokens:
+		if '/' in token:
+			level_theory = token
+
+	title_lines = sections[1]
+	charge_mult = sections[2][0]
+
+	return link0_lines, level_theory, title_lines, charge_mult
+
+def get_restart_input(lines, freq_only=False):
+	"""
+	This method builds an input restarting from check.chk,
+	i.e., with geom=check guess=read and no geometry, and
+	with only freq if opt has converged, from lines of the
+	old input.
+
+	Returns content of the new input
+	"""
+	link0_lines, level_theory, title_lines, charge_mult = parse_input(lines)
+
+	if freq_only:
+		route = '# freq {0} geom=check guess=read'.format(level_theory)
+	else:
+		route = '# opt freq {0} geom=check guess=read'.format(level_theory)
+
+	return '\n'.join(link0_lines + [route, ''] + title_lines + ['', charge_mult, '', ''])
+
+def replace_file(file_path, content, backup_path=None):
+	"""
+	This method writes content to a temporary file next
+	to file_path, then renames it to file_path, after
+	renaming the old file to backup_path if given.
+	"""
+	fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.tmp')
+	try:
+		with os.fdopen(fd, 'w') as f_out:
+			f_out.write(content)
+		os.chmod(tmp_path, 0o644)
+		if backup_path is not None:
+			os.rename(file_path, backup_path)
+		os.rename(tmp_path, file_path)
+	except (IOError, OSError):
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+def parse_walltime_hours(walltime):
+	"""
+	This method converts slurm walltime, i.e., minutes,
+	minutes:seconds, hours:minutes:seconds, days-hours,
+	days-hours:minutes or days-hours:minutes:seconds, to hours.
+	"""
+	days = 0
+	if '-' in walltime:
+		days, walltime = walltime.split('-')
+		tokens = [int(token) for token in walltime.split(':')]
+		hours, minutes, seconds = tokens + [0]*(3 - len(tokens))
+	else:
+		tokens = [int(token) for token in walltime.split(':')]
+		if len(tokens) == 3:
+			hours, minutes, seconds = tokens
+		elif len(tokens) == 2:
+			hours, minutes, seconds = 0, tokens[0], tokens[1]
+		else:
+			hours, minutes, seconds = 0, tokens[0], 0
+
+	return int(days)*24 + hours + minutes/60.0 + seconds/3600.0
+
+def escalate_walltime(spec_path, walltime_factor=2.0, max_walltime_hours=48.0):
+	"""
+	This method multiplies the walltime in submit.sl
+	by walltime_factor, up to max_walltime_hours.
+
+	Returns the new walltime
+	"""
+	submission_script_path = os.path.join(spec_path, 'submit.sl')
+	with open(submission_script_path, 'r') as f_in:
+		content = f_in.read()
+
+	match = re.search(r'^#SBATCH -t (\S+)$', content, re.MULTILINE)
+	if match is None:
+		return None
+
+	hours = parse_walltime_hours(match.group(1))
+	walltime = format_walltime(min(hours*walltime_factor, max_walltime_hours))
+
+	content = content[:match.start(1)] + walltime + content[match.end(1):]
+	replace_file(submission_script_path, content)
+
+	return walltime
+
+def fix_job(spec_path, attempt, walltime_factor=2.0, max_walltime_hours=48.0):
+	"""
+	This method prepares a staged job folder for restart:
+	1. check if opt has converged in the old log
+	2. build the restart input, before changing any file
+	3. back up old log, and old input replaced by the
+	   restart input
+	4. escalate walltime of submission script
+
+	Returns level of theory of the job, standardized
+	as in registration table
+	"""
+	log_path = os.path.join(spec_path, 'input.log')
+	freq_only = is_opt_converged(log_path)
+
+	inp_path = os.path.join(spec_path, 'input.inp')
+	with open(inp_path, 'r') as f_in:
+		lines = f_in.read().splitlines()
+	restart_input = get_restart_input(lines, freq_only=freq_only)
+	level_of_theory = autoqm.utils.standardize_level_of_theory(parse_input(lines)[1])
+
+	# old log should not be taken as
+	# the result of the restarted job
+	if os.path.exists(log_path):
+		os.rename(log_path, get_backup_path(log_path, attempt))
+
+	replace_file(inp_path, restart_input, backup_path=get_backup_path(inp_path, attempt))
+	escalate_walltime(spec_path, walltime_factor, max_walltime_hours)
+
+	return level_of_theory
+
+def restore_job_folder(aug_inchi, spec_path, scratch_spec_path, attempt, writer):
+	"""
+	This method moves a job which can't be fixed back to
+	scratch_spec_path, counting the attempt so it's tried at
+	most max_attempts times. If the move fails, the job is
+	marked as not archived, so archiver moves it back.
+	"""
+	query = {"aug_inchi": aug_inchi}
+	update_field = {'fix_attempts': attempt}
+	try:
+		autoqm.archiver.move_job_folder(spec_path, scratch_spec_path)
+	except (IOError, OSError) as e:
+		print("Moving back fails for {0}: {1}".format(aug_inchi, e))
+		update_field['archived'] = "No"
+
+	writer.update(query, update_field)
+
+def fix_jobs(registration_table,
+			failed_convergence_data_path,
+			data_path,
+			limit=100,
+			max_attempts=3,
+			walltime_factor=2.0,
+			max_walltime_hours=48.0,
+			threads=4):
+	"""
+	This method fixes jobs with following steps:
+	1. select jobs failing convergence, fixed fewer
+	   than max_attempts times
+	2. move their folders back to data_path, in a pool
+	   of threads
+	3. restart each from its checkpoint with more walltime,
+	   moving the folder back if it can't be fixed
+	4. change status to job_recreated_for_convergence
+	"""
+	# 1. select jobs to fix
+	targets = select_fixer_target(registration_table,
+								failed_convergence_data_path,
+								limit=limit,
+								max_attempts=max_attempts)
+
+	stage_tasks = []
+	attempts = {}
+	scratch_spec_paths = {}
+	for target in targets:
+		aug_inchi = str(target['aug_inchi'])
+		spec_name = aug_inchi.replace('/', '_slash_')
+		scratch_spec_path = os.path.join(failed_convergence_data_path, spec_name)
+		spec_path = os.path.join(data_path, spec_name)
+
+		stage_tasks.append((aug_inchi, scratch_spec_path, spec_path))
+		scratch_spec_paths[aug_inchi] = scratch_spec_path
+		attempts[aug_inchi] = int(target.get('fix_attempts', 0)) + 1
+
+	# 2. move job folders back
+	fix_count = 0
+	pool = ThreadPool(threads)
+	try:
+		with BulkUpdateWriter(registration_table,
+							outbox_table=autoqm.outbox.get_outbox_table()) as writer:
+			for aug_inchi, error in pool.imap_unordered(stage_job_folder, stage_tasks):
+				if error is not None:
+					print("Staging fails for {0}: {1}".format(aug_inchi, error))
+					continue
+
+				# 3. restart from checkpoint
+				spec_name = aug_inchi.replace('/', '_slash_')
+				spec_path = os.path.join(data_path, spec_name)
+				try:
+					level_of_theory = fix_job(spec_path,
+											attempts[aug_inchi],
+											walltime_factor=walltime_factor,
+											max_walltime_hours=max_walltime_hours)
+				except (IOError, OSError, IndexError, KeyError, ValueError) as e:
+					print("Fixing fails for {0}: {1}".format(aug_inchi, e))
+					restore_job_folder(aug_inchi,
+									spec_path,
+									scratch_spec_paths[aug_inchi],
+									attempts[aug_inchi],
+									writer)
+					continue
+
+				fix_count += 1
+
+				# 4. change status, the job is
+				# launched on its own from now on, with
+				# level of theory saved for pusher
+				query = {"aug_inchi": aug_inchi}
+				update_field = {
+					'status': "job_recreated_for_convergence",
+					'level_of_theory': level_of_theory,
+					'fix_attempts': attempts[aug_inchi],
+					'archived': "No",
+					'pack_id': None
+				}
+
+				writer.update(query, update_field)
+	finally:
+		pool.close()
+		pool.join()
+
+	print("Fixed {0} jobs.".format(fix_count))
+	autoqm.metrics.add_processed(fix_count)
+
+def run():
+
+	import autoqm.connector
+
+	# get config info
+	config = autoqm.utils.read_config()
+	qm_config = config['QuantumMechanicJob']
+
+	registration_table = autoqm.connector.get_collection('saturated_ringcore_table')
+	failed_convergence_data_path = os.path.join(qm_config['scratch_data_path'],
+												'failed_convergence')
+
+	with autoqm.metrics.stage_run('fixer'):
+		fix_jobs(registration_table,
+				failed_convergence_data_path,
+				qm_config['data_path'],
+				limit=int(qm_config.get('limit_per_fix', 100)),
+				max_attempts=int(qm_config.get('fix_attempts', 3)),
+				walltime_factor=float(qm_config.get('fix_walltime_factor', 2.0)),
+				max_walltime_hours=float(qm_config.get('fix_max_walltime_hours', 48.0)),
+				threads=int(qm_config.get('fixer_threads', 4)))
+
+if __name__ == '__main__':
+	run()
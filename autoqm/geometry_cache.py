@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import errno
+import hashlib
+import tempfile
+
+# bump when embedding or optimization of input
+# geometries changes, so older entries are not used
+geometry_version = 1
+
+# the cache is on local disk of each node by default,
+# as creators read and write it for every molecule
+default_cache_path = os.path.join(tempfile.gettempdir(), 'autoqm_geometry_cache')
+
+# temporary files older than this are left
+# by crashed writers, and removed by evict
+tmp_max_age_seconds = 3600
+
+class GeometryCache(object):
+	"""
+	A class for keeping generated geometries of creator on
+	local disk, one JSON file per key, i.e., sha1 of aug_inchi,
+	SMILES and embedding parameters. Each entry has the mol
+	block of the input geometry and the charge, multiplicity
+	and coordinates section of input.inp.
+
+	Entries are written through temporary files renamed in
+	place, so all creator processes can share one cache. Reading
+	an entry refreshes its mtime, and evict removes entries
+	least recently used until the cache fits in max_size_mb.
+
+	The cache is best effort: an entry which can't be read
+	or written is reported and the geometry generated again.
+	"""
+
+	def __init__(self, cache_path, max_size_mb=1024):
+		self.cache_path = cache_path
+		self.max_size_mb = max_size_mb
+
+	def get_key(self, aug_inchi, smiles, conformer_count=1):
+
+		key_string = json.dumps([geometry_version, aug_inchi, smiles, conformer_count])
+		return hashlib.sha1(key_string.encode('utf-8')).hexdigest()
+
+	def get_entry_path(self, key):
+
+		return os.path.join(self.cache_path, key + '.json')
+
+	def load(self, key):
+		"""
+		Returns the entry of key, or None if
+		it's not cached or can't be read
+		"""
+		entry_path = self.get_entry_path(key)
+		try:
+			with open(entry_path, 'r') as f_in:
+				entry = json.load(f_in)
+			os.utime(entry_path, None)
+		except (IOError, OSError) as e:
+			if e.errno != errno.ENOENT:
+				print('Reading geometry cache entry {0} fails: {1}'.format(key, e))
+			return None
+		except ValueError as e:
+			print('Reading geometry cache entry {0} fails: {1}'.format(key, e))
+			return None
+
+		return entry
+
+	def save(self, key, entry):
+		"""
+		This method writes entry of key, reporting
+		instead of raising if it can't be written.
+		"""
+		tmp_path = None
+		try:
+			if not os.path.exists(self.cache_path):
+				try:
+					os.makedirs(self.cache_path)
+				except OSError:
+					# created by another process meanwhile
+					if not os.path.isdir(self.cache_path):
+						raise
+
+			# write to a temporary file first so other
+			# processes never read a partial entry
+			fd, tmp_path = tempfile.mkstemp(dir=self.cache_path, suffix='.tmp')
+			with os.fdopen(fd, 'w') as f_out:
+				json.dump(entry, f_out)
+			os.rename(tmp_path, self.get_entry_path(key))
+		except (IOError, OSError) as e:
+			print('Saving geometry cache entry {0} fails: {1}'.format(key, e))
+			if tmp_path is not None and os.path.exists(tmp_path):
+				try:
+					os.remove(tmp_path)
+				except OSError:
+					pass
+
+	def evict(self):
+		"""
+		This method removes temporary files left by crashed
+		writers, then least recently used entries until total
+		size, temporary files being written included, is at
+		most max_size_mb.
+
+		Returns number of entries removed
+		"""
+		if not os.path.isdir(self.cache_path):
+			return 0
+
+		entries = []
+		total_size = 0
+		now = time.time()
+		for file_name in os.listdir(self.cache_path):
+			entry_path = os.path.join(self.cache_path, file_name)
+			try:
+				entry_stat = os.stat(entry_path)
+				if file_name.endswith('.tmp') and now - entry_stat.st_mtime > tmp_max_age_seconds:
+					os.remove(entry_path)
+					continue
+			except OSError:
+				continue
+
+			total_size += entry_stat.st_size
+			if file_name.endswith('.json'):
+				entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+
+		removed_count = 0
+		max_size = self.max_size_mb*1024*1024
+		for mtime, size, entry_path in sorted(entries):
+			if total_size <= max_size:
+				break
+			try:
+				os.remove(entry_path)
+				removed_count += 1
+			except OSError:
+				# evicted by another process meanwhile
+				pass
+			total_size -= size
+
+		return removed_count
@@ -0,0 +1,161 @@
+import os
+import time
+import zipfile
+import threading
+
+import autoqm.packer
+
+# listings of parent folders by path, kept as
+# (mtime, folder names, container names), and member
+# names of containers by path, which never change once
+# a container is renamed from .partial
+listing_cache = {}
+container_cache = {}
+cache_lock = threading.Lock()
+
+# a listing is cached only if its folder has not
+# changed for this many seconds, as a change within
+# mtime granularity would not be noticed
+min_cache_age = 2.0
+
+def scan_parent_folder(parent_path):
+	"""
+	This method lists a parent folder, e.g., data_path,
+	in one pass, telling job folders from containers.
+
+	Returns a set of folder names and a set of
+	container names (without container extension)
+	"""
+	folder_names = set()
+	container_names = set()
+	if not os.path.isdir(parent_path):
+		return folder_names, container_names
+
+	scandir = getattr(os, 'scandir', None)
+	if scandir is not None:
+		entries = [(entry.name, entry.is_dir()) for entry in scandir(parent_path)]
+	else:
+		# without scandir, entries are told apart by
+		# name so that no entry needs a stat call
+		entries = [(name, not name.endswith(autoqm.packer.container_extension))
+					for name in os.listdir(parent_path)]
+
+	for name, is_dir in entries:
+		if name.endswith('.partial'):
+			continue
+		if is_dir:
+			folder_names.add(name)
+		elif name.endswith(autoqm.packer.container_extension):
+			container_names.add(name[:-len(autoqm.packer.container_extension)])
+
+	return folder_names, container_names
+
+def get_parent_listing(parent_path, use_cache=True):
+	"""
+	This method returns folder and container names of
+	parent_path, from cache if the folder's mtime has
+	not changed since it was listed.
+	"""
+	if not use_cache:
+		return scan_parent_folder(parent_path)
+
+	try:
+		mtime = os.stat(parent_path).st_mtime
+	except OSError:
+		return set(), set()
+
+	with cache_lock:
+		cached_listing = listing_cache.get(parent_path)
+	if cached_listing is not None and cached_listing[0] == mtime:
+		return cached_listing[1], cached_listing[2]
+
+	folder_names, container_names = scan_parent_folder(parent_path)
+	if time.time() - mtime > min_cache_age:
+		with cache_lock:
+			listing_cache[parent_path] = (mtime, folder_names, container_names)
+
+	return folder_names, container_names
+
+class JobIndex(object):
+	"""
+	A class for looking up job folders and containers
+	under one parent folder, e.g., data_path, listed once
+	instead of probing each job with os.path.exists.
+
+	Files of a job folder are listed on first lookup and
+	kept for the life of the index, i.e., one stage run.
+	"""
+
+	def __init__(self, parent_path, use_cache=True):
+		self.parent_path = os.path.normpath(parent_path)
+		self.folder_names, self.container_names = get_parent_listing(self.parent_path, use_cache)
+		self.folder_files = {}
+
+		# containers gone from the listing, e.g., unpacked
+		# by job fixer, may come back with other members
+		forget_containers(self.parent_path, self.container_names)
+
+	def has_job(self, spec_name):
+
+		return spec_name in self.folder_names or spec_name in self.container_names
+
+	def has_job_folder(self, spec_name):
+
+		return spec_name in self.folder_names
+
+	def list_job_files(self, spec_name):
+		"""
+		This method lists files of a job, from the job folder
+		if it exists, otherwise from its container.
+
+		Returns a set of file names relative to job folder
+		"""
+		if spec_name in self.folder_names:
+			if spec_name not in self.folder_files:
+				try:
+					self.folder_files[spec_name] = set(os.listdir(os.path.join(self.parent_path, spec_name)))
+				except OSError:
+					self.folder_files[spec_name] = set()
+			return self.folder_files[spec_name]
+
+		if spec_name in self.container_names:
+			container_path = autoqm.packer.get_container_path(os.path.join(self.parent_path, spec_name))
+			return get_container_files(container_path)
+
+		return set()
+
+	def has_job_files(self, spec_name, file_names):
+
+		return set(file_names).issubset(self.list_job_files(spec_name))
+
+def get_container_files(container_path):
+	"""
+	Returns member names of a container, read
+	once per container and cached afterwards
+	"""
+	with cache_lock:
+		member_names = container_cache.get(container_path)
+	if member_names is not None:
+		return member_names
+
+	try:
+		with zipfile.ZipFile(container_path, 'r') as container:
+			member_names = set(container.namelist())
+	except (IOError, OSError, zipfile.BadZipfile):
+		return set()
+
+	with cache_lock:
+		container_cache[container_path] = member_names
+	return member_names
+
+def forget_containers(parent_path, container_names):
+	"""
+	This method drops cached member names of containers
+	under parent_path which are not in container_names.
+	"""
+	container_paths = set(autoqm.packer.get_container_path(os.path.join(parent_path, name))
+							for name in container_names)
+	with cache_lock:
+		for container_path in list(container_cache):
+			if os.path.dirname(container_path) == parent_path and container_path not in container_paths:
+				del container_cache[container_path]
@@ -6,37 +6,66 @@
 
 # launch job, get jobid and update status "job_launched"
 import os
-import subprocess
+import shutil
+import datetime
+import tempfile
 
 import autoqm.utils
+import autoqm.lease
+import autoqm.indexer
+import autoqm.metrics
+import autoqm.outbox
+import autoqm.scheduler
+from autoqm.writer import BulkUpdateWriter
 from autoqm.connector import saturated_ringcore_table
 
 config = autoqm.utils.read_config()
 
-def select_launch_target(limit=100):
+# statuses of jobs ready to launch, job_recreated_for_convergence
+# being jobs restarted by job fixer
+launch_statuses = ["job_created", "job_recreated_for_convergence"]
+
+def select_launch_target(limit=100, claim=None):
 	"""
 	This method is to inform job launcher which targets 
 	to launch, which need meet two requirements:
-	1. status is job_created
+	1. status is job_created, or job_recreated_for_convergence
+	   for jobs restarted by job fixer
 	2. job input files located as expected
 
+	If a LeaseClaim is given, targets are leased to this
+	worker, so other launchers don't select them. Members
+	of job packs are returned without a lease, as they're
+	claimed pack by pack when launched.
+
 	Returns a list of targets with necessary meta data
 	"""
-	top_targets = list(saturated_ringcore_table.find({"status":"job_created"}).sort([('count', -1)]).limit(limit))
+	query = {"status": {"$in": launch_statuses}}
+	projection = {"aug_inchi": 1, "pack_id": 1}
+	sort_key = [('count', -1), ('_id', -1)]
+	if claim is not None:
+		free_query = {"$and": [query, autoqm.lease.get_free_query(datetime.datetime.utcnow())]}
+		candidates = list(saturated_ringcore_table.find(free_query, projection).sort(sort_key).limit(limit))
+		single_ids = [target['_id'] for target in candidates if not target.get('pack_id')]
+		top_targets = [target for target in candidates if target.get('pack_id')]
+		if single_ids:
+			single_query = {"_id": {"$in": single_ids}, "status": {"$in": launch_statuses}}
+			top_targets += claim.claim(single_query, projection, sort_key)
+	else:
+		top_targets = list(saturated_ringcore_table.find(query, projection).sort(sort_key).limit(limit))
 
 	selected_targets = []
 	data_path = config['QuantumMechanicJob']['data_path']
+	job_index = autoqm.indexer.JobIndex(data_path)
 	for target in top_targets:
 		aug_inchi = str(target['aug_inchi'])
 		spec_name = aug_inchi.replace('/', '_slash_')
-		spec_path = os.path.join(data_path, spec_name)
 
-		inp_file = os.path.join(spec_path, 'input.inp')
-		submission_script_path = os.path.join(spec_path, 'submit.sl')
-		if os.path.exists(inp_file) and os.path.exists(submission_script_path):
+		if job_index.has_job_folder(spec_name) and \
+			job_index.has_job_files(spec_name, ['input.inp', 'submit.sl']):
 			selected_targets.append(target)
 		else:
-			print("Warning: {0} has status job_created, but no input files found.".format(aug_inchi))
+			print("Warning: {0} is to launch, but no input files found.".format(aug_inchi))
 			print("If the job input is created by this current worker, it should be fine.")
 			print("Otherwise, please check if there's issues with autoQM job creator.")
 
@@ -44,52 +73,264 @@ def select_launch_target(limit=100):
 
 	return selected_targets
 
-def launch_jobs(limit):
+def submit_job(script_name, script_dir):
+	"""
+	This method submits a job script from script_dir to
+	the scheduler backend set in config, "sbatch" for slurm,
+	without changing working directory of the process, which
+	other stages may share.
+
+	Returns job id, or None if submission fails
+	"""
+	return autoqm.scheduler.get_backend().submit(script_name, script_dir)
+
+def get_submission_options(submission_script_path):
+	"""
+	This method reads "#SBATCH" options of a submission
+	script, except job name and output which are per job.
+
+	Returns a tuple of option lines
+	"""
+	per_job_options = ('-J', '--job-name', '-o', '--output')
+
+	submission_options = []
+	with open(submission_script_path, 'r') as f_in:
+		for line in f_in:
+			tokens = line.split()
+			if len(tokens) < 2 or tokens[0] != '#SBATCH':
+				continue
+			if tokens[1].split('=')[0] in per_job_options:
+				continue
+			submission_options.append(' '.join(tokens))
+
+	return tuple(submission_options)
+
+def generate_array_script(array_path, 
+						spec_paths, 
+						submission_options, 
+						throttle=None):
+	"""
+	This method writes a slurm array script whose task i runs
+	submit.sl in job folder i of spec_paths. Job folders are
+	listed in the script itself and task output goes to out.log
+	of each job folder, so nothing in array_path is needed
+	once the script is submitted.
+	"""
+	spec_path_lines = ['"{0}"'.format(os.path.abspath(spec_path)) for spec_path in spec_paths]
+
+	array_range = '0-{0}'.format(len(spec_paths) - 1)
+	if throttle:
+		array_range += '%{0}'.format(throttle)
+
+	array_script_string = """#!/bin/bash -l
+%s
+#SBATCH -J autoqm_array
+#SBATCH -o /dev/null
+#SBATCH --array=%s
+
+spec_paths=(
+%s
+)
+cd "${spec_paths[$SLURM_ARRAY_TASK_ID]}" || exit 1
+bash -l submit.sl > out.log 2>&1
+""" % ('\n'.join(submission_options), array_range, '\n'.join(spec_path_lines))
+
+	array_script_path = os.path.join(array_path, 'array.sl')
+	with open(array_script_path, 'w+') as fout:
+		fout.write(array_script_string)
+
+def launch_job_arrays(targets, 
+					data_path, 
+					writer, 
+					throttle=None, 
+					array_max_size=1000):
+	"""
+	This method launches targets as slurm job arrays,
+	one array per group of targets requesting the same
+	resources, and updates each target with job id
+	<array job id>_<array index>.
+	"""
+	# group targets by requested resources
+	target_groups = {}
+	for target in targets:
+		aug_inchi = str(target['aug_inchi'])
+		spec_name = aug_inchi.replace('/', '_slash_')
+		spec_path = os.path.join(data_path, spec_name)
+
+		submission_script_path = os.path.join(spec_path, 'submit.sl')
+		submission_options = get_submission_options(submission_script_path)
+		target_groups.setdefault(submission_options, []).append(aug_inchi)
+
+	arrays_path = os.path.join(data_path, 'job_arrays')
+	if not os.path.exists(arrays_path):
+		os.mkdir(arrays_path)
+
+	for submission_options, aug_inchis in target_groups.items():
+		for i in range(0, len(aug_inchis), array_max_size):
+			array_aug_inchis = aug_inchis[i:i+array_max_size]
+			spec_paths = [os.path.join(data_path, aug_inchi.replace('/', '_slash_')) 
+						for aug_inchi in array_aug_inchis]
+
+			array_path = tempfile.mkdtemp(prefix='array_', dir=arrays_path)
+			generate_array_script(array_path, spec_paths, submission_options, throttle)
+
+			# sbatch keeps its own copy of the script
+			array_job_id = submit_job('array.sl', array_path)
+			shutil.rmtree(array_path)
+			if array_job_id is None:
+				continue
+			print("Array job id for {0} jobs is {1}.".format(len(array_aug_inchis), array_job_id))
+			autoqm.metrics.add_processed(len(array_aug_inchis))
+
+			for array_index, aug_inchi in enumerate(array_aug_inchis):
+				query = {"aug_inchi": aug_inchi}
+				update_field = {
+						'job_id': '{0}_{1}'.format(array_job_id, array_index),
+						'status': "job_launched"
+				}
+
+				writer.update(query, update_field)
+
+			# job ids of submitted jobs are written right
+			# away, so a crash doesn't submit them again
+			writer.flush()
+
+def launch_job_packs(targets, data_path, writer, claim=None):
+	"""
+	This method launches packs of small molecule jobs
+	which share one allocation, by submitting each pack
+	once and updating its members still waiting for launch
+	with the shared job id. Pack folders are removed once
+	submitted if the scheduler keeps its own copy of scripts.
+
+	If a LeaseClaim is given, all members of each pack
+	are claimed together, and packs held by other launchers
+	are left to them.
+	"""
+	pack_ids = []
+	for target in targets:
+		pack_id = str(target['pack_id'])
+		if pack_id not in pack_ids:
+			pack_ids.append(pack_id)
+
+	backend = autoqm.scheduler.get_backend()
+	packs_path = os.path.join(data_path, 'job_packs')
+	for pack_id in pack_ids:
+		if claim is not None:
+			member_query = {"pack_id": pack_id, "status": {"$in": launch_statuses}}
+			if not claim.claim_group(member_query, {"aug_inchi": 1}):
+				print("Pack {0} is claimed by another launcher, skipped.".format(pack_id))
+				continue
+
+		pack_path = os.path.join(packs_path, pack_id)
+
+		job_id = submit_job('submit.sl', pack_path)
+		if job_id is None:
+			continue
+		print("Job id for pack {0} is {1}.".format(pack_id, job_id))
+
+		with open(os.path.join(pack_path, 'members.txt'), 'r') as f_in:
+			member_aug_inchis = f_in.read().split()
+		autoqm.metrics.add_processed(len(member_aug_inchis))
+		if backend.copies_scripts:
+			shutil.rmtree(pack_path)
+
+		for aug_inchi in member_aug_inchis:
+			# members launched or finished meanwhile,
+			# e.g., reset by hand, are left as they are
+			query = {"aug_inchi": aug_inchi, "status": {"$in": launch_statuses}}
+			update_field = {
+					'job_id': job_id,
+					'status': "job_launched"
+			}
+
+			writer.update(query, update_field)
+		writer.flush()
+
+def launch_jobs(limit, 
+				launch_mode='single', 
+				array_throttle=None, 
+				array_max_size=1000,
+				claim=None):
 	"""
 	This method launches job with following steps:
 	1. select jobs to launch
 	2. go to each job folder
-	3. launch them with "sbatch submit.sl"
+	3. launch them with "sbatch submit.sl" from there
 	4. get job id
 	5. update status "job_launched"
+
+	If launch_mode is array, step 2 to 5 are replaced by
+	submitting all selected jobs as few job arrays, unless
+	the scheduler backend, e.g., local, has no job arrays.
+	Jobs packed by creator are launched pack by pack.
+
+	If a LeaseClaim is given, jobs are claimed with it
+	so several launchers can run at the same time.
+
+	Status of every submission is written before the next
+	submission, so a crash can't leave submitted jobs
+	recorded only in memory.
 	"""
 	# 1. select jobs to launch
-	targets = select_launch_target(limit)
+	targets = select_launch_target(limit, claim)
 
-	# 2. go to each job folder
 	data_path = config['QuantumMechanicJob']['data_path']
-	for target in targets:
-		aug_inchi = str(target['aug_inchi'])
-		spec_name = aug_inchi.replace('/', '_slash_')
-		spec_path = os.path.join(data_path, spec_name)
+	with BulkUpdateWriter(saturated_ringcore_table,
+						upsert=False,
+						outbox_table=autoqm.outbox.get_outbox_table()) as writer:
+		packed_targets = [target for target in targets if target.get('pack_id')]
+		launch_job_packs(packed_targets, data_path, writer, claim)
 
-		os.chdir(spec_path)
+		targets = [target for target in targets if not target.get('pack_id')]
+		if launch_mode == 'array' and autoqm.scheduler.get_backend().supports_arrays:
+			launch_job_arrays(targets, 
+							data_path, 
+							writer, 
+							throttle=array_throttle, 
+							array_max_size=array_max_size)
+			targets = []
 
-		# 3. launch them with "sbatch submit.sl"
-		commands = ['sbatch', 'submit.sl']
-		process = subprocess.Popen(commands,
-								stdout=subprocess.PIPE,
-								stderr=subprocess.PIPE)
+		# 2. go to each job folder
+		for target in targets:
+			aug_inchi = str(target['aug_inchi'])
+			spec_name = aug_inchi.replace('/', '_slash_')
+			spec_path = os.path.join(data_path, spec_name)
 
-		stdout, stderr = process.communicate()
+			# 3. launch them with "sbatch submit.sl"
+			# 4. get job id
+			job_id = submit_job('submit.sl', spec_path)
+			if job_id is None:
+				continue
+			print("Job id for {0} is {1}.".format(aug_inchi, job_id))
+			autoqm.metrics.add_processed(1)
 
-		if stderr:
-			print(stderr)
-			continue
+			# 5. update status "job_launched"
+			query = {"aug_inchi": aug_inchi}
+			update_field = {
+					'job_id': job_id,
+					'status': "job_launched"
+			}
 
-		# 4. get job id from stdout, e.g., "Submitted batch job 5022607"
-		job_id = stdout.replace('Submitted batch job ', '').strip()
-		print("Job id for {0} is {1}.".format(aug_inchi, job_id))
+			writer.update(query, update_field)
+			writer.flush()
 
-		# 5. update status "job_launched"
-		query = {"aug_inchi": aug_inchi}
-		update_field = {
-				'job_id': job_id,
-				'status': "job_launched"
-		}
+	if writer.failed_results:
+		print('Status of {0} launched jobs is not saved.'.format(len(writer.failed_results)))
 
-		saturated_ringcore_table.update_one(query, {"$set": update_field}, True)
+def run():
 
-limit = int(config['QuantumMechanicJob']['limit_per_launch'])
-launch_jobs(limit)
+	limit = int(config['QuantumMechanicJob']['limit_per_launch'])
+	launch_mode = config['QuantumMechanicJob'].get('launch_mode', 'single')
+	array_throttle = config['QuantumMechanicJob'].get('array_throttle')
+	array_max_size = int(config['QuantumMechanicJob'].get('array_max_size', 1000))
+	with autoqm.metrics.stage_run('launcher'), \
+		autoqm.lease.get_claim(saturated_ringcore_table) as claim:
+		launch_jobs(limit, 
+					launch_mode=launch_mode, 
+					array_throttle=array_throttle, 
+					array_max_size=array_max_size,
+					claim=claim)
 
+if __name__ == '__main__':
+	run()
@@ -0,0 +1,155 @@
+import os
+import uuid
+import socket
+import datetime
+
+import autoqm.utils
+
+def get_worker_id():
+	"""
+	Returns id of this worker, i.e., host:pid
+	"""
+	return '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+def get_free_query(now):
+	"""
+	Returns a query of documents nobody holds a lease
+	on, either never leased, released or expired
+	"""
+	return {"$or": [{"lease_expiry": None},
+					{"lease_expiry": {"$lt": now}}]}
+
+class LeaseClaim(object):
+	"""
+	A class for claiming documents of a table for one worker
+	with an expiring lease, so that several workers of the
+	same stage, e.g., launchers on different login nodes,
+	never work on the same document.
+
+	Documents are claimed in batch: ids of free candidates
+	are read, then leased by one update_many which takes
+	only those still matching and still free, and finally
+	read back by lease token. Leases of crashed workers
+	expire after lease_seconds and are claimed again.
+
+	It can be used as a context manager, which releases
+	the leases on exit.
+	"""
+
+	def __init__(self, table, lease_seconds=3600, worker_id=None):
+		self.table = table
+		self.lease_seconds = lease_seconds
+		self.worker_id = worker_id or get_worker_id()
+		self.token = uuid.uuid4().hex
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.release()
+
+	def claim(self, query, projection=None, sort_key=None, limit=0):
+		"""
+		This method leases up to limit (0 for no limit) free
+		documents matching query, in order of sort_key.
+
+		Returns a list of claimed documents
+		"""
+		now = datetime.datetime.utcnow()
+		cursor = self.table.find({"$and": [query, get_free_query(now)]}, {"_id": 1})
+		if sort_key is not None:
+			cursor = cursor.sort(sort_key)
+		candidate_ids = [doc['_id'] for doc in cursor.limit(limit)]
+		if not candidate_ids:
+			return []
+
+		# the filter is checked again per document, so
+		# those claimed by others meanwhile are left out
+		lease_query = {"$and": [{"_id": {"$in": candidate_ids}}, query, get_free_query(now)]}
+		self.table.update_many(lease_query, {"$set": self.get_lease_field(now)})
+
+		claimed_query = {"_id": {"$in": candidate_ids}, "lease_token": self.token}
+		cursor = self.table.find(claimed_query, projection)
+		if sort_key is not None:
+			cursor = cursor.sort(sort_key)
+		return list(cursor)
+
+	def claim_group(self, query, projection=None, sort_key=None):
+		"""
+		This method leases all documents matching query as one
+		group, e.g., members of a job pack. The first document
+		in order of sort_key (default: _id) is leased alone
+		first, and only the worker holding it leases the others
+		with one update_many, so a group is never split between
+		workers. Documents whose leases expired are taken over.
+
+		Returns a list of claimed documents, or an empty
+		list if the group is held by another worker
+		"""
+		sort_key = sort_key or [('_id', 1)]
+		first_docs = list(self.table.find(query, {"_id": 1}).sort(sort_key).limit(1))
+		if not first_docs:
+			return []
+
+		now = datetime.datetime.utcnow()
+		lease_field = self.get_lease_field(now)
+		claimable_query = {"$or": [{"lease_token": self.token}] + get_free_query(now)["$or"]}
+		first_query = {"$and": [{"_id": first_docs[0]['_id']}, query, claimable_query]}
+		self.table.update_one(first_query, {"$set": lease_field})
+		if self.table.find_one({"_id": first_docs[0]['_id'], "lease_token": self.token}) is None:
+			return []
+
+		self.table.update_many({"$and": [query, claimable_query]}, {"$set": lease_field})
+
+		# members leased one by one by another worker,
+		# and not expired, can't be taken over
+		if self.count_claimed_by_others(query) > 0:
+			self.release(query)
+			return []
+
+		cursor = self.table.find({"$and": [query, {"lease_token": self.token}]}, projection)
+		return list(cursor.sort(sort_key))
+
+	def get_lease_field(self, now):
+
+		return {
+			'lease_token': self.token,
+			'lease_owner': self.worker_id,
+			'lease_expiry': now + datetime.timedelta(seconds=self.lease_seconds)
+		}
+
+	def count_claimed_by_others(self, query):
+		"""
+		Returns number of documents matching query
+		leased by other workers
+		"""
+		now = datetime.datetime.utcnow()
+		others_query = {"$and": [query,
+								{"lease_token": {"$ne": self.token}},
+								{"lease_expiry": {"$gte": now}}]}
+		return self.table.find(others_query, {"_id": 1}).count()
+
+	def release(self, query=None):
+		"""
+		This method releases all leases of this claim,
+		or only those on documents matching query.
+		"""
+		release_field = {
+			'lease_token': None,
+			'lease_owner': None,
+			'lease_expiry': None
+		}
+		release_query = {"lease_token": self.token}
+		if query is not None:
+			release_query = {"$and": [query, release_query]}
+		self.table.update_many(release_query, {"$set": release_field})
+
+def get_claim(table):
+	"""
+	This method returns a LeaseClaim on table with
+	lease_seconds in config (default: 3600), which
+	should be longer than any stage run.
+	"""
+	config = autoqm.utils.read_config()
+	lease_seconds = float(config['QuantumMechanicJob'].get('lease_seconds', 3600))
+	return LeaseClaim(table, lease_seconds=lease_seconds)
@@ -1,9 +1,257 @@
+
+import signal
+import argparse
+import threading
+import traceback
+
+import autoqm.utils
+import autoqm.outbox
+import autoqm.connector
 import autoqm.creator
 import autoqm.launcher
+import autoqm.checker
+import autoqm.archiver
+import autoqm.pusher
+import autoqm.fixer
+
+config = autoqm.utils.read_config()
+
+# default seconds between two runs of each stage,
+# can be overwritten in [Daemon] section of config,
+# e.g., launcher_interval: 10
+stage_intervals = {
+	'creator': 60,
+	'launcher': 10,
+	'checker': 60,
+	'archiver': 300,
+	'pusher': 600,
+	'fixer': 600
+}
+
+# stages woken up by outbox events, by updated field
+# and value, if outbox is enabled; they still run on
+# a long fallback interval to catch missed events
+event_triggers = {
+	('status', 'job_created'): ['launcher'],
+	('status', 'job_recreated_for_convergence'): ['launcher'],
+	('status', 'job_success'): ['archiver'],
+	('status', 'job_failed_convergence'): ['archiver'],
+	('status', 'job_failed_isomorphism'): ['archiver'],
+	('archived', 'Yes'): ['pusher', 'fixer']
+}
+default_fallback_interval = 1800
+
+class Stage(object):
+	"""
+	A class for running one pipeline stage in its own
+	thread, once every interval seconds or as soon as
+	it's triggered, until stop_event is set.
+	"""
+
+	def __init__(self, name, run, interval, stop_event):
+		self.name = name
+		self.run = run
+		self.interval = interval
+		self.stop_event = stop_event
+		self.wakeup_event = threading.Event()
+		self.downstream_stages = []
+		self.thread = threading.Thread(target=self.loop, name=name)
+		self.thread.daemon = True
+
+	def trigger(self):
+		"""
+		This method wakes the stage up for an immediate run.
+		"""
+		self.wakeup_event.set()
+
+	def loop(self):
+
+		while not self.stop_event.is_set():
+			self.wakeup_event.clear()
+			try:
+				self.run()
+			except Exception:
+				print('Stage {0} fails:'.format(self.name))
+				traceback.print_exc()
+
+			# let downstream stages pick up
+			# the work right away
+			for stage in self.downstream_stages:
+				stage.trigger()
+
+			self.wakeup_event.wait(self.interval)
+
+def create_stages(stop_event, use_events=False):
+	"""
+	This method creates pipeline stages and links them,
+	so that a creator run triggers the launcher, a checker
+	run triggers the archiver, which triggers the pusher
+	and the fixer, whose restarted jobs trigger the launcher.
+
+	If use_events, stages are not linked but triggered by
+	outbox events instead, and those triggered by events
+	run on the fallback interval otherwise.
+
+	Returns a dictionary of stages by name
+	"""
+	stage_runs = {
+		'creator': autoqm.creator.run,
+		'launcher': autoqm.launcher.run,
+		'checker': autoqm.checker.run,
+		'archiver': autoqm.archiver.run,
+		'pusher': autoqm.pusher.run,
+		'fixer': autoqm.fixer.run
+	}
+
+	daemon_config = config.get('Daemon', {})
+	event_stage_names = set(name for stage_names in event_triggers.values() for name in stage_names)
+	fallback_interval = autoqm.outbox.get_outbox_config().get('fallback_interval', default_fallback_interval)
+	stages = {}
+	for name, run in stage_runs.items():
+		default_interval = stage_intervals[name]
+		if use_events and name in event_stage_names:
+			default_interval = fallback_interval
+		interval = float(daemon_config.get('{0}_interval'.format(name),
+											default_interval))
+		stages[name] = Stage(name, run, interval, stop_event)
+
+	if use_events:
+		return stages
+
+	stages['creator'].downstream_stages.append(stages['launcher'])
+	stages['checker'].downstream_stages.append(stages['archiver'])
+	stages['archiver'].downstream_stages.append(stages['pusher'])
+	stages['archiver'].downstream_stages.append(stages['fixer'])
+	stages['fixer'].downstream_stages.append(stages['launcher'])
+
+	return stages
+
+class OutboxDispatcher(object):
+	"""
+	A class for reading outbox events in its own thread
+	and triggering stages by event_triggers, so a job_success
+	is archived and pushed without waiting for intervals.
+	"""
+
+	def __init__(self, stages, stop_event, retry_interval=30):
+		self.stages = stages
+		self.stop_event = stop_event
+		self.retry_interval = retry_interval
+
+		outbox_config = autoqm.outbox.get_outbox_config()
+		use_change_stream = outbox_config.get('use_change_stream', 'yes').strip().lower() in ('yes', 'true', '1')
+		self.subscriber = autoqm.outbox.OutboxSubscriber(outbox_config.get('subscriber_name', 'daemon'),
+														autoqm.connector.saturated_ringcore_outbox,
+														autoqm.connector.saturated_ringcore_outbox_cursors,
+														poll_interval=float(outbox_config.get('poll_interval', 1.0)),
+														use_change_stream=use_change_stream)
+		self.thread = threading.Thread(target=self.loop, name='outbox')
+		self.thread.daemon = True
+
+	def handle_events(self, events):
+
+		stage_names = set()
+		for event in events:
+			for field, value in event.get('changes', {}).items():
+				stage_names.update(event_triggers.get((field, value), []))
+
+		for name in stage_names:
+			self.stages[name].trigger()
+
+	def loop(self):
+
+		while not self.stop_event.is_set():
+			try:
+				self.subscriber.listen(self.handle_events, self.stop_event)
+			except Exception:
+				print('Outbox subscriber fails, retrying in {0} seconds:'.format(self.retry_interval))
+				traceback.print_exc()
+				self.stop_event.wait(self.retry_interval)
+
+def ensure_indexes():
+	"""
+	This method creates indexes of registration and
+	results tables used by the stage queries, and of
+	outbox table if it's enabled.
+	"""
+	autoqm.connector.ensure_indexes(autoqm.connector.saturated_ringcore_table,
+									autoqm.connector.saturated_ringcore_res_table)
+
+	if autoqm.outbox.is_enabled():
+		ttl_days = float(autoqm.outbox.get_outbox_config().get('ttl_days', 7))
+		autoqm.connector.ensure_outbox_indexes(autoqm.connector.saturated_ringcore_outbox, ttl_days)
+
+def run_daemon():
+	"""
+	This method runs creator, launcher, checker, archiver,
+	pusher and fixer concurrently in one long-running process until
+	it receives SIGINT or SIGTERM; running stages finish their
+	current run before the daemon exits.
+	"""
+	ensure_indexes()
+
+	stop_event = threading.Event()
+	use_events = autoqm.outbox.is_enabled()
+	stages = create_stages(stop_event, use_events=use_events)
+	dispatcher = None
+	if use_events:
+		dispatcher = OutboxDispatcher(stages, stop_event)
+
+	def stop(signum, frame):
+		print('Received signal {0}, stopping autoQM daemon...'.format(signum))
+		stop_event.set()
+		for stage in stages.values():
+			stage.trigger()
+
+	signal.signal(signal.SIGINT, stop)
+	signal.signal(signal.SIGTERM, stop)
+
+	for stage in stages.values():
+		stage.thread.start()
+	if dispatcher is not None:
+		dispatcher.thread.start()
+
+	# waiting with a timeout keeps main thread
+	# responsive to signals
+	while not stop_event.is_set():
+		stop_event.wait(1)
+
+	for stage in stages.values():
+		stage.thread.join()
+	if dispatcher is not None:
+		dispatcher.thread.join()
+	print('autoQM daemon stopped.')
+
+def run_once():
+	"""
+	This method runs every stage once in pipeline order.
+	"""
+	ensure_indexes()
+
+	autoqm.creator.run()
+	autoqm.fixer.run()
+	autoqm.launcher.run()
+	autoqm.checker.run()
+	autoqm.archiver.run()
+	autoqm.pusher.run()
 
 def main():
-	autoqm.creator.create_jobs()
-	autoqm.launcher.launch_jobs()
+
+	parser = argparse.ArgumentParser(description='Run autoQM pipeline.')
+	parser.add_argument('command',
+						nargs='?',
+						default='daemon',
+						choices=['daemon', 'once', 'indexes'],
+						help='run stages continuously (daemon), once, '
+							'or only create database indexes (indexes)')
+	args = parser.parse_args()
+
+	if args.command == 'daemon':
+		run_daemon()
+	elif args.command == 'once':
+		run_once()
+	else:
+		ensure_indexes()
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
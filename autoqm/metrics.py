@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import subprocess
+import contextlib
+
+import pymongo.monitoring
+
+import autoqm.utils
+
+# metrics are written only if their destinations are set
+# in an optional [Metrics] section of config, e.g.,
+# textfile_dir: /var/lib/node_exporter/textfile_collector
+# jsonl_path: /scratch/autoqm/metrics.jsonl
+# read on first stage run, so importing this module
+# doesn't need config
+metrics_config = None
+
+def get_metrics_config():
+	"""
+	Returns [Metrics] section of config,
+	read once per process
+	"""
+	global metrics_config
+	if metrics_config is None:
+		metrics_config = autoqm.utils.read_config().get('Metrics', {})
+	return metrics_config
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+				1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+metric_definitions = {
+	'autoqm_stage_runs_total': ('counter', 'Number of stage runs.'),
+	'autoqm_stage_failures_total': ('counter', 'Number of stage runs raising an exception.'),
+	'autoqm_stage_items_total': ('counter', 'Number of molecules processed by a stage.'),
+	'autoqm_stage_duration_seconds': ('histogram', 'Duration of stage runs.'),
+	'autoqm_stage_last_run_timestamp_seconds': ('gauge', 'Time a stage run last finished.'),
+	'autoqm_db_command_duration_seconds': ('histogram', 'Latency of database commands.'),
+	'autoqm_db_command_failures_total': ('counter', 'Number of failed database commands.'),
+	'autoqm_subprocess_duration_seconds': ('histogram', 'Latency of subprocess calls, e.g., sbatch.'),
+	'autoqm_subprocess_failures_total': ('counter', 'Number of subprocess calls with non-zero exit status.'),
+	'autoqm_queue_depth': ('gauge', 'Number of molecules of registration table in each status.')
+}
+
+class MetricsRegistry(object):
+	"""
+	A class for keeping counters, gauges and histograms
+	of one process, each series keyed by metric name and
+	a sorted tuple of label pairs.
+	"""
+
+	def __init__(self, buckets=default_buckets):
+		self.buckets = buckets
+		self.counters = {}
+		self.gauges = {}
+		self.histograms = {}
+		self.lock = threading.Lock()
+
+	def inc(self, name, value=1, **labels):
+
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + value
+
+	def set_gauge(self, name, value, **labels):
+
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			self.gauges[key] = value
+
+	def observe(self, name, value, **labels):
+
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock:
+			if key not in self.histograms:
+				self.histograms[key] = {'buckets': [0]*len(self.buckets), 'sum': 0.0, 'count': 0}
+			histogram = self.histograms[key]
+			for i, upper_bound in enumerate(self.buckets):
+				if value <= upper_bound:
+					histogram['buckets'][i] += 1
+			histogram['sum'] += value
+			histogram['count'] += 1
+
+	def render_prometheus(self, label_filter=None):
+		"""
+		This method renders series, those whose labels
+		pass label_filter if it's given, in Prometheus
+		text exposition format.
+		"""
+		with self.lock:
+			series = [(name, labels, 'value', value) for (name, labels), value in self.counters.items()]
+			series += [(name, labels, 'value', value) for (name, labels), value in self.gauges.items()]
+			series += [(name, labels, 'histogram', dict(histogram, buckets=list(histogram['buckets'])))
+						for (name, labels), histogram in self.histograms.items()]
+
+		lines = []
+		rendered_names = set()
+		for name, labels, kind, value in sorted(series, key=lambda s: (s[0], s[1])):
+			if label_filter is not None and not label_filter(dict(labels)):
+				continue
+
+			if name not in rendered_names:
+				metric_type, metric_help = metric_definitions.get(name, ('untyped', ''))
+				lines.append('# HELP {0} {1}'.format(name, metric_help))
+				lines.append('# TYPE {0} {1}'.format(name, metric_type))
+				rendered_names.add(name)
+
+			if kind == 'value':
+				lines.append('{0}{1} {2}'.format(name, format_labels(labels), value))
+				continue
+
+			for upper_bound, bucket_count in zip(self.buckets, value['buckets']):
+				bucket_labels = labels + (('le', repr(float(upper_bound))),)
+				lines.append('{0}_bucket{1} {2}'.format(name, format_labels(bucket_labels), bucket_count))
+			lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels + (('le', '+Inf'),)), value['count']))
+			lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), value['sum']))
+			lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), value['count']))
+
+		lines.append('')
+		return '\n'.join(lines)
+
+def format_labels(labels):
+
+	if not labels:
+		return ''
+	label_strings = ['{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+					for key, value in labels]
+	return '{' + ','.join(label_strings) + '}'
+
+# metrics of this process
+registry = MetricsRegistry()
+
+class StageRun(object):
+	"""
+	A class for collecting what one stage run does,
+	written as one line of the JSON-lines log.
+	"""
+
+	def __init__(self, stage):
+		self.stage = stage
+		self.start_time = time.time()
+		self.processed = 0
+		self.failed = False
+		self.db_commands = {}
+		self.subprocess_calls = {}
+
+	def add_call(self, calls, command, seconds, failed):
+
+		call = calls.setdefault(command, {'count': 0, 'seconds': 0.0, 'failures': 0})
+		call['count'] += 1
+		call['seconds'] += seconds
+		if failed:
+			call['failures'] += 1
+
+# stage runs are tracked per thread, as stages
+# run in their own threads in the daemon
+local_state = threading.local()
+
+def get_current_run():
+
+	return getattr(local_state, 'stage_run', None)
+
+def get_current_stage():
+
+	stage_run = get_current_run()
+	if stage_run is None:
+		return 'other'
+	return stage_run.stage
+
+@contextlib.contextmanager
+def stage_run(stage):
+	"""
+	This method times a stage run in its with block,
+	labels database and subprocess calls made in the block
+	with stage, then writes metrics of the stage.
+	"""
+	current_run = StageRun(stage)
+	local_state.stage_run = current_run
+	try:
+		yield current_run
+	except Exception:
+		current_run.failed = True
+		registry.inc('autoqm_stage_failures_total', stage=stage)
+		raise
+	finally:
+		local_state.stage_run = None
+		duration = time.time() - current_run.start_time
+		registry.inc('autoqm_stage_runs_total', stage=stage)
+		registry.observe('autoqm_stage_duration_seconds', duration, stage=stage)
+		registry.set_gauge('autoqm_stage_last_run_timestamp_seconds', time.time(), stage=stage)
+		try:
+			queue_depths = record_queue_depths()
+			write_metrics(current_run, duration, queue_depths)
+		except Exception as e:
+			print('Writing metrics of {0} fails: {1}'.format(stage, e))
+
+def add_processed(count):
+	"""
+	This method adds count molecules to
+	items processed by the current stage.
+	"""
+	stage = get_current_stage()
+	registry.inc('autoqm_stage_items_total', count, stage=stage)
+	current_run = get_current_run()
+	if current_run is not None:
+		current_run.processed += count
+
+class DatabaseListener(pymongo.monitoring.CommandListener):
+	"""
+	A class for recording latency of every command
+	sent to the database, passed as an event listener
+	to the client.
+	"""
+
+	def started(self, event):
+		pass
+
+	def succeeded(self, event):
+		record_db_command(event.command_name, event.duration_micros/1e6, False)
+
+	def failed(self, event):
+		record_db_command(event.command_name, event.duration_micros/1e6, True)
+
+def record_db_command(command, seconds, failed):
+
+	stage = get_current_stage()
+	registry.observe('autoqm_db_command_duration_seconds', seconds, stage=stage, command=command)
+	if failed:
+		registry.inc('autoqm_db_command_failures_total', stage=stage, command=command)
+
+	current_run = get_current_run()
+	if current_run is not None:
+		current_run.add_call(current_run.db_commands, command, seconds, failed)
+
+def run_subprocess(commands, cwd=None):
+	"""
+	This method runs commands, e.g., ['sbatch', 'submit.sl'],
+	recording its latency and exit status.
+
+	Returns return code, stdout and stderr
+	"""
+	start_time = time.time()
+	process = subprocess.Popen(commands,
+								cwd=cwd,
+								stdout=subprocess.PIPE,
+								stderr=subprocess.PIPE)
+	stdout, stderr = process.communicate()
+	seconds = time.time() - start_time
+
+	command = os.path.basename(commands[0])
+	failed = process.returncode != 0
+	stage = get_current_stage()
+	registry.observe('autoqm_subprocess_duration_seconds', seconds, stage=stage, command=command)
+	if failed:
+		registry.inc('autoqm_subprocess_failures_total', stage=stage, command=command)
+
+	current_run = get_current_run()
+	if current_run is not None:
+		current_run.add_call(current_run.subprocess_calls, command, seconds, failed)
+
+	return process.returncode, stdout, stderr
+
+# queue depths counted last, shared by stages of
+# this process so the table is scanned at most once
+# every queue_depths_interval seconds
+queue_depths_lock = threading.Lock()
+queue_depths_state = {'timestamp': None, 'queue_depths': {}}
+
+def record_queue_depths():
+	"""
+	This method counts molecules of registration table
+	in each status with one aggregation, unless
+	queue_depths is set to False in [Metrics]. Counts
+	are reused by all stages until queue_depths_interval
+	(default: 60) seconds have passed.
+
+	Returns a dictionary of counts by status
+	"""
+	metrics_config = get_metrics_config()
+	if metrics_config.get('queue_depths', 'True').strip().lower() != 'true':
+		return {}
+	if not (metrics_config.get('textfile_dir') or metrics_config.get('jsonl_path')):
+		return {}
+
+	queue_depths_interval = float(metrics_config.get('queue_depths_interval', 60))
+	with queue_depths_lock:
+		last_timestamp = queue_depths_state['timestamp']
+		if last_timestamp is not None and time.time() - last_timestamp < queue_depths_interval:
+			return queue_depths_state['queue_depths']
+
+		from autoqm.connector import saturated_ringcore_table
+
+		pipeline = [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
+		queue_depths = {}
+		for group in saturated_ringcore_table.aggregate(pipeline):
+			queue_depths[str(group['_id'])] = group['count']
+			registry.set_gauge('autoqm_queue_depth', group['count'], status=str(group['_id']))
+
+		queue_depths_state['timestamp'] = time.time()
+		queue_depths_state['queue_depths'] = queue_depths
+
+	return queue_depths
+
+def write_metrics(current_run, duration, queue_depths):
+	"""
+	This method writes metrics of the stage to
+	<textfile_dir>/autoqm_<stage>.prom for Prometheus
+	textfile collector, queue depths to autoqm_queue.prom,
+	and appends the stage run to jsonl_path.
+	"""
+	stage = current_run.stage
+	metrics_config = get_metrics_config()
+
+	textfile_dir = metrics_config.get('textfile_dir')
+	if textfile_dir:
+		write_textfile(os.path.join(textfile_dir, 'autoqm_{0}.prom'.format(stage)),
+						registry.render_prometheus(lambda labels: labels.get('stage') == stage))
+		if queue_depths:
+			write_textfile(os.path.join(textfile_dir, 'autoqm_queue.prom'),
+							registry.render_prometheus(lambda labels: 'status' in labels))
+
+	jsonl_path = metrics_config.get('jsonl_path')
+	if jsonl_path:
+		record = {
+			'timestamp': time.time(),
+			'stage': stage,
+			'duration_seconds': duration,
+			'processed': current_run.processed,
+			'failed': current_run.failed,
+			'db_commands': current_run.db_commands,
+			'subprocess_calls': current_run.subprocess_calls,
+			'queue_depths': queue_depths
+		}
+		with open(jsonl_path, 'a') as f_out:
+			f_out.write(json.dumps(record, sort_keys=True) + '\n')
+
+def write_textfile(textfile_path, text):
+	"""
+	This method writes text through a temporary file,
+	so the collector never reads a partial file.
+	"""
+	fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(textfile_path)),
+									prefix='.autoqm_')
+	with os.fdopen(fd, 'w') as f_out:
+		f_out.write(text)
+	os.chmod(tmp_path, 0o644)
+	os.rename(tmp_path, textfile_path)
@@ -0,0 +1,215 @@
+import datetime
+
+import pymongo
+
+import autoqm.utils
+import autoqm.connector
+
+# status transitions are appended to an outbox table
+# only if an optional [Outbox] section of config
+# enables it, e.g.,
+# enabled: yes
+# poll_interval: 1
+# ttl_days: 7
+# read on first use, so importing this module
+# doesn't need config
+outbox_config = None
+
+def get_outbox_config():
+	"""
+	Returns [Outbox] section of config,
+	read once per process
+	"""
+	global outbox_config
+	if outbox_config is None:
+		outbox_config = autoqm.utils.read_config().get('Outbox', {})
+	return outbox_config
+
+# fields of registration table whose updates are
+# appended to outbox as events
+event_fields = ('status', 'archived')
+
+def is_enabled():
+
+	return get_outbox_config().get('enabled', 'no').strip().lower() in ('yes', 'true', '1')
+
+def get_outbox_table():
+	"""
+	Returns the outbox table if outbox is enabled, otherwise None,
+	so writers given it append events only when asked to.
+	"""
+	if not is_enabled():
+		return None
+	return autoqm.connector.saturated_ringcore_outbox
+
+def get_event_query(query):
+	"""
+	Returns equality fields of query, e.g., aug_inchi, as
+	operators like $in can't be keys of stored documents
+	"""
+	return dict((field, value) for field, value in query.items()
+				if not field.startswith('$') and not isinstance(value, dict))
+
+def make_events(table_name, updates):
+	"""
+	This method makes one event per (query, update_field)
+	of updates which sets any of event_fields, keeping
+	only equality fields of query.
+
+	Returns a list of event documents
+	"""
+	created = datetime.datetime.utcnow()
+	events = []
+	for query, update_field in updates:
+		changes = dict((field, update_field[field]) for field in event_fields if field in update_field)
+		if not changes:
+			continue
+
+		event = {
+			'table': table_name,
+			'query': get_event_query(query),
+			'changes': changes,
+			'created': created
+		}
+		events.append(event)
+
+	return events
+
+def append_events(outbox_table, events):
+	"""
+	This method appends events to outbox table. Events only
+	wake stages up earlier, so failing to append them is
+	reported without failing the update itself.
+	"""
+	if not events:
+		return
+	try:
+		outbox_table.insert_many(events, ordered=False)
+	except Exception as e:
+		print('Appending {0} events to outbox fails: {1}'.format(len(events), e))
+
+class OutboxSubscriber(object):
+	"""
+	A class for reading events of outbox table in order
+	of _id, from where subscriber name left off last time,
+	which is kept in cursor table.
+
+	Events are read from a change stream of outbox table if
+	the database has one (replica sets), otherwise by polling
+	for events with larger _id every poll_interval seconds.
+
+	Events are hints for stages to run earlier. An event can
+	be missed if another process inserts it with a smaller
+	_id after a later one has been read, which only delays
+	the stage to its next interval run.
+	"""
+
+	def __init__(self, name,
+				outbox_table,
+				cursor_table,
+				poll_interval=1.0,
+				batch_size=1000,
+				use_change_stream=True):
+		self.name = name
+		self.outbox_table = outbox_table
+		self.cursor_table = cursor_table
+		self.poll_interval = poll_interval
+		self.batch_size = batch_size
+		self.use_change_stream = use_change_stream
+		self.last_id = None
+
+	def load_position(self):
+		"""
+		This method loads _id of the last event read by this
+		subscriber. A new subscriber starts after the newest
+		event, since stages catch up with their own first run.
+		"""
+		cursor_doc = self.cursor_table.find_one({'_id': self.name})
+		if cursor_doc is not None:
+			self.last_id = cursor_doc['last_id']
+			return
+
+		newest_events = list(self.outbox_table.find({}, {'_id': 1}).sort('_id', -1).limit(1))
+		if newest_events:
+			self.last_id = newest_events[0]['_id']
+			self.save_position()
+
+	def save_position(self):
+
+		self.cursor_table.update_one({'_id': self.name},
+									{'$set': {'last_id': self.last_id,
+											'updated': datetime.datetime.utcnow()}},
+									upsert=True)
+
+	def poll(self):
+		"""
+		This method reads events after last_id, at most
+		batch_size of them, and moves last_id past them.
+
+		Returns a list of events
+		"""
+		query = {}
+		if self.last_id is not None:
+			query['_id'] = {'$gt': self.last_id}
+		events = list(self.outbox_table.find(query).sort('_id', 1).limit(self.batch_size))
+
+		if events:
+			self.last_id = events[-1]['_id']
+			self.save_position()
+		return events
+
+	def open_change_stream(self):
+		"""
+		This method opens a change stream of inserts into outbox
+		table, or returns None if the database can't provide one,
+		e.g., a standalone server or an in-memory stand-in.
+		"""
+		if not self.use_change_stream:
+			return None
+		try:
+			return self.outbox_table.watch([{'$match': {'operationType': 'insert'}}],
+											max_await_time_ms=int(self.poll_interval*1000))
+		except (pymongo.errors.PyMongoError, NotImplementedError, AttributeError):
+			return None
+
+	def listen(self, handle_events, stop_event):
+		"""
+		This method calls handle_events with each batch of new
+		events until stop_event is set. The change stream, when
+		there's one, is opened before catching up by polling, so
+		no event falls between the two.
+		"""
+		self.load_position()
+
+		stream = self.open_change_stream()
+		events = self.poll()
+		while events:
+			handle_events(events)
+			events = self.poll()
+
+		if stream is None:
+			print('Outbox subscriber {0} polls every {1} seconds.'.format(self.name, self.poll_interval))
+			while not stop_event.is_set():
+				events = self.poll()
+				if events:
+					handle_events(events)
+				else:
+					stop_event.wait(self.poll_interval)
+			return
+
+		print('Outbox subscriber {0} reads the change stream.'.format(self.name))
+		with stream:
+			while not stop_event.is_set():
+				change = stream.try_next()
+				if change is None:
+					continue
+
+				event = change['fullDocument']
+				# events read while catching up
+				# show up in the stream again
+				if self.last_id is not None and event['_id'] <= self.last_id:
+					continue
+
+				self.last_id = event['_id']
+				self.save_position()
+				handle_events([event])
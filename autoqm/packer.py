@@ -0,0 +1,100 @@
+import os
+import shutil
+import zipfile
+
+# job folders archived as containers are kept
+# next to where the folder would be, e.g.,
+# success/InChI=1S_slash_C10H12_slash_...zip
+container_extension = '.zip'
+
+def get_container_path(spec_path):
+
+	return spec_path + container_extension
+
+def pack_job_folder(spec_path, container_path):
+	"""
+	This method packs all files of a job folder into one
+	compressed container. The container is written as .partial
+	and renamed only after every member passes its CRC check.
+	"""
+	partial_path = container_path + '.partial'
+	with zipfile.ZipFile(partial_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as container:
+		for root, dirs, files in os.walk(spec_path):
+			for file_name in files:
+				file_path = os.path.join(root, file_name)
+				container.write(file_path, os.path.relpath(file_path, spec_path))
+
+	with zipfile.ZipFile(partial_path, 'r') as container:
+		bad_member = container.testzip()
+	if bad_member is not None:
+		os.remove(partial_path)
+		raise IOError('CRC check fails for {0} when packing {1}.'.format(bad_member, spec_path))
+
+	os.rename(partial_path, container_path)
+
+def unpack_job_folder(container_path, spec_path):
+	"""
+	This method unpacks a container into job folder spec_path,
+	through a .partial folder renamed when all members are
+	extracted, and removes the container.
+	"""
+	partial_path = spec_path + '.partial'
+	if os.path.exists(partial_path):
+		shutil.rmtree(partial_path)
+
+	with zipfile.ZipFile(container_path, 'r') as container:
+		container.extractall(partial_path)
+
+	os.rename(partial_path, spec_path)
+	os.remove(container_path)
+
+def list_job_files(spec_path):
+	"""
+	This method lists files of a job, from the job folder if
+	it exists, otherwise from the member index of its container.
+
+	Returns a set of file names relative to job folder
+	"""
+	if os.path.isdir(spec_path):
+		return set(os.listdir(spec_path))
+
+	container_path = get_container_path(spec_path)
+	if os.path.exists(container_path):
+		with zipfile.ZipFile(container_path, 'r') as container:
+			return set(container.namelist())
+
+	return set()
+
+def has_job_files(spec_path, file_names):
+	"""
+	This method checks if a job, either as a folder or
+	as a container, has all the given files.
+	"""
+	return set(file_names).issubset(list_job_files(spec_path))
+
+def open_job_file(spec_path, file_name):
+	"""
+	This method opens a file of a job for reading in binary mode,
+	from the job folder if it's there, otherwise from the
+	container, without unpacking other members.
+	"""
+	file_path = os.path.join(spec_path, file_name)
+	if os.path.exists(file_path):
+		return open(file_path, 'rb')
+
+	# the opened member keeps its own file handle,
+	# so the container itself can be closed here
+	with zipfile.ZipFile(get_container_path(spec_path), 'r') as container:
+		return container.open(file_name, 'r')
+
+def extract_job_file(spec_path, file_name, dest_file):
+	"""
+	This method copies one file of a job, either from the
+	job folder or from its container, to dest_file.
+	"""
+	f_in = open_job_file(spec_path, file_name)
+	try:
+		with open(dest_file, 'wb') as f_out:
+			shutil.copyfileobj(f_in, f_out)
+	finally:
+		f_in.close()
@@ -0,0 +1,164 @@
+import os
+import json
+import math
+import tempfile
+
+class ResourcePredictor(object):
+	"""
+	A class for predicting walltime, number of processors
+	and memory of a job from heavy atom count of the molecule.
+
+	Cpu time of opt and freq is fitted as log(hours) = a + b*n,
+	n being heavy atom count. The fit is kept as sums over
+	observed jobs, so it's refit incrementally whenever
+	another successful job is observed.
+	"""
+
+	def __init__(self, model_path=None,
+				procs_num_tiers=((8, 8), (12, 16)),
+				max_procs_num=32,
+				memory_per_heavy_atom_mb=100,
+				min_memory_mb=500,
+				max_memory_mb=1500,
+				parallel_efficiency=0.5,
+				safety_factor=2.0,
+				min_walltime_hours=0.5,
+				max_walltime_hours=48.0,
+				default_walltime_hours=2.0):
+		self.model_path = model_path
+		self.procs_num_tiers = procs_num_tiers
+		self.max_procs_num = max_procs_num
+		self.memory_per_heavy_atom_mb = memory_per_heavy_atom_mb
+		self.min_memory_mb = min_memory_mb
+		self.max_memory_mb = max_memory_mb
+		self.parallel_efficiency = parallel_efficiency
+		self.safety_factor = safety_factor
+		self.min_walltime_hours = min_walltime_hours
+		self.max_walltime_hours = max_walltime_hours
+		self.default_walltime_hours = default_walltime_hours
+
+		self.sample_count = 0
+		self.sum_x = 0.0
+		self.sum_y = 0.0
+		self.sum_xx = 0.0
+		self.sum_xy = 0.0
+
+		if model_path is not None and os.path.exists(model_path):
+			self.load()
+
+	def load(self):
+
+		with open(self.model_path, 'r') as f_in:
+			model = json.load(f_in)
+
+		self.sample_count = model['sample_count']
+		self.sum_x = model['sum_x']
+		self.sum_y = model['sum_y']
+		self.sum_xx = model['sum_xx']
+		self.sum_xy = model['sum_xy']
+
+	def save(self):
+		"""
+		This method saves the fit to model_path, through
+		a temporary file so readers never see a partial one.
+		"""
+		model = {
+			'sample_count': self.sample_count,
+			'sum_x': self.sum_x,
+			'sum_y': self.sum_y,
+			'sum_xx': self.sum_xx,
+			'sum_xy': self.sum_xy
+		}
+
+		model_dir = os.path.dirname(os.path.abspath(self.model_path))
+		fd, tmp_path = tempfile.mkstemp(dir=model_dir)
+		with os.fdopen(fd, 'w') as f_out:
+			json.dump(model, f_out)
+		os.rename(tmp_path, self.model_path)
+
+	def observe(self, heavy_atom_count, cpu_hours):
+		"""
+		This method adds cpu hours of one successful job
+		to the fit.
+		"""
+		if cpu_hours <= 0:
+			return
+
+		x = float(heavy_atom_count)
+		y = math.log(cpu_hours)
+		self.sample_count += 1
+		self.sum_x += x
+		self.sum_y += y
+		self.sum_xx += x*x
+		self.sum_xy += x*y
+
+	def get_coefficients(self):
+		"""
+		Returns least square (a, b) of log(hours) = a + b*n,
+		or None if there are not enough jobs observed
+		"""
+		n = self.sample_count
+		denominator = n*self.sum_xx - self.sum_x**2
+		if n < 2 or denominator <= 0:
+			return None
+
+		b = (n*self.sum_xy - self.sum_x*self.sum_y)/denominator
+		a = (self.sum_y - b*self.sum_x)/n
+		return a, b
+
+	def predict_cpu_hours(self, heavy_atom_count):
+
+		coefficients = self.get_coefficients()
+		if coefficients is None:
+			return None
+
+		a, b = coefficients
+		return math.exp(a + b*heavy_atom_count)
+
+	def predict_procs_num(self, heavy_atom_count):
+
+		for max_heavy_atom_count, procs_num in self.procs_num_tiers:
+			if heavy_atom_count <= max_heavy_atom_count:
+				return procs_num
+		return self.max_procs_num
+
+	def predict_memory_mb(self, heavy_atom_count):
+
+		memory_mb = self.memory_per_heavy_atom_mb*heavy_atom_count
+		return int(min(self.max_memory_mb, max(self.min_memory_mb, memory_mb)))
+
+	def predict_walltime_hours(self, heavy_atom_count, procs_num):
+		"""
+		Returns walltime in hours for the job running on
+		procs_num processors, with safety margin
+		"""
+		cpu_hours = self.predict_cpu_hours(heavy_atom_count)
+		if cpu_hours is None:
+			return self.default_walltime_hours
+
+		walltime_hours = cpu_hours/(procs_num*self.parallel_efficiency)*self.safety_factor
+		return min(self.max_walltime_hours, max(self.min_walltime_hours, walltime_hours))
+
+	def predict_resources(self, heavy_atom_count):
+		"""
+		Returns walltime (e.g., 2:00:00), procs_num (e.g., 32)
+		and memory (e.g., 1500mb) for the job, or None if there
+		are not enough jobs observed, in which case callers keep
+		their own resources
+		"""
+		if self.get_coefficients() is None:
+			return None
+
+		procs_num = self.predict_procs_num(heavy_atom_count)
+		memory_mb = self.predict_memory_mb(heavy_atom_count)
+		walltime_hours = self.predict_walltime_hours(heavy_atom_count, procs_num)
+
+		return format_walltime(walltime_hours), str(procs_num), '{0}mb'.format(memory_mb)
+
+def format_walltime(walltime_hours):
+	"""
+	This method formats hours as slurm walltime, e.g.,
+	2.5 as 2:30:00, rounding up to whole minutes.
+	"""
+	minutes = int(math.ceil(walltime_hours*60))
+	return '{0}:{1:02d}:00'.format(minutes//60, minutes%60)
@@ -20,9 +20,16 @@
 import os
 import time
 import shutil
+import multiprocessing
+
+import pymongo
 
 import autoqm.utils
+import autoqm.packer
+import autoqm.indexer
+import autoqm.metrics
 import autoqm.connector
+from autoqm.writer import BulkUpdateWriter
 
 
 def select_push_target(registration_table,
@@ -32,109 +39,277 @@ def select_push_target(registration_table,
 	This method is to inform job pusher which targets 
 	to push, which need meet three requirements:
 	1. status is job_success
-	2. job files (.log and .inp) located as expected
+	2. job files (.log and .inp) located as expected,
+	   either in job folder or in its container
 	3. results table doesn't have this job at
 	   that level of theory
 
+	Level of theory is read from the registration doc, 
+	older docs without it get it from input file once 
+	and have it saved back.
+
 	Returns a list of targets with necessary meta data
 	"""
 	reg_query = {"status":"job_success"}
-	targets = list(registration_table.find(reg_query))
+	reg_projection = {"aug_inchi": 1, 
+					"SMILES_input": 1, 
+					"level_of_theory": 1}
+	targets = list(registration_table.find(reg_query, reg_projection))
+
+	candidate_targets = []
+	job_index = autoqm.indexer.JobIndex(success_data_path)
+	with BulkUpdateWriter(registration_table) as writer:
+		for target in targets:
+			aug_inchi = str(target['aug_inchi'])
+			spec_name = aug_inchi.replace('/', '_slash_')
+			spec_path = os.path.join(success_data_path, spec_name)
+			inp_path = os.path.join(spec_path, 'input.inp')
+			if job_index.has_job_files(spec_name, ['input.log', 'input.inp']):
+				if 'level_of_theory' not in target:
+					target['level_of_theory'] = autoqm.utils.get_level_of_theory(inp_path)
+
+					query = {"aug_inchi": aug_inchi}
+					update_field = {
+						'level_of_theory': target['level_of_theory']
+					}
+					writer.update(query, update_field)
+
+				candidate_targets.append(target)
+
+	# query results table for all candidates at once
+	aug_inchis = [str(target['aug_inchi']) for target in candidate_targets]
+	pushed_keys = get_pushed_keys(results_table, aug_inchis)
 
 	selected_targets = []
-	for target in targets:
-		aug_inchi = str(target['aug_inchi'])
-		spec_name = aug_inchi.replace('/', '_slash_')
-		spec_path = os.path.join(success_data_path, spec_name)
-		log_path = os.path.join(spec_path, 'input.log')
-		inp_path = os.path.join(spec_path, 'input.inp')
-		if os.path.exists(log_path) and os.path.exists(inp_path):
-			level_of_theory = autoqm.utils.get_level_of_theory(inp_path)
-
-			# query results table
-			res_query = {"aug_inchi":aug_inchi, 
-						"level_of_theory":level_of_theory}
-			res_entries = list(results_table.find(res_query))
-			if len(res_entries) == 0:
-				# means no records of this target
-				# in results table
-				selected_targets.append(target)
+	for target in candidate_targets:
+		key = (str(target['aug_inchi']), str(target['level_of_theory']))
+		if key not in pushed_keys:
+			# means no records of this target
+			# in results table
+			selected_targets.append(target)
 	return selected_targets
 
-def push_jobs(registration_table, results_table, success_data_path):
+def get_pushed_keys(results_table, aug_inchis, chunk_size=1000):
+	"""
+	This method queries results table for given aug_inchis
+	with one "$in" query per chunk.
+
+	Returns a set of (aug_inchi, level_of_theory) already
+	in results table
+	"""
+	pushed_keys = set()
+	projection = {"_id": 0, "aug_inchi": 1, "level_of_theory": 1}
+	for i in range(0, len(aug_inchis), chunk_size):
+		res_query = {"aug_inchi": {"$in": aug_inchis[i:i+chunk_size]}}
+		for res_entry in results_table.find(res_query, projection):
+			pushed_keys.add((str(res_entry['aug_inchi']), 
+							str(res_entry.get('level_of_theory'))))
+
+	return pushed_keys
+
+def insert_results(results_table, insert_entries):
+	"""
+	This method inserts entries into results table in one
+	unordered insert_many. Entries already in results table,
+	which violate the unique (aug_inchi, level_of_theory) index,
+	are skipped.
+
+	Returns number of entries inserted
+	"""
+	if not insert_entries:
+		return 0
+
+	try:
+		result = results_table.insert_many(insert_entries, ordered=False)
+		return len(result.inserted_ids)
+	except pymongo.errors.BulkWriteError as e:
+		for write_error in e.details.get('writeErrors', []):
+			# 11000 is duplicate key error
+			if write_error['code'] != 11000:
+				raise
+		return e.details['nInserted']
+
+def get_thermo_values(thermo):
+	"""
+	This method converts thermo data from cantherm
+	into the values pushed to results table.
+	"""
+	thermo_values = {
+		"Hf298(kcal/mol)" : thermo.H298.value_si/1000/4.184, 
+		"S298(cal/mol/K)" : thermo.S298.value_si/4.184, 
+		"Cp300(cal/mol/K)" : thermo.Cpdata.value_si[0]/4.184, 
+		"Cp400(cal/mol/K)" : thermo.Cpdata.value_si[1]/4.184, 
+		"Cp500(cal/mol/K)" : thermo.Cpdata.value_si[2]/4.184, 
+		"Cp600(cal/mol/K)" : thermo.Cpdata.value_si[3]/4.184, 
+		"Cp800(cal/mol/K)" : thermo.Cpdata.value_si[4]/4.184, 
+		"Cp1000(cal/mol/K)" : thermo.Cpdata.value_si[5]/4.184, 
+		"Cp1500(cal/mol/K)" : thermo.Cpdata.value_si[6]/4.184
+	}
+	return thermo_values
+
+def run_cantherm_job(aug_inchi, spec_path, model_chemistry, smiles):
+	"""
+	This method runs cantherm for one target.
+
+	Returns aug_inchi, thermo values and error message
+	"""
+	try:
+		thermo = autoqm.utils.run_cantherm(spec_path, model_chemistry, smiles)
+		return aug_inchi, get_thermo_values(thermo), None
+	except Exception as e:
+		return aug_inchi, None, '{0}: {1}'.format(type(e).__name__, e)
+
+def run_cantherm_worker(connection, cantherm_job):
+	"""
+	This method is the entry of a cantherm worker process, 
+	it sends the result back to the parent through connection.
+	"""
+	connection.send(run_cantherm_job(*cantherm_job))
+	connection.close()
+
+def run_cantherm_jobs(cantherm_jobs, processes=1, timeout=None):
+	"""
+	This method runs cantherm for a list of 
+	(aug_inchi, spec_path, model_chemistry, smiles) jobs.
+
+	With processes larger than 1 or a timeout, each job runs in 
+	a worker process, at most processes of them at a time, and a
+	worker running longer than timeout seconds is terminated.
+
+	Yields (aug_inchi, thermo_values, error) as each job finishes
+	"""
+	if processes <= 1 and timeout is None:
+		for cantherm_job in cantherm_jobs:
+			yield run_cantherm_job(*cantherm_job)
+		return
+
+	pending_jobs = list(cantherm_jobs)
+	running_workers = []
+	while pending_jobs or running_workers:
+		# start workers for pending jobs
+		while pending_jobs and len(running_workers) < max(processes, 1):
+			cantherm_job = pending_jobs.pop(0)
+			receiver, sender = multiprocessing.Pipe(duplex=False)
+			worker = multiprocessing.Process(target=run_cantherm_worker,
+											args=(sender, cantherm_job))
+			worker.daemon = True
+			worker.start()
+			sender.close()
+			running_workers.append((cantherm_job[0], worker, receiver, time.time()))
+
+		time.sleep(0.1)
+
+		# collect finished, crashed and timed out workers
+		still_running_workers = []
+		for aug_inchi, worker, receiver, start_time in running_workers:
+			result = None
+			if receiver.poll():
+				try:
+					result = receiver.recv()
+				except EOFError:
+					result = (aug_inchi, None, 'Worker exited with code {0}.'.format(worker.exitcode))
+			elif not worker.is_alive():
+				result = (aug_inchi, None, 'Worker exited with code {0}.'.format(worker.exitcode))
+			elif timeout is not None and time.time() - start_time > timeout:
+				worker.terminate()
+				result = (aug_inchi, None, 'Timeout after {0} seconds.'.format(timeout))
+
+			if result is None:
+				still_running_workers.append((aug_inchi, worker, receiver, start_time))
+			else:
+				worker.join()
+				receiver.close()
+				yield result
+
+		running_workers = still_running_workers
+
+def push_jobs(registration_table, 
+			results_table, 
+			success_data_path, 
+			insert_batch_size=100,
+			processes=1,
+			timeout=None):
+	"""
+	This method pushes jobs with following steps:
+	1. select jobs to push
+	2. run cantherm for them, in a pool of processes
+	   workers with a per-job timeout if requested
+	3. insert results in batches as cantherm jobs finish
+	"""
+	# make sure results table rejects duplicates
+	autoqm.connector.ensure_results_indexes(results_table)
 
 	# select push targets
 	targets = select_push_target(registration_table,
 								results_table,
 								success_data_path)
 
+	cantherm_jobs = []
+	target_info_dict = {}
 	for target in targets:
 		aug_inchi = str(target['aug_inchi'])
 		spec_name = aug_inchi.replace('/', '_slash_')
 		spec_path = os.path.join(success_data_path, spec_name)
 
-		inp_path = os.path.join(spec_path, 'input.inp')
-		model_chemistry = autoqm.utils.get_level_of_theory(inp_path)
+		model_chemistry = str(target['level_of_theory'])
 
 		smiles = str(target['SMILES_input'])
 
-		# run cantherm
-		thermo = autoqm.utils.run_cantherm(spec_path, model_chemistry, smiles)
-		
-		# push to results table
-		Hf298 = thermo.H298.value_si/1000/4.184  # kcal/mol
-		S298 = thermo.S298.value_si/4.184		 # cal/mol/K
-		Cp300 = thermo.Cpdata.value_si[0]/4.184  # cal/mol/K
-		Cp400 = thermo.Cpdata.value_si[1]/4.184  # cal/mol/K
-		Cp500 = thermo.Cpdata.value_si[2]/4.184  # cal/mol/K
-		Cp600 = thermo.Cpdata.value_si[3]/4.184  # cal/mol/K
-		Cp800 = thermo.Cpdata.value_si[4]/4.184  # cal/mol/K
-		Cp1000 = thermo.Cpdata.value_si[5]/4.184 # cal/mol/K
-		Cp1500 = thermo.Cpdata.value_si[6]/4.184 # cal/mol/K
-
-		# check results table again there's no
-		# same entry
-		res_query = {"aug_inchi":aug_inchi, 
-					"level_of_theory":model_chemistry}
-		res_entries = list(results_table.find(res_query))
-		
-		if len(res_entries) > 0:
+		cantherm_jobs.append((aug_inchi, spec_path, model_chemistry, smiles))
+		target_info_dict[aug_inchi] = (smiles, model_chemistry)
+
+	# run cantherm
+	insert_entries = []
+	insert_count = 0
+	for aug_inchi, thermo_values, error in run_cantherm_jobs(cantherm_jobs, 
+															processes=processes, 
+															timeout=timeout):
+		if error is not None:
+			print('CanTherm fails for {0}: {1}'.format(aug_inchi, error))
 			continue
 
-		# do the insertion
+		# collect the insertion
+		smiles, model_chemistry = target_info_dict[aug_inchi]
 		insert_entry = {"aug_inchi" : aug_inchi, 
-						"Hf298(kcal/mol)" : Hf298, 
-						"S298(cal/mol/K)" : S298, 
-						"Cp300(cal/mol/K)" : Cp300, 
-						"Cp400(cal/mol/K)" : Cp400, 
-						"Cp500(cal/mol/K)" : Cp500, 
-						"Cp600(cal/mol/K)" : Cp600, 
-						"Cp800(cal/mol/K)" : Cp800, 
-						"Cp1000(cal/mol/K)" : Cp1000, 
-						"Cp1500(cal/mol/K)" : Cp1500, 
 						"timestamp" : time.time(), 
 						"SMILES_input" : smiles, 
 						"level_of_theory" : model_chemistry}
+		insert_entry.update(thermo_values)
 
-		results_table.insert_one(insert_entry)
+		insert_entries.append(insert_entry)
+		if len(insert_entries) >= insert_batch_size:
+			insert_count += insert_results(results_table, insert_entries)
+			insert_entries = []
+
+	# do the insertion
+	insert_count += insert_results(results_table, insert_entries)
+	print("Pushed {0} jobs.".format(insert_count))
+	autoqm.metrics.add_processed(insert_count)
 
 
 def run():
 	# get config info
 	config = autoqm.utils.read_config()
 
-	# connect to thermo central db
-	auth_info = autoqm.utils.get_TCD_authentication_info()
-	tcdi = autoqm.connector.ThermoCentralDatabaseInterface(*auth_info)
-	tcd =  getattr(tcdi.client, 'thermoCentralDB')
-
 	# get registration table and result table
-	# and specify success job data path
-	pusher_reg_table = getattr(tcd, 'saturated_ringcore_table')
-	pusher_res_table = getattr(tcd, 'saturated_ringcore_res_table')
+	# from thermo central db and specify 
+	# success job data path
+	pusher_reg_table = autoqm.connector.get_collection('saturated_ringcore_table')
+	pusher_res_table = autoqm.connector.get_collection('saturated_ringcore_res_table')
 	success_data_path = os.path.join(config['QuantumMechanicJob']['scratch_data_path'],
 									'success')
 
-	push_jobs(pusher_reg_table, pusher_res_table, success_data_path)
+	processes = int(config['QuantumMechanicJob'].get('cantherm_processes', 1))
+	timeout = config['QuantumMechanicJob'].get('cantherm_timeout')
+	if timeout is not None:
+		timeout = float(timeout)
+
+	with autoqm.metrics.stage_run('pusher'):
+		push_jobs(pusher_reg_table, 
+				pusher_res_table, 
+				success_data_path,
+				processes=processes,
+				timeout=timeout)
 
-run()
\ No newline at end of file
+if __name__ == '__main__':
+	run()
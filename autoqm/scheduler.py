@@ -0,0 +1,407 @@
+import os
+import re
+import sys
+import json
+import time
+import errno
+import fcntl
+import tempfile
+import subprocess
+import multiprocessing
+
+import autoqm.utils
+import autoqm.metrics
+
+class SchedulerBackend(object):
+	"""
+	A base class for schedulers which launcher submits
+	job scripts to and checker asks for job statuses.
+
+	Job statuses are reported as off_queue (finished
+	or never known), job_launched or job_running.
+	"""
+
+	# whether several jobs can be submitted
+	# as one slurm job array
+	supports_arrays = False
+	# whether the backend keeps its own copy of a
+	# submitted script, so script_dir can be removed
+	copies_scripts = False
+
+	def submit(self, script_name, script_dir):
+		"""
+		This method submits script_name in script_dir.
+
+		Returns job id, or None if submission fails
+		"""
+		raise NotImplementedError()
+
+	def get_statuses(self, job_ids):
+		"""
+		Returns a dictionary mapping each job_id to
+		off_queue or job_launched or job_running
+		"""
+		raise NotImplementedError()
+
+	def get_status(self, job_id):
+
+		return self.get_statuses([job_id])[job_id]
+
+class SlurmBackend(SchedulerBackend):
+	"""
+	A class for submitting jobs with "sbatch" and polling
+	them with "squeue" in batch, or "scontrol" per job if
+	polling is per_job.
+	"""
+
+	supports_arrays = True
+	copies_scripts = True
+
+	def __init__(self, polling='batch', chunk_size=500):
+		self.polling = polling
+		self.chunk_size = chunk_size
+
+	def submit(self, script_name, script_dir):
+		"""
+		This method submits a slurm script with "sbatch"
+		from script_dir, without changing working directory
+		of the process, which other stages may share.
+
+		Returns job id, or None if submission fails
+		"""
+		commands = ['sbatch', script_name]
+		returncode, stdout, stderr = autoqm.metrics.run_subprocess(commands, cwd=script_dir)
+
+		# sbatch may warn on stderr and still submit,
+		# so only exit status tells a failure
+		if stderr:
+			print(stderr)
+		if returncode != 0:
+			return None
+
+		# get job id from stdout, e.g., "Submitted batch job 5022607"
+		match = re.search(r'Submitted batch job (\d+)', stdout)
+		if match is None:
+			print('Unexpected sbatch output: {0}'.format(stdout))
+			return None
+		return match.group(1)
+
+	def get_statuses(self, job_ids):
+
+		if self.polling == 'batch':
+			return self.get_queue_statuses(job_ids)
+
+		return dict((job_id, self.get_job_status(job_id)) for job_id in job_ids)
+
+	def get_job_status(self, job_id):
+		"""
+		This method checks slurm status of a job given job_id,
+		which can also be an array task, e.g., 5037088_3
+
+		Returns off_queue or job_launched or job_running
+		"""
+		commands = ['scontrol', 'show', 'jobid', job_id]
+		returncode, stdout, stderr = autoqm.metrics.run_subprocess(commands)
+
+		if "Invalid job id specified" in stderr:
+			return "off_queue"
+
+		# array tasks have job_id <array job id>_<array index>
+		# and are shown as "ArrayJobId=<array job id>"
+		if '_' in job_id:
+			expected_string = "ArrayJobId={0}".format(job_id.split('_')[0])
+		else:
+			expected_string = "JobId={0}".format(job_id)
+		assert expected_string in stdout, 'Slurm cannot show details for job_id {0}'.format(job_id)
+		for stdout_line in stdout.splitlines():
+			if "JobState=" in stdout_line:
+				tokens = [token.strip() for token in stdout_line.split() if "JobState=" in token]
+				status = tokens[0].replace('JobState=', '').lower()
+				if status == "running":
+					return "job_running"
+				else:
+					return "job_launched"
+
+	def get_queue_statuses(self, job_ids):
+		"""
+		This method checks slurm status of many jobs at once
+		by calling "squeue" once per chunk of job_ids instead of
+		"scontrol show jobid" once per job. Array tasks are listed
+		one per line as <array job id>_<array index>.
+
+		Returns a dictionary mapping each job_id to off_queue
+		or job_launched or job_running
+		"""
+		job_ids = [str(job_id).strip() for job_id in job_ids]
+		status_map = dict((job_id, "off_queue") for job_id in job_ids)
+
+		for i in range(0, len(job_ids), self.chunk_size):
+			chunk = job_ids[i:i+self.chunk_size]
+			# -r lists one line per array task
+			commands = ['squeue', '-h', '-r', '-o', '%i %T',
+						'-j', ','.join(chunk)]
+			returncode, stdout, stderr = autoqm.metrics.run_subprocess(commands)
+
+			# squeue complains about invalid job ids only when
+			# none of the requested jobs is known, which means
+			# the whole chunk is off queue
+			if "Invalid job id specified" in stderr:
+				continue
+
+			assert returncode == 0, 'Slurm cannot show details for jobs: {0}'.format(stderr)
+			for stdout_line in stdout.splitlines():
+				tokens = stdout_line.split()
+				if len(tokens) != 2 or tokens[0] not in status_map:
+					continue
+
+				job_id, status = tokens[0], tokens[1].lower()
+				if status == "running":
+					status_map[job_id] = "job_running"
+				else:
+					status_map[job_id] = "job_launched"
+
+		return status_map
+
+class LocalBackend(SchedulerBackend):
+	"""
+	A class for running job scripts, e.g., submit.sl, with
+	bash on local cores, at most max_jobs at a time.
+
+	Jobs are tracked in a JSON state file shared by
+	launcher and checker, even in different processes,
+	under an exclusive lock. Queued jobs are started on
+	each submit and status check, and by each finished
+	job, which runs dispatch before it exits, so the
+	queue drains even when no stage is running.
+	"""
+
+	def __init__(self, state_path, max_jobs=None):
+		self.state_path = os.path.abspath(state_path)
+		self.max_jobs = max_jobs or multiprocessing.cpu_count()
+
+		state_dir = os.path.dirname(self.state_path)
+		if not os.path.exists(state_dir):
+			os.makedirs(state_dir)
+
+	def submit(self, script_name, script_dir):
+
+		with open(self.state_path + '.lock', 'a') as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+			state = self.load_state()
+
+			job_id = str(state['next_job_id'])
+			state['next_job_id'] += 1
+			state['jobs'][job_id] = {
+				'script_name': script_name,
+				'script_dir': os.path.abspath(script_dir),
+				'status': 'queued',
+				'pid': None,
+				'submit_time': time.time()
+			}
+
+			self.update_jobs(state)
+			self.save_state(state)
+
+		return job_id
+
+	def dispatch(self):
+		"""
+		This method marks finished jobs and starts
+		queued ones under the lock of the state file.
+
+		Returns the updated state
+		"""
+		with open(self.state_path + '.lock', 'a') as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+			state = self.load_state()
+			self.update_jobs(state)
+			self.save_state(state)
+
+		return state
+
+	def get_statuses(self, job_ids):
+
+		state = self.dispatch()
+
+		status_map = {}
+		for job_id in job_ids:
+			job_id = str(job_id).strip()
+			job = state['jobs'].get(job_id)
+			if job is None or job['status'] == 'finished':
+				status_map[job_id] = "off_queue"
+			elif job['status'] == 'running':
+				status_map[job_id] = "job_running"
+			else:
+				status_map[job_id] = "job_launched"
+
+		return status_map
+
+	def load_state(self):
+
+		if not os.path.exists(self.state_path):
+			return {'next_job_id': 1, 'jobs': {}}
+
+		with open(self.state_path, 'r') as f_in:
+			return json.load(f_in)
+
+	def save_state(self, state):
+
+		fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.state_path))
+		with os.fdopen(fd, 'w') as f_out:
+			json.dump(state, f_out)
+		os.rename(tmp_path, self.state_path)
+
+	def get_exit_path(self, job_id):
+
+		return '{0}.{1}.exit'.format(self.state_path, job_id)
+
+	def update_jobs(self, state):
+		"""
+		This method marks running jobs whose processes are
+		gone as finished, drops finished jobs older than a
+		week, and starts queued jobs in submission order
+		while fewer than max_jobs are running.
+		"""
+		running_count = 0
+		for job_id, job in list(state['jobs'].items()):
+			if job['status'] == 'running':
+				exit_path = self.get_exit_path(job_id)
+				if not os.path.exists(exit_path) and \
+					is_process_running(job['pid'], job.get('pid_start_time')):
+					running_count += 1
+					continue
+
+				job['status'] = 'finished'
+				job['end_time'] = time.time()
+				if os.path.exists(exit_path):
+					with open(exit_path, 'r') as f_in:
+						job['returncode'] = int(f_in.read().strip() or -1)
+					os.remove(exit_path)
+
+			elif job['status'] == 'finished':
+				if time.time() - job.get('end_time', 0) > 7*24*3600:
+					del state['jobs'][job_id]
+
+		queued_jobs = sorted((job['submit_time'], int(job_id))
+							for job_id, job in state['jobs'].items()
+							if job['status'] == 'queued')
+		for submit_time, job_id in queued_jobs:
+			if running_count >= self.max_jobs:
+				break
+
+			job_id = str(job_id)
+			job = state['jobs'][job_id]
+			job['pid'] = self.start_job(job_id, job)
+			job['pid_start_time'] = get_process_start_time(job['pid'])
+			job['status'] = 'running'
+			job['start_time'] = time.time()
+			running_count += 1
+
+	def start_job(self, job_id, job):
+		"""
+		This method starts the job script with bash in its own
+		session, so it outlives the stage starting it, and has
+		its exit status written next to the state file. The job
+		then runs dispatch of this module to start queued jobs.
+
+		Returns pid of the job
+		"""
+		dispatch_command = '"{0}" -m autoqm.scheduler dispatch "{1}" {2}'.format(sys.executable,
+																		self.state_path,
+																		self.max_jobs)
+		command = 'bash {0} > out.log 2>&1; echo $? > "{1}"; exec {2} > /dev/null 2>&1'.format(job['script_name'],
+																							self.get_exit_path(job_id),
+																							dispatch_command)
+
+		# make sure the job finds autoqm, however the stage was started
+		package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+		env = dict(os.environ)
+		env['PYTHONPATH'] = os.pathsep.join([package_dir] + [path for path in [env.get('PYTHONPATH')] if path])
+
+		process = subprocess.Popen(['bash', '-c', command],
+									cwd=job['script_dir'],
+									env=env,
+									preexec_fn=os.setsid)
+		return process.pid
+
+def get_process_start_time(pid):
+	"""
+	Returns start time of process pid in clock ticks
+	since boot, read from /proc, or None if unknown
+	"""
+	try:
+		with open('/proc/{0}/stat'.format(pid), 'r') as f_in:
+			stat = f_in.read()
+	except (IOError, OSError):
+		return None
+
+	# command name in parentheses may contain spaces,
+	# and starttime is the 20th field after it
+	fields = stat[stat.rfind(')')+2:].split()
+	return int(fields[19])
+
+def is_process_running(pid, start_time=None):
+	"""
+	This method checks if process pid is still running,
+	reaping it first if it's a finished child of this process.
+	If start_time is given, a process with another start time
+	has reused the pid, and the job's process is not running.
+	"""
+	try:
+		reaped_pid, _ = os.waitpid(pid, os.WNOHANG)
+		if reaped_pid == pid:
+			return False
+	except OSError as e:
+		# not a child of this process
+		if e.errno != errno.ECHILD:
+			raise
+
+	try:
+		os.kill(pid, 0)
+	except OSError as e:
+		if e.errno != errno.EPERM:
+			return False
+
+	if start_time is not None:
+		current_start_time = get_process_start_time(pid)
+		if current_start_time is not None and current_start_time != start_time:
+			return False
+
+	return True
+
+def get_backend():
+	"""
+	This method returns the scheduler backend set by
+	scheduler in config, slurm (default) or local, e.g.,
+
+	scheduler: local
+	local_max_jobs: 16
+	local_state_path: /scratch/autoqm/local_scheduler/state.json
+	"""
+	qm_config = autoqm.utils.read_config()['QuantumMechanicJob']
+	scheduler = qm_config.get('scheduler', 'slurm')
+
+	if scheduler == 'slurm':
+		return SlurmBackend(polling=qm_config.get('slurm_polling', 'batch'))
+	elif scheduler == 'local':
+		state_path = qm_config.get('local_state_path',
+							os.path.join(qm_config['scratch_data_path'], 'local_scheduler', 'state.json'))
+		max_jobs = qm_config.get('local_max_jobs')
+		if max_jobs is not None:
+			max_jobs = int(max_jobs)
+		return LocalBackend(state_path, max_jobs=max_jobs)
+	else:
+		raise Exception('Unknown scheduler {0}.'.format(scheduler))
+
+def dispatch(state_path, max_jobs):
+	"""
+	This method starts queued jobs of the local
+	scheduler with state file state_path.
+	"""
+	LocalBackend(state_path, max_jobs=max_jobs).dispatch()
+
+if __name__ == '__main__':
+	# run by finished local jobs, e.g.,
+	# python -m autoqm.scheduler dispatch <state_path> <max_jobs>
+	if len(sys.argv) == 4 and sys.argv[1] == 'dispatch':
+		dispatch(sys.argv[2], int(sys.argv[3]))
@@ -1,19 +1,29 @@
 import os
+import re
+import mmap
 import shutil
+import hashlib
+import tempfile
 import ConfigParser
 
 from rmgpy.species import Species
+from rmgpy.molecule import Molecule
+from rmgpy.molecule.element import getElement
 from rmgpy.cantherm.main import CanTherm
 from rmgpy.cantherm.thermo import ThermoJob
 
+import autoqm.packer
+
 def read_config(cfg_path='default'):
-	'''This function reads a configuration file and returns an equivalent dictionary'''
+	'''This function reads a configuration file and returns an equivalent dictionary.
+	The default one is autoqm/config.cfg unless AUTOQM_CONFIG points to another.'''
 
 	config_parser = ConfigParser.SafeConfigParser()
 	config_parser.optionxform = str
 
 	if cfg_path == 'default':
-		cfg_path = os.path.join(os.path.dirname(__file__), 'config.cfg')
+		cfg_path = os.environ.get('AUTOQM_CONFIG', 
+								os.path.join(os.path.dirname(__file__), 'config.cfg'))
 	with open(cfg_path, 'r') as fid:
 		config_parser.readfp(fid)
 	return config_parser._sections
@@ -34,25 +44,296 @@ def get_TCD_authentication_info(cfg_path='default'):
  
 	return 'None', 0, 'None', 'None'
 
+def get_TCD_connection_options(cfg_path='default'):
+	"""
+	This helper method returns keyword arguments of
+	ThermoCentralDatabaseInterface for connection pool size, 
+	timeouts and retries set in config, all of them optional, e.g.,
+
+	[ThermoCentralDatabase]
+	TCD_MAX_POOL_SIZE: 100
+	TCD_SERVER_SELECTION_TIMEOUT_MS: 2000
+	TCD_CONNECT_TIMEOUT_MS: 20000
+	TCD_SOCKET_TIMEOUT_MS: 60000
+	TCD_RETRY_WRITES: True
+	TCD_RETRY_READS: True
+	"""
+	option_types = {
+		'TCD_MAX_POOL_SIZE': ('max_pool_size', int),
+		'TCD_SERVER_SELECTION_TIMEOUT_MS': ('server_selection_timeout_ms', int),
+		'TCD_CONNECT_TIMEOUT_MS': ('connect_timeout_ms', int),
+		'TCD_SOCKET_TIMEOUT_MS': ('socket_timeout_ms', int),
+		'TCD_RETRY_WRITES': ('retry_writes', lambda value: value.strip().lower() == 'true'),
+		'TCD_RETRY_READS': ('retry_reads', lambda value: value.strip().lower() == 'true')
+	}
+
+	connection_options = {}
+	try:
+		config = read_config(cfg_path)
+		for key, value in config['ThermoCentralDatabase'].items():
+			if key in option_types:
+				option_name, option_type = option_types[key]
+				connection_options[option_name] = option_type(value)
+	except KeyError:
+		print('Thermo Central Database Configuration File  Not Completely Set!')
+
+	return connection_options
+
+level_of_theory_dict = {
+	"um062x/cc-pvtz": "M06-2X/cc-pVTZ"
+}
+
 def get_level_of_theory(inp_path):
 	"""
 	This helper method returns level of theory given
 	a quantum input file. 
 
-	Currently it supports Gaussian inputs only.
+	Currently it supports Gaussian inputs only. The input 
+	file can also be read from a job container.
 	"""
-	level_of_theory_dict = {
-		"um062x/cc-pvtz": "M06-2X/cc-pVTZ"
-	}
-	with open(inp_path, 'r') as f_in:
+	spec_path, inp_file_name = os.path.split(inp_path)
+	with autoqm.packer.open_job_file(spec_path, inp_file_name) as f_in:
 		for line in f_in.readlines():
-			if '# opt freq ' in line:
-				level_of_theory_in_file = line.split(' ')[3].strip().lower()
-				level_of_theory = level_of_theory_dict[level_of_theory_in_file]
-				return level_of_theory
+			# the file is opened in binary mode
+			line = line.decode('utf-8')
+			# any route, e.g., "# opt freq um062x/cc-pvtz" or
+			# "# freq um062x/cc-pvtz geom=check guess=read"
+			# of inputs restarted by job fixer
+			if not line.strip().startswith('#'):
+				continue
+			for token in line.split():
+				if '/' in token:
+					level_of_theory = standardize_level_of_theory(token)
+					return level_of_theory
 		else:
 			raise Exception('Can not find level of theory in {0}.'.format(inp_path))
 
+def standardize_level_of_theory(level_theory):
+	"""
+	This helper method maps the level of theory written
+	in quantum input files, e.g., um062x/cc-pvtz, to the
+	one used by cantherm and results table.
+	"""
+	return level_of_theory_dict[level_theory.strip().lower()]
+
+def scan_gaussian_log(log_path, tail_size=4096):
+	"""
+	This helper method scans a Gaussian log file backwards
+	from its end through mmap, so only the tail of the log
+	is read from disk.
+
+	Returns the number of normal terminations counted back
+	from the end of the log (at most two, stopping at an error
+	termination) and the last standard orientation block as a
+	list of (atomic number, x, y, z) tuples. The geometry is None
+	if the log does not end with a normal termination.
+	"""
+	with open(log_path, 'rb') as f_in:
+		size = os.fstat(f_in.fileno()).st_size
+		if size == 0:
+			return 0, None
+
+		log_map = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			# a finished job reports its termination
+			# within the last few lines of the log
+			tail_start = max(0, size - tail_size)
+			last_normal = log_map.rfind(b'Normal termination', tail_start)
+			last_error = log_map.rfind(b'Error termination', tail_start)
+			if last_normal == -1 or last_error > last_normal:
+				return 0, None
+
+			normal_termination_count = 1
+			earlier_normal = log_map.rfind(b'Normal termination', 0, last_normal)
+			if earlier_normal != -1:
+				earlier_error = log_map.rfind(b'Error termination', earlier_normal, last_normal)
+				if earlier_error == -1:
+					normal_termination_count = 2
+
+			coordinates = None
+			orientation = log_map.rfind(b'Standard orientation:', 0, last_normal)
+			if orientation != -1:
+				coordinates = parse_orientation_block(log_map, orientation)
+
+			return normal_termination_count, coordinates
+		finally:
+			log_map.close()
+
+def parse_orientation_block(log_map, position):
+	"""
+	This helper method parses an orientation block of a
+	Gaussian log which starts at given position, e.g.,
+
+	                 Standard orientation:
+	 ----------------------------------------------------------
+	 Center     Atomic      Atomic         Coordinates (Angstroms)
+	 Number     Number       Type         X           Y           Z
+	 ----------------------------------------------------------
+	      1          6           0     1.531622    0.664846   -0.109062
+	 ----------------------------------------------------------
+
+	Returns a list of (atomic number, x, y, z) tuples.
+	"""
+	# the atom rows sit between the second
+	# and the third dashed lines
+	dashed_line_starts = []
+	while len(dashed_line_starts) < 3:
+		position = log_map.find(b'-----', position)
+		if position == -1:
+			return None
+		dashed_line_starts.append(position)
+		position = log_map.find(b'\n', position)
+		if position == -1:
+			return None
+
+	rows_start = log_map.find(b'\n', dashed_line_starts[1]) + 1
+	rows = log_map[rows_start:dashed_line_starts[2]]
+
+	coordinates = []
+	for row in rows.splitlines():
+		tokens = row.split()
+		if len(tokens) != 6:
+			continue
+		coordinates.append((int(tokens[1]), 
+							float(tokens[3]), 
+							float(tokens[4]), 
+							float(tokens[5])))
+
+	return coordinates
+
+def get_xyz_string(coordinates, comment=''):
+	"""
+	This helper method converts a list of (atomic number, x, y, z)
+	tuples, e.g., from scan_gaussian_log, into XYZ format.
+	"""
+	xyz_lines = [str(len(coordinates)), comment]
+	for atomic_number, x, y, z in coordinates:
+		symbol = getElement(atomic_number).symbol
+		xyz_lines.append("{0:4s} {1:12.6f} {2:12.6f} {3:12.6f}".format(symbol, x, y, z))
+	xyz_lines.append('')
+
+	return '\n'.join(xyz_lines)
+
+def remove_inchi_stereo_layers(inchi):
+	"""
+	This helper method removes stereo layers, i.e., /b, /t,
+	/m and /s, from an InChI, so an InChI written from 3D
+	geometry compares with stereo-free aug_inchi.
+	"""
+	layers = inchi.split('/')
+	stereo_prefixes = ('b', 't', 'm', 's')
+	kept_layers = layers[:2] + [layer for layer in layers[2:] if layer[:1] not in stereo_prefixes]
+
+	return '/'.join(kept_layers)
+
+def get_formula_from_coordinates(coordinates):
+	"""
+	This helper method returns the Hill formula, 
+	e.g., C10H12, of a list of (atomic number, x, y, z)
+	tuples, in the same form as InChI formula layer.
+	"""
+	element_counts = {}
+	for coordinate in coordinates:
+		symbol = getElement(coordinate[0]).symbol
+		element_counts[symbol] = element_counts.get(symbol, 0) + 1
+
+	if 'C' in element_counts:
+		symbols = ['C'] + (['H'] if 'H' in element_counts else [])
+		symbols += sorted(s for s in element_counts if s not in ('C', 'H'))
+	else:
+		symbols = sorted(element_counts)
+
+	formula = ''
+	for symbol in symbols:
+		count = element_counts[symbol]
+		formula += symbol + (str(count) if count > 1 else '')
+
+	return formula
+
+def get_heavy_atom_count_from_formula(formula):
+	"""
+	This helper method counts non-hydrogen atoms
+	of a formula, e.g., 10 for C10H12.
+	"""
+	count = 0
+	for symbol, number in re.findall('([A-Z][a-z]?)(\d*)', formula):
+		if symbol != 'H':
+			count += int(number) if number else 1
+
+	return count
+
+def get_job_cpu_times(log_path, max_count=2):
+	"""
+	This helper method reads the "Job cpu time" reports
+	of a Gaussian log, e.g., one for opt and one for freq,
+	searching backwards from the end of the log through mmap.
+
+	Returns a list of cpu times in hours, in log order
+	"""
+	cpu_times = []
+	with open(log_path, 'rb') as f_in:
+		if os.fstat(f_in.fileno()).st_size == 0:
+			return cpu_times
+
+		log_map = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			end = len(log_map)
+			while len(cpu_times) < max_count:
+				position = log_map.rfind(b'Job cpu time:', 0, end)
+				if position == -1:
+					break
+
+				line_end = log_map.find(b'\n', position)
+				if line_end == -1:
+					line_end = len(log_map)
+				line = log_map[position:line_end].decode('ascii', 'ignore')
+
+				# e.g., Job cpu time: 0 days 2 hours 20 minutes 42.6 seconds.
+				tokens = line.split(':', 1)[1].split()
+				days, hours, minutes, seconds = [float(tokens[i]) for i in (0, 2, 4, 6)]
+				cpu_times.insert(0, days*24 + hours + minutes/60.0 + seconds/3600.0)
+				end = position
+		finally:
+			log_map.close()
+
+	return cpu_times
+
+def get_resonance_isomers(aug_inchi, cache_path=None):
+	"""
+	This helper method returns resonance isomers of the 
+	molecule given its aug_inchi. If cache_path is given, 
+	isomers are memoized there as adjacency lists in one
+	file per aug_inchi, so they're generated only once.
+	"""
+	cache_file = None
+	if cache_path is not None:
+		cache_key = hashlib.sha1(aug_inchi.encode('utf-8')).hexdigest()
+		cache_file = os.path.join(cache_path, cache_key + '.adj')
+		if os.path.exists(cache_file):
+			with open(cache_file, 'r') as f_in:
+				adjacency_lists = f_in.read().split('\n\n')
+			return [Molecule().fromAdjacencyList(adjacency_list) 
+					for adjacency_list in adjacency_lists if adjacency_list.strip()]
+
+	spec = Species(molecule=[Molecule().fromAugmentedInChI(aug_inchi)])
+	spec.generateResonanceIsomers()
+
+	if cache_file is not None:
+		if not os.path.exists(cache_path):
+			try:
+				os.makedirs(cache_path)
+			except OSError:
+				# created by another process meanwhile
+				pass
+		# write to a temporary file first so other 
+		# processes never read a partial file
+		fd, tmp_file = tempfile.mkstemp(dir=cache_path)
+		with os.fdopen(fd, 'w') as f_out:
+			f_out.write('\n\n'.join(mol.toAdjacencyList().strip() for mol in spec.molecule))
+		os.rename(tmp_file, cache_file)
+
+	return spec.molecule
+
 def get_testing_TCD_authentication_info():
 
     try:
@@ -165,15 +446,32 @@ rotors = []
 		f_in.write(species_file_string)
 
 def run_cantherm(spec_path, model_chemistry, smiles):
-
+	"""
+	This helper method runs cantherm in spec_path/cantherm,
+	or in a temporary folder if the job is packed into a
+	container, and returns the thermo data.
+	"""
 	# create folder for cantherm calculation
-	cantherm_folder = os.path.join(spec_path, 'cantherm')
-	if not os.path.exists(cantherm_folder):
-		os.mkdir(cantherm_folder)
+	packed = not os.path.isdir(spec_path)
+	if packed:
+		cantherm_folder = tempfile.mkdtemp(prefix='cantherm_')
+	else:
+		cantherm_folder = os.path.join(spec_path, 'cantherm')
+		if not os.path.exists(cantherm_folder):
+			os.mkdir(cantherm_folder)
+
+	try:
+		# copy log file to cantherm folder
+		autoqm.packer.extract_job_file(spec_path, 
+									'input.log', 
+									os.path.join(cantherm_folder, 'input.log'))
+
+		return run_cantherm_in_folder(cantherm_folder, model_chemistry, smiles)
+	finally:
+		if packed:
+			shutil.rmtree(cantherm_folder)
 
-	# copy log file to cantherm folder
-	log_file = os.path.join(spec_path, 'input.log')
-	shutil.copy(log_file, os.path.join(cantherm_folder, 'input.log'))
+def run_cantherm_in_folder(cantherm_folder, model_chemistry, smiles):
 
 	# create cantherm input and species files
 	create_cantherm_input(cantherm_folder, model_chemistry)
@@ -0,0 +1,112 @@
+import time
+
+import pymongo
+
+class BulkUpdateWriter(object):
+	"""
+	A class for buffering "$set" updates to a table and
+	flushing them as bulk writes, either when batch_size
+	updates are buffered or when flush_interval seconds
+	have passed since the last flush, which is checked
+	whenever an update is buffered.
+
+	Results of failed updates of every flush, including
+	those flushed by update or on exit, are collected in
+	failed_results for callers to inspect.
+
+	It can be used as a context manager, which flushes
+	the remaining updates on exit.
+
+	If outbox_table is given, updates of status (or archived)
+	written successfully are also appended to it as events.
+	"""
+
+	def __init__(self, table,
+				batch_size=500,
+				flush_interval=5.0,
+				ordered=False,
+				upsert=True,
+				outbox_table=None):
+		self.table = table
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.ordered = ordered
+		self.upsert = upsert
+		self.outbox_table = outbox_table
+		self.requests = []
+		self.failed_results = []
+		self.last_flush_time = time.time()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.flush()
+
+	def update(self, query, update_field):
+		"""
+		This method buffers one "$set" update and flushes
+		the buffer if it's full or old enough.
+		"""
+		self.requests.append((query, update_field))
+
+		if (len(self.requests) >= self.batch_size or
+			time.time() - self.last_flush_time >= self.flush_interval):
+			self.flush()
+
+	def flush(self):
+		"""
+		This method sends the buffered updates in one bulk write.
+
+		Returns a list of per-document results, each of which is
+		a dictionary with query, update_field, ok and error
+		"""
+		requests = self.requests
+		self.requests = []
+		self.last_flush_time = time.time()
+		if not requests:
+			return []
+
+		operations = [pymongo.UpdateOne(query,
+										{"$set": update_field},
+										upsert=self.upsert) for query, update_field in requests]
+
+		write_errors = {}
+		executed_count = len(requests)
+		try:
+			self.table.bulk_write(operations, ordered=self.ordered)
+		except pymongo.errors.BulkWriteError as e:
+			for write_error in e.details.get('writeErrors', []):
+				write_errors[write_error['index']] = write_error['errmsg']
+			# an ordered bulk write stops at its first error
+			if self.ordered and write_errors:
+				executed_count = min(write_errors) + 1
+
+		results = []
+		for index, (query, update_field) in enumerate(requests):
+			result = {
+				'query': query,
+				'update_field': update_field,
+				'ok': True,
+				'error': None
+			}
+			if index in write_errors:
+				result['ok'] = False
+				result['error'] = write_errors[index]
+			elif index >= executed_count:
+				result['ok'] = False
+				result['error'] = 'Not executed after an earlier error in ordered bulk write.'
+
+			if not result['ok']:
+				print('Update fails for {0}: {1}'.format(query, result['error']))
+				self.failed_results.append(result)
+			results.append(result)
+
+		if self.outbox_table is not None:
+			import autoqm.outbox
+
+			written_updates = [(result['query'], result['update_field']) for result in results if result['ok']]
+			events = autoqm.outbox.make_events(getattr(self.table, 'name', None), written_updates)
+			autoqm.outbox.append_events(self.outbox_table, events)
+
+		return results
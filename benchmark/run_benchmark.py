@@ -0,0 +1,433 @@
+# benchmark autoQM stages without the cluster
+# 1. seed a database stand-in with synthetic pending molecules
+# 2. put fake sbatch, squeue and scontrol on PATH
+# 3. run creator and launcher
+# 4. write synthetic gaussian logs for launched jobs
+# 5. run checker, archiver and pusher
+# 6. report seconds, molecules/second, database calls
+#    and subprocess calls of each stage
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+test_data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+							'..',
+							'test',
+							'data')
+checker_log_template = os.path.join(test_data_path,
+									'utils_data',
+									'test_species1',
+									'input.log')
+pusher_spec_template = os.path.join(test_data_path,
+									'pusher_data',
+									'success',
+									'InChI=1S_slash_C10H12_slash_c1-3-7-8(4-1)10-6-2-5-9(7)10_slash_h1-3,6-10H,4-5H2')
+pusher_smiles = 'C1=CC2C(C1)C1C=CCC21'
+
+# fake slurm commands log every call to
+# AUTOQM_BENCHMARK_CALLS, one line per call
+fake_commands = {
+	'sbatch': """#!/usr/bin/env python
+import os
+import fcntl
+with open(os.environ['AUTOQM_BENCHMARK_CALLS'], 'a') as f_calls:
+	f_calls.write('sbatch\\n')
+counter_path = os.environ['AUTOQM_BENCHMARK_CALLS'] + '.job_id'
+with open(counter_path, 'a+') as f_counter:
+	fcntl.flock(f_counter, fcntl.LOCK_EX)
+	f_counter.seek(0)
+	job_id = int(f_counter.read() or 1000000) + 1
+	f_counter.seek(0)
+	f_counter.truncate()
+	f_counter.write(str(job_id))
+print('Submitted batch job {0}'.format(job_id))
+""",
+	'squeue': """#!/usr/bin/env python
+import os
+with open(os.environ['AUTOQM_BENCHMARK_CALLS'], 'a') as f_calls:
+	f_calls.write('squeue\\n')
+""",
+	'scontrol': """#!/usr/bin/env python
+import os
+import sys
+with open(os.environ['AUTOQM_BENCHMARK_CALLS'], 'a') as f_calls:
+	f_calls.write('scontrol\\n')
+sys.stderr.write('slurm_load_jobs error: Invalid job id specified\\n')
+sys.exit(1)
+"""
+}
+
+config_template = """[ThermoCentralDatabase]
+TCD_HOST: localhost
+TCD_PORT: 27017
+TCD_USER: benchmark
+TCD_PW: benchmark
+
+[QuantumMechanicJob]
+data_path: {data_path}
+scratch_data_path: {scratch_data_path}
+limit_per_creation: {molecules}
+limit_per_launch: {molecules}
+"""
+
+class CallCounter(object):
+	"""
+	A class for counting database calls by name,
+	either client-side calls through CountingDatabase
+	or commands sent to a real server as a pymongo
+	command listener.
+	"""
+
+	def __init__(self):
+		self.counts = {}
+
+	def add(self, name):
+		self.counts[name] = self.counts.get(name, 0) + 1
+
+	def total(self):
+		return sum(self.counts.values())
+
+	def reset(self):
+		self.counts = {}
+
+	# pymongo command listener interface
+	def started(self, event):
+		self.add(event.command_name)
+
+	def succeeded(self, event):
+		pass
+
+	def failed(self, event):
+		pass
+
+class CountingCollection(object):
+	"""
+	A collection proxy that counts each method call,
+	for database stand-ins without command monitoring.
+	Reading more batches of a cursor is not counted.
+	"""
+
+	def __init__(self, collection, counter):
+		self.collection = collection
+		self.counter = counter
+
+	def __getattr__(self, attr):
+		value = getattr(self.collection, attr)
+		if not callable(value):
+			return value
+
+		def counted(*args, **kwargs):
+			self.counter.add(attr)
+			return value(*args, **kwargs)
+		return counted
+
+class CountingDatabase(object):
+
+	def __init__(self, database, counter):
+		self.database = database
+		self.counter = counter
+
+	def __getattr__(self, name):
+		return CountingCollection(getattr(self.database, name), self.counter)
+
+def setup_work_dir(work_dir, molecules):
+	"""
+	This method creates data folders, config file and
+	fake slurm commands under work_dir, and points
+	AUTOQM_CONFIG and PATH to them.
+	"""
+	data_path = os.path.join(work_dir, 'data')
+	scratch_data_path = os.path.join(work_dir, 'scratch')
+	bin_path = os.path.join(work_dir, 'bin')
+	for path in (data_path, scratch_data_path, bin_path):
+		os.mkdir(path)
+
+	config_path = os.path.join(work_dir, 'config.cfg')
+	with open(config_path, 'w') as f_out:
+		f_out.write(config_template.format(data_path=data_path,
+											scratch_data_path=scratch_data_path,
+											molecules=molecules))
+
+	for command, script in fake_commands.items():
+		command_path = os.path.join(bin_path, command)
+		with open(command_path, 'w') as f_out:
+			f_out.write(script)
+		os.chmod(command_path, 0o755)
+
+	calls_path = os.path.join(work_dir, 'slurm_calls.log')
+	open(calls_path, 'w').close()
+
+	os.environ['AUTOQM_CONFIG'] = config_path
+	os.environ['AUTOQM_BENCHMARK_CALLS'] = calls_path
+	os.environ['PATH'] = bin_path + os.pathsep + os.environ.get('PATH', '')
+
+	return data_path, scratch_data_path, calls_path
+
+def get_database(counter, mongo_uri=None):
+	"""
+	This method returns a fresh benchmark database, on the
+	local MongoDB server at mongo_uri if given, otherwise
+	in memory through mongomock.
+	"""
+	if mongo_uri:
+		import pymongo
+		client = pymongo.MongoClient(mongo_uri, event_listeners=[counter])
+		client.drop_database('autoqm_benchmark')
+		return client.autoqm_benchmark
+
+	try:
+		import mongomock
+	except ImportError:
+		raise Exception('Benchmark needs mongomock installed, or --mongo-uri of a local MongoDB.')
+
+	return CountingDatabase(mongomock.MongoClient().autoqm_benchmark, counter)
+
+def seed_registration_table(registration_table, molecules, chunk_size=10000):
+	"""
+	This method inserts synthetic pending molecules,
+	alkanes of one to eight carbons, with unique aug_inchi.
+	"""
+	for i in range(0, molecules, chunk_size):
+		docs = []
+		for j in range(i, min(i + chunk_size, molecules)):
+			carbon_count = 1 + j % 8
+			docs.append({
+				"aug_inchi": "InChI=1S/C{0}H{1}/benchmark-{2}".format(carbon_count,
+																	2*carbon_count + 2,
+																	j),
+				"SMILES_input": 'C'*carbon_count,
+				"count": molecules - j,
+				"status": "pending"
+			})
+		registration_table.insert_many(docs)
+
+def seed_push_targets(registration_table, success_data_path, push_count):
+	"""
+	This method inserts archived success jobs for
+	the pusher, with log and input copied from test data.
+	"""
+	if not os.path.exists(success_data_path):
+		os.mkdir(success_data_path)
+
+	docs = []
+	for i in range(push_count):
+		aug_inchi = "InChI=1S/C10H12/benchmark-push-{0}".format(i)
+		spec_path = os.path.join(success_data_path, aug_inchi.replace('/', '_slash_'))
+		os.mkdir(spec_path)
+		for file_name in ('input.log', 'input.inp'):
+			link_or_copy(os.path.join(pusher_spec_template, file_name),
+						os.path.join(spec_path, file_name))
+
+		docs.append({
+			"aug_inchi": aug_inchi,
+			"SMILES_input": pusher_smiles,
+			"level_of_theory": 'M06-2X/cc-pVTZ',
+			"status": "job_success",
+			"archived": "Yes"
+		})
+	if docs:
+		registration_table.insert_many(docs)
+
+def link_or_copy(src_file, dest_file):
+
+	try:
+		os.link(src_file, dest_file)
+	except OSError:
+		shutil.copyfile(src_file, dest_file)
+
+def write_synthetic_logs(registration_table, data_path, work_dir):
+	"""
+	This method writes gaussian logs for launched jobs:
+	none for one in ten (aborted), an unfinished log for
+	two in ten (failed convergence) and a finished one,
+	of another molecule, for the rest (failed isomorphism).
+	"""
+	truncated_log_path = os.path.join(work_dir, 'truncated.log')
+	with open(checker_log_template, 'r') as f_in:
+		lines = f_in.readlines()
+	with open(truncated_log_path, 'w') as f_out:
+		f_out.writelines(lines[:len(lines)//2])
+
+	targets = registration_table.find({"status": "job_launched"}, {"aug_inchi": 1})
+	for i, target in enumerate(targets):
+		spec_path = os.path.join(data_path, str(target['aug_inchi']).replace('/', '_slash_'))
+		log_path = os.path.join(spec_path, 'input.log')
+		if i % 10 == 0:
+			continue
+		elif i % 10 < 3:
+			link_or_copy(truncated_log_path, log_path)
+		else:
+			link_or_copy(checker_log_template, log_path)
+
+def count_slurm_calls(calls_path):
+
+	counts = {}
+	with open(calls_path, 'r') as f_in:
+		for line in f_in:
+			command = line.strip()
+			counts[command] = counts.get(command, 0) + 1
+	return counts
+
+def run_stage(name, stage_run, count_processed, counter, calls_path, quiet=True):
+	"""
+	This method times one stage run, and counts molecules
+	it processed, database calls and slurm commands.
+
+	Returns a dictionary of stage measurements
+	"""
+	processed_before = count_processed()
+	slurm_calls_before = count_slurm_calls(calls_path)
+	counter.reset()
+
+	stdout = sys.stdout
+	if quiet:
+		sys.stdout = open(os.devnull, 'w')
+	try:
+		start_time = time.time()
+		stage_run()
+		seconds = time.time() - start_time
+	finally:
+		if quiet:
+			sys.stdout.close()
+			sys.stdout = stdout
+
+	db_calls = dict(counter.counts)
+	slurm_calls = count_slurm_calls(calls_path)
+	for command, count in slurm_calls_before.items():
+		slurm_calls[command] -= count
+	processed = count_processed() - processed_before
+
+	return {
+		'stage': name,
+		'seconds': seconds,
+		'molecules': processed,
+		'molecules_per_second': processed/seconds if seconds > 0 else 0.0,
+		'db_calls': sum(db_calls.values()),
+		'db_calls_by_name': db_calls,
+		'subprocess_calls': sum(slurm_calls.values()),
+		'subprocess_calls_by_name': slurm_calls
+	}
+
+def report(results):
+
+	print('{0:10s} {1:>10s} {2:>10s} {3:>12s} {4:>10s} {5:>12s}'.format('stage',
+																		'seconds',
+																		'molecules',
+																		'molecules/s',
+																		'db calls',
+																		'subprocesses'))
+	for result in results:
+		print('{0:10s} {1:10.2f} {2:10d} {3:12.1f} {4:10d} {5:12d}'.format(result['stage'],
+																		result['seconds'],
+																		result['molecules'],
+																		result['molecules_per_second'],
+																		result['db_calls'],
+																		result['subprocess_calls']))
+
+def run_benchmark(args):
+
+	work_dir = tempfile.mkdtemp(prefix='autoqm_benchmark_', dir=args.work_dir)
+	data_path, scratch_data_path, calls_path = setup_work_dir(work_dir, args.molecules)
+	success_data_path = os.path.join(scratch_data_path, 'success')
+
+	counter = CallCounter()
+	database = get_database(counter, args.mongo_uri)
+
+	# stage modules read config at import,
+	# so they're imported after AUTOQM_CONFIG is set
+	import autoqm.connector
+	import autoqm.creator
+	import autoqm.launcher
+	import autoqm.checker
+	import autoqm.archiver
+	import autoqm.pusher
+
+	autoqm.connector.set_default_database(database)
+	registration_table = database.saturated_ringcore_table
+	results_table = database.saturated_ringcore_res_table
+	autoqm.connector.ensure_indexes(registration_table, results_table)
+
+	seed_registration_table(registration_table, args.molecules)
+	seed_push_targets(registration_table, success_data_path, args.push_count)
+
+	def count_status(*statuses):
+		return lambda: registration_table.count_documents({"status": {"$in": list(statuses)}})
+
+	stages = [
+		('creator',
+			lambda: autoqm.creator.create_jobs(limit=args.molecules,
+												partition='regularx',
+												processes=args.creator_processes),
+			count_status('job_created')),
+		('launcher',
+			lambda: autoqm.launcher.launch_jobs(args.molecules, launch_mode=args.launch_mode),
+			count_status('job_launched')),
+		('checker',
+			autoqm.checker.check_jobs,
+			count_status('job_aborted', 'job_failed_convergence', 'job_failed_isomorphism')),
+		('archiver',
+			lambda: autoqm.archiver.archive_jobs(threads=args.archiver_threads),
+			lambda: registration_table.count_documents({"archived": "Yes"})),
+		('pusher',
+			lambda: autoqm.pusher.push_jobs(registration_table,
+											results_table,
+											success_data_path,
+											processes=args.cantherm_processes),
+			lambda: results_table.count_documents({}))
+	]
+
+	results = []
+	for name, stage_run, count_processed in stages:
+		if name == 'checker':
+			# jobs "finish" between launcher and checker
+			write_synthetic_logs(registration_table, data_path, work_dir)
+		results.append(run_stage(name,
+								stage_run,
+								count_processed,
+								counter,
+								calls_path,
+								quiet=not args.verbose))
+
+	report(results)
+	if args.output:
+		with open(args.output, 'w') as f_out:
+			json.dump(results, f_out, indent=2)
+
+	if args.keep_work_dir:
+		print('Benchmark files are kept in {0}.'.format(work_dir))
+	else:
+		shutil.rmtree(work_dir)
+
+def main():
+
+	parser = argparse.ArgumentParser(description='Benchmark autoQM stages with local stand-ins '
+												'for thermo central database and slurm.')
+	parser.add_argument('--molecules', type=int, default=10000,
+						help='number of synthetic molecules to run through the pipeline')
+	parser.add_argument('--push-count', type=int, default=20,
+						help='number of success jobs seeded for the pusher')
+	parser.add_argument('--mongo-uri', default=None,
+						help='local MongoDB to use instead of in-memory mongomock, '
+							'e.g., mongodb://localhost:27017')
+	parser.add_argument('--launch-mode', default='single', choices=['single', 'array'])
+	parser.add_argument('--creator-processes', type=int, default=1)
+	parser.add_argument('--archiver-threads', type=int, default=4)
+	parser.add_argument('--cantherm-processes', type=int, default=1)
+	parser.add_argument('--work-dir', default=None,
+						help='where the temporary benchmark folder is created')
+	parser.add_argument('--output', default=None,
+						help='also write stage measurements to this JSON file')
+	parser.add_argument('--keep-work-dir', action='store_true')
+	parser.add_argument('--verbose', action='store_true',
+						help='keep printing of stages')
+	args = parser.parse_args()
+
+	run_benchmark(args)
+
+if __name__ == '__main__':
+	main()
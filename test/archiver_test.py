@@ -0,0 +1,71 @@
+import os
+import shutil
+import unittest
+
+import autoqm.archiver
+
+class TestArchiver(unittest.TestCase):
+    """
+    Contains unit tests for methods of archiver
+    """
+
+    data_path = os.path.join(os.path.dirname(__file__), 
+                            'data', 
+                            'archiver_data')
+
+    def setUp(self):
+
+        # create a job folder with a sub-folder
+        self.spec_path = os.path.join(self.data_path, 'spec')
+        os.makedirs(os.path.join(self.spec_path, 'cantherm'))
+
+        log_path = os.path.join(os.path.dirname(__file__), 
+                                'data', 
+                                'utils_data',
+                                'test_species1',
+                                'input.log')
+        shutil.copy(log_path, os.path.join(self.spec_path, 'input.log'))
+        with open(os.path.join(self.spec_path, 'cantherm', 'input.py'), 'w') as f_out:
+            f_out.write('# cantherm input\n')
+
+        self.log_checksum = autoqm.archiver.get_file_checksum(os.path.join(self.spec_path, 'input.log'))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.data_path)
+
+    def test_copy_job_folder(self):
+
+        scratch_spec_path = os.path.join(self.data_path, 'scratch_spec')
+        autoqm.archiver.copy_job_folder(self.spec_path, scratch_spec_path)
+
+        self.assertFalse(os.path.exists(self.spec_path))
+        self.assertFalse(os.path.exists(scratch_spec_path + '.partial'))
+        self.assertTrue(os.path.exists(os.path.join(scratch_spec_path, 'cantherm', 'input.py')))
+        self.assertEqual(self.log_checksum, 
+                        autoqm.archiver.get_file_checksum(os.path.join(scratch_spec_path, 'input.log')))
+
+    def test_move_job_folder(self):
+
+        scratch_spec_path = os.path.join(self.data_path, 'scratch_spec')
+        autoqm.archiver.move_job_folder(self.spec_path, scratch_spec_path)
+
+        self.assertFalse(os.path.exists(self.spec_path))
+        self.assertEqual(self.log_checksum, 
+                        autoqm.archiver.get_file_checksum(os.path.join(scratch_spec_path, 'input.log')))
+
+    def test_archive_job_existing_destination(self):
+
+        scratch_spec_path = os.path.join(self.data_path, 'scratch_spec')
+        os.makedirs(scratch_spec_path)
+        os.makedirs(scratch_spec_path + '.1')
+
+        aug_inchi, error = autoqm.archiver.archive_job(('spec', self.spec_path, scratch_spec_path, 'folder'))
+
+        # the earlier archive is kept under next free version
+        self.assertEqual('spec', aug_inchi)
+        self.assertTrue(error is None)
+        self.assertFalse(os.path.exists(self.spec_path))
+        self.assertTrue(os.path.exists(scratch_spec_path + '.2'))
+        self.assertEqual(self.log_checksum, 
+                        autoqm.archiver.get_file_checksum(os.path.join(scratch_spec_path, 'input.log')))
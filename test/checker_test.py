@@ -0,0 +1,45 @@
+import unittest
+
+import pybel
+from rdkit import Chem
+from rdkit.Chem import AllChem
+
+import autoqm.utils
+import autoqm.checker
+
+class TestCheckIsomorphism(unittest.TestCase):
+    """
+    Contains unit tests for isomorphism check of checker
+    """
+
+    def get_coordinates(self, smiles):
+
+        mol3d = Chem.AddHs(Chem.MolFromSmiles(smiles))
+        AllChem.EmbedMolecule(mol3d, randomSeed=0xf00d)
+        AllChem.UFFOptimizeMolecule(mol3d)
+
+        conformer = mol3d.GetConformer()
+        coordinates = []
+        for atom in mol3d.GetAtoms():
+            position = conformer.GetAtomPosition(atom.GetIdx())
+            coordinates.append((atom.GetAtomicNum(), position.x, position.y, position.z))
+        return coordinates
+
+    def test_check_isomorphism_chiral_ring_core(self):
+
+        # trans-1,2-dimethylcyclopentane has two stereocenters,
+        # which aug_inchi doesn't carry
+        aug_inchi = pybel.readstring('smi', 'CC1CCCC1C').write('inchi').split()[0]
+        coordinates = self.get_coordinates('C[C@@H]1CCC[C@H]1C')
+
+        # InChI comparison should decide, without
+        # falling through to RMG isomorphism
+        get_resonance_isomers = autoqm.utils.get_resonance_isomers
+        def fail(*args, **kwargs):
+            raise AssertionError('RMG isomorphism is not expected.')
+
+        autoqm.utils.get_resonance_isomers = fail
+        try:
+            self.assertTrue(autoqm.checker.check_isomorphism(aug_inchi, coordinates))
+        finally:
+            autoqm.utils.get_resonance_isomers = get_resonance_isomers
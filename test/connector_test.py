@@ -25,4 +25,81 @@ class TestThermoCentralDatabaseInterface(unittest.TestCase):
 
         tcdi = autoqm.connector.ThermoCentralDatabaseInterface(*auth_info)
 
-        self.assertTrue(tcdi.client is not None)
\ No newline at end of file
+        self.assertTrue(tcdi.client is not None)
+
+    def testLazyConnect(self):
+
+        host = 'somehost'
+        port = 27017
+        username = 'me'
+        password = 'pswd'
+
+        tcdi = autoqm.connector.ThermoCentralDatabaseInterface(host, port, username, password)
+
+        # no connection is made before client is used
+        self.assertFalse(tcdi.connected)
+
+    def testSharedClient(self):
+
+        auth_info = autoqm.utils.get_TCD_authentication_info()
+
+        tcdi1 = autoqm.connector.ThermoCentralDatabaseInterface(*auth_info)
+        tcdi2 = autoqm.connector.ThermoCentralDatabaseInterface(*auth_info)
+
+        self.assertTrue(tcdi1.client is tcdi2.client)
+
+class TestLazyCollection(unittest.TestCase):
+    """
+    Contains unit tests for resolving tables lazily
+    """
+
+    def testInjectedDatabase(self):
+
+        class InMemoryDatabase(object):
+            pass
+
+        class InMemoryTable(object):
+            def find(self, query):
+                return [{'aug_inchi': 'InChI=1S/CH4/h1H4', 'status': 'pending'}]
+
+        database = InMemoryDatabase()
+        database.saturated_ringcore_table = InMemoryTable()
+        autoqm.connector.set_default_database(database)
+
+        try:
+            targets = autoqm.connector.saturated_ringcore_table.find({'status': 'pending'})
+            self.assertEqual(1, len(targets))
+            self.assertEqual('InChI=1S/CH4/h1H4', targets[0]['aug_inchi'])
+        finally:
+            autoqm.connector.set_default_database(None)
+
+class TestIndexes(unittest.TestCase):
+    """
+    Contains unit tests for index bootstrap
+    """
+    # connect to testing database
+
+    tcdi = autoqm.connector.connectToTestCentralDatabase()
+    tcd =  getattr(tcdi.client, 'thermoCentralDB')
+
+    def testEnsureIndexes(self):
+
+        index_reg_table = getattr(self.tcd, 'index_reg_table')
+        index_res_table = getattr(self.tcd, 'index_res_table')
+
+        autoqm.connector.ensure_indexes(index_reg_table, index_res_table)
+        # calling it again keeps the same indexes
+        autoqm.connector.ensure_indexes(index_reg_table, index_res_table)
+
+        reg_index_keys = [index_info['key'] for index_info in index_reg_table.index_information().values()]
+        self.assertIn([('aug_inchi', 1)], reg_index_keys)
+        self.assertIn([('status', 1), ('count', -1), ('_id', -1)], reg_index_keys)
+        self.assertIn([('status', 1), ('archived', 1)], reg_index_keys)
+
+        res_index_info = index_res_table.index_information()
+        res_index_keys = [index_info['key'] for index_info in res_index_info.values()]
+        self.assertIn([('aug_inchi', 1), ('level_of_theory', 1)], res_index_keys)
+
+        # clean up testing tables
+        index_reg_table.drop()
+        index_res_table.drop()
@@ -0,0 +1,76 @@
+import unittest
+
+from rdkit import Chem
+
+import autoqm.creator
+import autoqm.connector
+
+class TestConformerSearch(unittest.TestCase):
+    """
+    Contains unit tests for conformer search of creator
+    """
+
+    def test_search_conformers(self):
+
+        mol3d = Chem.AddHs(Chem.MolFromSmiles('C1=CC2CCC=21'))
+        conformer_id = autoqm.creator.search_conformers(mol3d, 10, num_threads=1)
+
+        self.assertTrue(conformer_id is not None)
+        self.assertEqual(10, mol3d.GetNumConformers())
+        self.assertTrue(autoqm.creator.has_same_connectivity(mol3d, conformer_id))
+
+    def test_has_same_connectivity(self):
+
+        mol3d = Chem.AddHs(Chem.MolFromSmiles('CCO'))
+        conformer_id = autoqm.creator.search_conformers(mol3d, 2, num_threads=1)
+
+        self.assertTrue(autoqm.creator.has_same_connectivity(mol3d, conformer_id))
+
+        # pulling O onto the first C breaks the connectivity
+        conformer = mol3d.GetConformer(conformer_id)
+        conformer.SetAtomPosition(2, conformer.GetAtomPosition(0))
+        self.assertFalse(autoqm.creator.has_same_connectivity(mol3d, conformer_id))
+
+class TestCreateJobs(unittest.TestCase):
+    """
+    Contains unit tests for status updates of create_jobs
+    """
+    # connect to testing database
+
+    tcdi = autoqm.connector.connectToTestCentralDatabase()
+    tcd =  getattr(tcdi.client, 'thermoCentralDB')
+
+    aug_inchi = 'InChI=1S/C2H6/c1-2/h1-2H3'
+
+    def setUp(self):
+
+        self.creator_reg_table = getattr(self.tcd, 'creator_reg_table')
+        self.creator_reg_table.delete_many({})
+        # packed once, then reset to pending
+        self.creator_reg_table.insert_one({"aug_inchi": self.aug_inchi,
+                                           "SMILES_input": "CC",
+                                           "status": "pending",
+                                           "count": 1,
+                                           "pack_id": "old_pack"})
+
+        database = type('TestDatabase', (object,), {})()
+        database.saturated_ringcore_table = self.creator_reg_table
+        autoqm.connector.set_default_database(database)
+
+        # no input is generated, only statuses are checked
+        self.create_job = autoqm.creator.create_job
+        autoqm.creator.create_job = lambda job_args: (job_args[1], True)
+
+    def tearDown(self):
+
+        autoqm.creator.create_job = self.create_job
+        autoqm.connector.set_default_database(None)
+        self.creator_reg_table.delete_many({})
+
+    def test_recreate_unpacked(self):
+
+        autoqm.creator.create_jobs(10, 'regular', pack_size=1)
+
+        created_doc = self.creator_reg_table.find_one({"aug_inchi": self.aug_inchi})
+        self.assertEqual('job_created', created_doc['status'])
+        self.assertTrue(created_doc['pack_id'] is None)
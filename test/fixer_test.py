@@ -1,7 +1,9 @@
 import os
+import shutil
 import unittest
 
 import autoqm.fixer
+import autoqm.pusher
 from autoqm.connector import connectToTestCentralDatabase
 
 class TestFixer(unittest.TestCase):
@@ -29,3 +31,184 @@ class TestFixer(unittest.TestCase):
         self.assertEqual(1, len(selected_targets))
         self.assertEqual(str(selected_targets[0]['aug_inchi']), 
                         'InChI=1S/C13H14/c1-2-7-13-11(5-1)8-10-4-3-6-12(13)9-10/h1-7,11-13H,8-9H2')
+
+    def test_fix_jobs(self):
+
+        fixer_reg_table = getattr(self.tcd, 'fixer_reg_table')
+        aug_inchi = 'InChI=1S/C13H14/c1-2-7-13-11(5-1)8-10-4-3-6-12(13)9-10/h1-7,11-13H,8-9H2'
+        spec_name = aug_inchi.replace('/', '_slash_')
+        original_doc = fixer_reg_table.find_one({"aug_inchi": aug_inchi})
+
+        # fix a copy of the archived job
+        fixer_data_path = os.path.join(os.path.dirname(__file__), 
+                                    'data', 
+                                    'fixer_data')
+        tmp_path = os.path.join(fixer_data_path, 'tmp')
+        failed_convergence_data_path = os.path.join(tmp_path, 'failed_convergence')
+        data_path = os.path.join(tmp_path, 'data')
+        shutil.copytree(os.path.join(fixer_data_path, 'failed_convergence'), 
+                        failed_convergence_data_path)
+        os.mkdir(data_path)
+
+        try:
+            autoqm.fixer.fix_jobs(fixer_reg_table,
+                                failed_convergence_data_path,
+                                data_path,
+                                max_attempts=3)
+
+            spec_path = os.path.join(data_path, spec_name)
+            self.assertFalse(os.path.exists(os.path.join(failed_convergence_data_path, spec_name)))
+            self.assertTrue(os.path.exists(os.path.join(spec_path, 'check.chk')))
+            self.assertTrue(os.path.exists(os.path.join(spec_path, 'input.inp.1.bak')))
+
+            with open(os.path.join(spec_path, 'input.inp'), 'r') as f_in:
+                lines = f_in.read().splitlines()
+            self.assertEqual('# opt freq um062x/cc-pvtz geom=check guess=read', lines[3])
+            self.assertEqual(spec_name, lines[5])
+            self.assertEqual('0   1', lines[7])
+            self.assertEqual(9, len(lines))
+
+            with open(os.path.join(spec_path, 'submit.sl'), 'r') as f_in:
+                self.assertIn('#SBATCH -t 4:00:00\n', f_in.read())
+
+            fixed_doc = fixer_reg_table.find_one({"aug_inchi": aug_inchi})
+            self.assertEqual('job_recreated_for_convergence', fixed_doc['status'])
+            self.assertEqual(1, fixed_doc['fix_attempts'])
+            self.assertEqual('No', fixed_doc['archived'])
+        finally:
+            # restore fixer_reg_table and test data folder
+            fixer_reg_table.replace_one({"aug_inchi": aug_inchi}, original_doc)
+            shutil.rmtree(tmp_path)
+
+    def test_fix_jobs_malformed_input(self):
+
+        fixer_reg_table = getattr(self.tcd, 'fixer_reg_table')
+        aug_inchi = 'InChI=1S/C13H14/c1-2-7-13-11(5-1)8-10-4-3-6-12(13)9-10/h1-7,11-13H,8-9H2'
+        spec_name = aug_inchi.replace('/', '_slash_')
+        original_doc = fixer_reg_table.find_one({"aug_inchi": aug_inchi})
+
+        fixer_data_path = os.path.join(os.path.dirname(__file__), 
+                                    'data', 
+                                    'fixer_data')
+        tmp_path = os.path.join(fixer_data_path, 'tmp')
+        failed_convergence_data_path = os.path.join(tmp_path, 'failed_convergence')
+        data_path = os.path.join(tmp_path, 'data')
+        shutil.copytree(os.path.join(fixer_data_path, 'failed_convergence'), 
+                        failed_convergence_data_path)
+        os.mkdir(data_path)
+
+        # input without charge, multiplicity and geometry
+        scratch_spec_path = os.path.join(failed_convergence_data_path, spec_name)
+        malformed_input = '%chk=check.chk\n# opt freq um062x/cc-pvtz\n\n{0}\n'.format(spec_name)
+        with open(os.path.join(scratch_spec_path, 'input.inp'), 'w') as f_out:
+            f_out.write(malformed_input)
+
+        try:
+            autoqm.fixer.fix_jobs(fixer_reg_table,
+                                failed_convergence_data_path,
+                                data_path,
+                                max_attempts=3)
+
+            # the job is moved back untouched
+            self.assertFalse(os.path.exists(os.path.join(data_path, spec_name)))
+            self.assertEqual(['check.chk', 'input.inp', 'submit.sl'], 
+                            sorted(os.listdir(scratch_spec_path)))
+            with open(os.path.join(scratch_spec_path, 'input.inp'), 'r') as f_in:
+                self.assertEqual(malformed_input, f_in.read())
+
+            fixed_doc = fixer_reg_table.find_one({"aug_inchi": aug_inchi})
+            self.assertEqual('job_failed_convergence', fixed_doc['status'])
+            self.assertEqual(1, fixed_doc['fix_attempts'])
+        finally:
+            fixer_reg_table.replace_one({"aug_inchi": aug_inchi}, original_doc)
+            shutil.rmtree(tmp_path)
+
+    def test_fix_jobs_freq_only_and_push(self):
+
+        fixer_reg_table = getattr(self.tcd, 'fixer_reg_table')
+        fixer_res_table = getattr(self.tcd, 'fixer_res_table')
+        aug_inchi = 'InChI=1S/C13H14/c1-2-7-13-11(5-1)8-10-4-3-6-12(13)9-10/h1-7,11-13H,8-9H2'
+        spec_name = aug_inchi.replace('/', '_slash_')
+        original_doc = fixer_reg_table.find_one({"aug_inchi": aug_inchi})
+
+        fixer_data_path = os.path.join(os.path.dirname(__file__), 
+                                    'data', 
+                                    'fixer_data')
+        tmp_path = os.path.join(fixer_data_path, 'tmp')
+        failed_convergence_data_path = os.path.join(tmp_path, 'failed_convergence')
+        data_path = os.path.join(tmp_path, 'data')
+        shutil.copytree(os.path.join(fixer_data_path, 'failed_convergence'), 
+                        failed_convergence_data_path)
+        os.mkdir(data_path)
+
+        # opt has converged, but freq has not finished
+        with open(os.path.join(failed_convergence_data_path, spec_name, 'input.log'), 'w') as f_out:
+            f_out.write(' Normal termination of Gaussian 09\n')
+
+        try:
+            autoqm.fixer.fix_jobs(fixer_reg_table,
+                                failed_convergence_data_path,
+                                data_path,
+                                max_attempts=3)
+
+            spec_path = os.path.join(data_path, spec_name)
+            with open(os.path.join(spec_path, 'input.inp'), 'r') as f_in:
+                lines = f_in.read().splitlines()
+            self.assertEqual('# freq um062x/cc-pvtz geom=check guess=read', lines[3])
+
+            fixed_doc = fixer_reg_table.find_one({"aug_inchi": aug_inchi})
+            self.assertEqual('M06-2X/cc-pVTZ', fixed_doc['level_of_theory'])
+
+            # the restarted job succeeds, and is pushed even
+            # for a doc without level of theory, read from
+            # the freq only input instead
+            with open(os.path.join(spec_path, 'input.log'), 'w') as f_out:
+                f_out.write(' Normal termination of Gaussian 09\n')
+            fixer_reg_table.update_one({"aug_inchi": aug_inchi},
+                                       {"$set": {"status": "job_success"},
+                                        "$unset": {"level_of_theory": ""}})
+            fixer_res_table.delete_many({})
+
+            selected_targets = autoqm.pusher.select_push_target(fixer_reg_table,
+                                                                fixer_res_table,
+                                                                data_path)
+            self.assertEqual([aug_inchi], [str(target['aug_inchi']) for target in selected_targets])
+            self.assertEqual('M06-2X/cc-pVTZ', selected_targets[0]['level_of_theory'])
+        finally:
+            fixer_reg_table.replace_one({"aug_inchi": aug_inchi}, original_doc)
+            shutil.rmtree(tmp_path)
+
+    def test_get_restart_input(self):
+
+        lines = ['%chk=check.chk',
+                '%mem=1500mb',
+                '# opt freq',
+                '  um062x/cc-pvtz',
+                '',
+                'title line 1',
+                'title line 2',
+                '',
+                '0 1',
+                'C 0.0 0.0 0.0',
+                '']
+        restart_input = autoqm.fixer.get_restart_input(lines, freq_only=True)
+
+        self.assertEqual(['%chk=check.chk',
+                        '%mem=1500mb',
+                        '# freq um062x/cc-pvtz geom=check guess=read',
+                        '',
+                        'title line 1',
+                        'title line 2',
+                        '',
+                        '0 1',
+                        '',
+                        ''], restart_input.split('\n'))
+
+        self.assertRaises(ValueError, autoqm.fixer.get_restart_input, lines[:7])
+
+    def test_parse_walltime_hours(self):
+
+        self.assertEqual(2.0, autoqm.fixer.parse_walltime_hours('2:00:00'))
+        self.assertEqual(0.5, autoqm.fixer.parse_walltime_hours('30'))
+        self.assertEqual(0.5, autoqm.fixer.parse_walltime_hours('30:00'))
+        self.assertEqual(26.5, autoqm.fixer.parse_walltime_hours('1-2:30'))
@@ -0,0 +1,91 @@
+import os
+import shutil
+import unittest
+
+from autoqm.geometry_cache import GeometryCache
+
+class TestGeometryCache(unittest.TestCase):
+    """
+    Contains unit tests for methods of GeometryCache
+    """
+
+    cache_path = os.path.join(os.path.dirname(__file__),
+                            'data',
+                            'geometry_cache_data')
+
+    def tearDown(self):
+
+        if os.path.exists(self.cache_path):
+            shutil.rmtree(self.cache_path)
+
+    def test_get_key(self):
+
+        geometry_cache = GeometryCache(self.cache_path)
+        key = geometry_cache.get_key('InChI=1S/CH4/h1H4', 'C')
+
+        self.assertEqual(key, geometry_cache.get_key('InChI=1S/CH4/h1H4', 'C'))
+        self.assertNotEqual(key, geometry_cache.get_key('InChI=1S/CH4/h1H4', 'C', conformer_count=10))
+
+    def test_save_and_load(self):
+
+        geometry_cache = GeometryCache(self.cache_path)
+        key = geometry_cache.get_key('InChI=1S/CH4/h1H4', 'C')
+        geometry = {'mol_block': 'mol block', 'input_body': '0   1\nC 0.0 0.0 0.0\n'}
+
+        self.assertTrue(geometry_cache.load(key) is None)
+
+        geometry_cache.save(key, geometry)
+
+        self.assertEqual(geometry, geometry_cache.load(key))
+        self.assertEqual([key + '.json'], os.listdir(self.cache_path))
+
+    def test_evict(self):
+
+        geometry_cache = GeometryCache(self.cache_path, max_size_mb=2.5/1024)
+        geometry = {'mol_block': 'x'*1000, 'input_body': ''}
+        keys = [geometry_cache.get_key(str(i), 'C') for i in range(3)]
+        for i, key in enumerate(keys):
+            geometry_cache.save(key, geometry)
+            entry_path = geometry_cache.get_entry_path(key)
+            os.utime(entry_path, (i, i))
+
+        # loading the oldest entry makes it most recently used
+        geometry_cache.load(keys[0])
+
+        self.assertEqual(1, geometry_cache.evict())
+        self.assertTrue(geometry_cache.load(keys[1]) is None)
+        self.assertTrue(geometry_cache.load(keys[0]) is not None)
+        self.assertTrue(geometry_cache.load(keys[2]) is not None)
+
+    def test_save_fails(self):
+
+        # cache path taken by a file
+        with open(self.cache_path, 'w') as f_out:
+            f_out.write('')
+
+        try:
+            geometry_cache = GeometryCache(self.cache_path)
+            key = geometry_cache.get_key('InChI=1S/CH4/h1H4', 'C')
+            geometry_cache.save(key, {'mol_block': 'mol block', 'input_body': ''})
+
+            self.assertTrue(geometry_cache.load(key) is None)
+        finally:
+            os.remove(self.cache_path)
+
+    def test_evict_tmp_files(self):
+
+        geometry_cache = GeometryCache(self.cache_path, max_size_mb=1.5/1024)
+        key = geometry_cache.get_key('InChI=1S/CH4/h1H4', 'C')
+        geometry_cache.save(key, {'mol_block': 'x'*1000, 'input_body': ''})
+
+        # one left by a crashed writer, one being written
+        stale_tmp_path = os.path.join(self.cache_path, 'stale.tmp')
+        live_tmp_path = os.path.join(self.cache_path, 'live.tmp')
+        for tmp_path in [stale_tmp_path, live_tmp_path]:
+            with open(tmp_path, 'w') as f_out:
+                f_out.write('x'*1000)
+        os.utime(stale_tmp_path, (0, 0))
+
+        # the live temporary file counts towards size
+        self.assertEqual(1, geometry_cache.evict())
+        self.assertEqual(['live.tmp'], os.listdir(self.cache_path))
@@ -0,0 +1,78 @@
+import os
+import shutil
+import unittest
+
+import autoqm.packer
+import autoqm.indexer
+
+class TestIndexer(unittest.TestCase):
+    """
+    Contains unit tests for methods of indexer
+    """
+
+    data_path = os.path.join(os.path.dirname(__file__),
+                            'data',
+                            'indexer_data')
+
+    def setUp(self):
+
+        # listings cached by earlier tests may have
+        # the same mtime as the folders made here
+        autoqm.indexer.listing_cache.clear()
+        autoqm.indexer.container_cache.clear()
+
+        # one job as folder, one as container
+        # and one container still being written
+        for spec_name in ['test_species1', 'test_species2']:
+            spec_path = os.path.join(self.data_path, spec_name)
+            os.makedirs(spec_path)
+            for file_name in ['input.inp', 'input.log']:
+                with open(os.path.join(spec_path, file_name), 'w') as f_out:
+                    f_out.write('# {0}\n'.format(file_name))
+
+        spec_path = os.path.join(self.data_path, 'test_species2')
+        autoqm.packer.pack_job_folder(spec_path, autoqm.packer.get_container_path(spec_path))
+        shutil.rmtree(spec_path)
+
+        with open(os.path.join(self.data_path, 'test_species3.zip.partial'), 'w') as f_out:
+            f_out.write('')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.data_path)
+        autoqm.indexer.listing_cache.clear()
+        autoqm.indexer.container_cache.clear()
+
+    def test_scan_parent_folder(self):
+
+        folder_names, container_names = autoqm.indexer.scan_parent_folder(self.data_path)
+
+        self.assertEqual(set(['test_species1']), folder_names)
+        self.assertEqual(set(['test_species2']), container_names)
+
+    def test_job_index(self):
+
+        job_index = autoqm.indexer.JobIndex(self.data_path, use_cache=False)
+
+        self.assertTrue(job_index.has_job('test_species1'))
+        self.assertTrue(job_index.has_job('test_species2'))
+        self.assertFalse(job_index.has_job('test_species3'))
+        self.assertTrue(job_index.has_job_folder('test_species1'))
+        self.assertFalse(job_index.has_job_folder('test_species2'))
+
+        self.assertTrue(job_index.has_job_files('test_species1', ['input.inp', 'input.log']))
+        self.assertTrue(job_index.has_job_files('test_species2', ['input.inp', 'input.log']))
+        self.assertFalse(job_index.has_job_files('test_species2', ['submit.sl']))
+        self.assertFalse(job_index.has_job_files('test_species3', ['input.inp']))
+
+    def test_get_parent_listing(self):
+
+        # an old listing is cached until the folder changes
+        os.utime(self.data_path, (0, 0))
+        autoqm.indexer.get_parent_listing(self.data_path)
+        self.assertIn(self.data_path, autoqm.indexer.listing_cache)
+
+        os.makedirs(os.path.join(self.data_path, 'test_species4'))
+        folder_names, container_names = autoqm.indexer.get_parent_listing(self.data_path)
+
+        self.assertEqual(set(['test_species1', 'test_species4']), folder_names)
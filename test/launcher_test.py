@@ -0,0 +1,49 @@
+import os
+import shutil
+import unittest
+
+import autoqm.launcher
+
+class TestLauncher(unittest.TestCase):
+    """
+    Contains unit tests for methods of launcher
+    """
+
+    spec_path = os.path.join(os.path.dirname(__file__), 
+                            'data', 
+                            'fixer_data',
+                            'failed_convergence',
+                            'InChI=1S_slash_C13H14_slash_c1-2-7-13-11(5-1)8-10-4-3-6-12(13)9-10_slash_h1-7,11-13H,8-9H2')
+
+    def test_get_submission_options(self):
+
+        submission_script_path = os.path.join(self.spec_path, 'submit.sl')
+        submission_options = autoqm.launcher.get_submission_options(submission_script_path)
+
+        expected_options = ('#SBATCH -p regular', 
+                            '#SBATCH -N 1', 
+                            '#SBATCH -t 2:00:00', 
+                            '#SBATCH -C haswell')
+        self.assertEqual(expected_options, submission_options)
+
+    def test_generate_array_script(self):
+
+        array_path = os.path.join(os.path.dirname(__file__), 
+                                'data', 
+                                'launcher_data')
+        os.makedirs(array_path)
+
+        submission_options = ('#SBATCH -p regular', '#SBATCH -N 1')
+        autoqm.launcher.generate_array_script(array_path, 
+                                            [self.spec_path, self.spec_path], 
+                                            submission_options, 
+                                            throttle=10)
+
+        with open(os.path.join(array_path, 'array.sl'), 'r') as f_in:
+            array_script_lines = f_in.read().splitlines()
+        self.assertEqual(2, array_script_lines.count('"{0}"'.format(os.path.abspath(self.spec_path))))
+        self.assertIn('#SBATCH -p regular', array_script_lines)
+        self.assertIn('#SBATCH -N 1', array_script_lines)
+        self.assertIn('#SBATCH --array=0-1%10', array_script_lines)
+
+        shutil.rmtree(array_path)
@@ -0,0 +1,95 @@
+import datetime
+import unittest
+
+import autoqm.lease
+from autoqm.connector import connectToTestCentralDatabase
+
+class TestLeaseClaim(unittest.TestCase):
+    """
+    Contains unit tests for methods of LeaseClaim
+    """
+    # connect to testing database
+
+    tcdi = connectToTestCentralDatabase()
+    tcd =  getattr(tcdi.client, 'thermoCentralDB')
+
+    def setUp(self):
+
+        self.lease_reg_table = getattr(self.tcd, 'lease_reg_table')
+        self.lease_reg_table.delete_many({})
+        self.lease_reg_table.insert_many([
+            {"aug_inchi": "InChI=1S/CH4/h1H4", "status": "job_created", "count": 3},
+            {"aug_inchi": "InChI=1S/C2H6/c1-2/h1-2H3", "status": "job_created", "count": 2},
+            {"aug_inchi": "InChI=1S/C3H8/c1-3-2/h3H2,1-2H3", "status": "job_created", "count": 1},
+            {"aug_inchi": "InChI=1S/C4H10/c1-3-4-2/h3-4H2,1-2H3", "status": "job_launched", "count": 4}
+        ])
+        self.query = {"status": "job_created"}
+        self.projection = {"aug_inchi": 1}
+        self.sort_key = [('count', -1), ('_id', -1)]
+
+    def tearDown(self):
+
+        self.lease_reg_table.delete_many({})
+
+    def test_claim(self):
+
+        claim1 = autoqm.lease.LeaseClaim(self.lease_reg_table, worker_id='node1:1')
+        claim2 = autoqm.lease.LeaseClaim(self.lease_reg_table, worker_id='node2:1')
+
+        targets1 = claim1.claim(self.query, self.projection, self.sort_key, limit=2)
+        targets2 = claim2.claim(self.query, self.projection, self.sort_key, limit=2)
+
+        # each document goes to one worker only
+        self.assertEqual(["InChI=1S/CH4/h1H4", "InChI=1S/C2H6/c1-2/h1-2H3"],
+                         [target['aug_inchi'] for target in targets1])
+        self.assertEqual(["InChI=1S/C3H8/c1-3-2/h3H2,1-2H3"],
+                         [target['aug_inchi'] for target in targets2])
+        self.assertEqual(2, claim2.count_claimed_by_others(self.query))
+
+        # released documents can be claimed again
+        claim1.release()
+        self.assertEqual(2, len(claim2.claim(self.query, self.projection, self.sort_key)))
+        self.assertEqual(0, claim2.count_claimed_by_others(self.query))
+
+    def test_claim_expired_lease(self):
+
+        with autoqm.lease.LeaseClaim(self.lease_reg_table, worker_id='node1:1') as claim1:
+            claim1.claim(self.query, self.projection)
+
+            # a crashed worker's lease expires
+            expired_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+            self.lease_reg_table.update_many({"lease_token": claim1.token},
+                                             {"$set": {"lease_expiry": expired_time}})
+
+            claim2 = autoqm.lease.LeaseClaim(self.lease_reg_table, worker_id='node2:1')
+            self.assertEqual(3, len(claim2.claim(self.query, self.projection)))
+
+        # leases of claim2 are kept after claim1 releases its own
+        self.assertEqual(3, self.lease_reg_table.find({"lease_owner": "node2:1"}).count())
+
+    def test_claim_group(self):
+
+        self.lease_reg_table.update_many({"status": "job_created"}, {"$set": {"pack_id": "pack1"}})
+        pack_query = {"pack_id": "pack1", "status": "job_created"}
+
+        claim1 = autoqm.lease.LeaseClaim(self.lease_reg_table, worker_id='node1:1')
+        claim2 = autoqm.lease.LeaseClaim(self.lease_reg_table, worker_id='node2:1')
+
+        # two launchers contend for one pack,
+        # which goes to one of them as a whole
+        self.assertEqual(3, len(claim1.claim_group(pack_query, self.projection)))
+        self.assertEqual([], claim2.claim_group(pack_query, self.projection))
+        self.assertEqual(0, self.lease_reg_table.find({"lease_owner": "node2:1"}).count())
+
+        # a pack partly leased one by one by another
+        # launcher is left to it, without any lease kept
+        claim1.release()
+        claim2.claim({"aug_inchi": "InChI=1S/C3H8/c1-3-2/h3H2,1-2H3"})
+        self.assertEqual([], claim1.claim_group(pack_query, self.projection))
+        self.assertEqual(0, self.lease_reg_table.find({"lease_owner": "node1:1"}).count())
+
+        # members of expired leases are taken over
+        expired_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        self.lease_reg_table.update_many({"lease_token": claim2.token},
+                                         {"$set": {"lease_expiry": expired_time}})
+        self.assertEqual(3, len(claim1.claim_group(pack_query, self.projection)))
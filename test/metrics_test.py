@@ -0,0 +1,113 @@
+import os
+import json
+import shutil
+import unittest
+
+import autoqm.metrics
+import autoqm.connector
+
+class TestMetricsRegistry(unittest.TestCase):
+    """
+    Contains unit tests for methods of MetricsRegistry
+    """
+
+    def test_render_prometheus(self):
+
+        registry = autoqm.metrics.MetricsRegistry(buckets=(0.1, 1.0))
+        registry.inc('autoqm_stage_items_total', 3, stage='launcher')
+        registry.observe('autoqm_stage_duration_seconds', 0.5, stage='launcher')
+        registry.observe('autoqm_stage_duration_seconds', 2.0, stage='launcher')
+        registry.set_gauge('autoqm_queue_depth', 7, status='job_created')
+
+        text = registry.render_prometheus()
+
+        self.assertIn('# TYPE autoqm_stage_items_total counter', text)
+        self.assertIn('autoqm_stage_items_total{stage="launcher"} 3', text)
+        self.assertIn('autoqm_stage_duration_seconds_bucket{stage="launcher",le="0.1"} 0', text)
+        self.assertIn('autoqm_stage_duration_seconds_bucket{stage="launcher",le="1.0"} 1', text)
+        self.assertIn('autoqm_stage_duration_seconds_bucket{stage="launcher",le="+Inf"} 2', text)
+        self.assertIn('autoqm_stage_duration_seconds_count{stage="launcher"} 2', text)
+        self.assertIn('autoqm_queue_depth{status="job_created"} 7', text)
+
+        text = registry.render_prometheus(lambda labels: labels.get('stage') == 'launcher')
+        self.assertNotIn('autoqm_queue_depth', text)
+
+class TestStageRun(unittest.TestCase):
+    """
+    Contains unit tests for recording a stage run
+    """
+
+    metrics_path = os.path.join(os.path.dirname(__file__), 
+                                'data', 
+                                'metrics_data')
+
+    def setUp(self):
+
+        if os.path.exists(self.metrics_path):
+            shutil.rmtree(self.metrics_path)
+        os.makedirs(self.metrics_path)
+
+        self.metrics_config = autoqm.metrics.metrics_config
+        autoqm.metrics.metrics_config = {
+            'textfile_dir': self.metrics_path,
+            'jsonl_path': os.path.join(self.metrics_path, 'metrics.jsonl'),
+            'queue_depths': 'False'
+        }
+
+    def tearDown(self):
+
+        autoqm.metrics.metrics_config = self.metrics_config
+        shutil.rmtree(self.metrics_path)
+
+    def test_stage_run(self):
+
+        with autoqm.metrics.stage_run('test_stage'):
+            returncode, stdout, stderr = autoqm.metrics.run_subprocess(['echo', 'hello'])
+            autoqm.metrics.add_processed(2)
+
+        self.assertEqual(0, returncode)
+        self.assertEqual('hello', stdout.strip())
+
+        with open(os.path.join(self.metrics_path, 'metrics.jsonl'), 'r') as f_in:
+            records = [json.loads(line) for line in f_in]
+        self.assertEqual(1, len(records))
+        self.assertEqual('test_stage', records[0]['stage'])
+        self.assertEqual(2, records[0]['processed'])
+        self.assertEqual(1, records[0]['subprocess_calls']['echo']['count'])
+
+        with open(os.path.join(self.metrics_path, 'autoqm_test_stage.prom'), 'r') as f_in:
+            text = f_in.read()
+        self.assertIn('autoqm_stage_items_total{stage="test_stage"} 2', text)
+        self.assertIn('autoqm_subprocess_duration_seconds_count{command="echo",stage="test_stage"} 1', text)
+
+    def test_record_queue_depths_throttled(self):
+
+        class CountingTable(object):
+
+            aggregate_count = 0
+
+            def aggregate(self, pipeline):
+                CountingTable.aggregate_count += 1
+                return [{'_id': 'job_launched', 'count': 3}]
+
+        class StandInDatabase(object):
+
+            saturated_ringcore_table = CountingTable()
+
+        autoqm.metrics.metrics_config['queue_depths'] = 'True'
+        queue_depths_state = dict(autoqm.metrics.queue_depths_state)
+        autoqm.metrics.queue_depths_state['timestamp'] = None
+        autoqm.connector.set_default_database(StandInDatabase())
+        try:
+            for stage in ('stage_a', 'stage_b'):
+                with autoqm.metrics.stage_run(stage):
+                    pass
+        finally:
+            autoqm.connector.set_default_database(None)
+            autoqm.metrics.queue_depths_state.update(queue_depths_state)
+
+        # the second stage reuses counts of the first
+        self.assertEqual(1, CountingTable.aggregate_count)
+        with open(os.path.join(self.metrics_path, 'metrics.jsonl'), 'r') as f_in:
+            records = [json.loads(line) for line in f_in]
+        self.assertEqual([{'job_launched': 3}]*2, [record['queue_depths'] for record in records])
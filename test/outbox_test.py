@@ -0,0 +1,132 @@
+import unittest
+import threading
+
+import autoqm.outbox
+import autoqm.writer
+from autoqm.connector import connectToTestCentralDatabase
+
+class TestOutbox(unittest.TestCase):
+    """
+    Contains unit tests for methods of outbox
+    """
+    # connect to testing database
+
+    tcdi = connectToTestCentralDatabase()
+    tcd =  getattr(tcdi.client, 'thermoCentralDB')
+
+    def setUp(self):
+
+        self.outbox_reg_table = getattr(self.tcd, 'outbox_reg_table')
+        self.outbox_table = getattr(self.tcd, 'outbox_table')
+        self.outbox_cursor_table = getattr(self.tcd, 'outbox_cursor_table')
+        for table in [self.outbox_reg_table, self.outbox_table, self.outbox_cursor_table]:
+            table.delete_many({})
+
+    def tearDown(self):
+
+        for table in [self.outbox_reg_table, self.outbox_table, self.outbox_cursor_table]:
+            table.delete_many({})
+
+    def test_make_events(self):
+
+        updates = [({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"status": "job_success"}),
+                   ({"aug_inchi": "InChI=1S/C2H6/c1-2/h1-2H3"}, {"level_of_theory": "um062x/cc-pvtz"})]
+        events = autoqm.outbox.make_events('outbox_reg_table', updates)
+
+        # only status and archived updates are events
+        self.assertEqual(1, len(events))
+        self.assertEqual({"status": "job_success"}, events[0]['changes'])
+        self.assertEqual({"aug_inchi": "InChI=1S/CH4/h1H4"}, events[0]['query'])
+
+    def test_writer_appends_events(self):
+
+        with autoqm.writer.BulkUpdateWriter(self.outbox_reg_table,
+                                            outbox_table=self.outbox_table) as writer:
+            writer.update({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"status": "job_success"})
+            writer.update({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"archived": "Yes"})
+            writer.update({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"level_of_theory": "um062x/cc-pvtz"})
+
+        events = list(self.outbox_table.find().sort('_id', 1))
+        self.assertEqual([{"status": "job_success"}, {"archived": "Yes"}],
+                         [event['changes'] for event in events])
+
+    def test_writer_appends_events_of_operator_query(self):
+
+        self.outbox_reg_table.insert_one({"aug_inchi": "InChI=1S/CH4/h1H4", "status": "job_created"})
+
+        # e.g., launcher updates only members still waiting
+        query = {"aug_inchi": "InChI=1S/CH4/h1H4",
+                 "status": {"$in": ["job_created", "job_recreated_for_convergence"]}}
+        with autoqm.writer.BulkUpdateWriter(self.outbox_reg_table,
+                                            upsert=False,
+                                            outbox_table=self.outbox_table) as writer:
+            writer.update(query, {"status": "job_launched"})
+            writer.flush()
+
+        events = list(self.outbox_table.find())
+        self.assertEqual(1, len(events))
+        self.assertEqual({"aug_inchi": "InChI=1S/CH4/h1H4"}, events[0]['query'])
+        self.assertEqual({"status": "job_launched"}, events[0]['changes'])
+
+    def test_append_events_fails(self):
+
+        class FailingTable(object):
+
+            def insert_many(self, events, ordered=True):
+                raise ValueError('key must not start with $')
+
+        # failing to append events never fails the update
+        events = autoqm.outbox.make_events('outbox_reg_table',
+                                           [({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"status": "job_success"})])
+        autoqm.outbox.append_events(FailingTable(), events)
+
+    def test_poll(self):
+
+        subscriber = autoqm.outbox.OutboxSubscriber('test_subscriber',
+                                                    self.outbox_table,
+                                                    self.outbox_cursor_table,
+                                                    use_change_stream=False)
+        subscriber.load_position()
+
+        events = autoqm.outbox.make_events('outbox_reg_table',
+                                           [({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"status": "job_success"})])
+        autoqm.outbox.append_events(self.outbox_table, events)
+
+        self.assertEqual(1, len(subscriber.poll()))
+        self.assertEqual(0, len(subscriber.poll()))
+
+        # a new subscriber of same name resumes
+        # after the last event read
+        autoqm.outbox.append_events(self.outbox_table, autoqm.outbox.make_events('outbox_reg_table',
+                                    [({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"archived": "Yes"})]))
+        subscriber = autoqm.outbox.OutboxSubscriber('test_subscriber',
+                                                    self.outbox_table,
+                                                    self.outbox_cursor_table,
+                                                    use_change_stream=False)
+        subscriber.load_position()
+        events = subscriber.poll()
+
+        self.assertEqual(1, len(events))
+        self.assertEqual({"archived": "Yes"}, events[0]['changes'])
+
+    def test_listen(self):
+
+        autoqm.outbox.append_events(self.outbox_table, autoqm.outbox.make_events('outbox_reg_table',
+                                    [({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"status": "job_success"})]))
+        self.outbox_cursor_table.insert_one({'_id': 'test_subscriber', 'last_id': None})
+
+        subscriber = autoqm.outbox.OutboxSubscriber('test_subscriber',
+                                                    self.outbox_table,
+                                                    self.outbox_cursor_table,
+                                                    poll_interval=0.1,
+                                                    use_change_stream=False)
+        stop_event = threading.Event()
+        handled_events = []
+
+        def handle_events(events):
+            handled_events.extend(events)
+            stop_event.set()
+
+        subscriber.listen(handle_events, stop_event)
+
+        self.assertEqual(1, len(handled_events))
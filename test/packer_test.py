@@ -0,0 +1,76 @@
+import os
+import shutil
+import unittest
+
+import autoqm.packer
+
+class TestPacker(unittest.TestCase):
+    """
+    Contains unit tests for methods of packer
+    """
+
+    data_path = os.path.join(os.path.dirname(__file__), 
+                            'data', 
+                            'packer_data')
+
+    def setUp(self):
+
+        # pack a copy of a job folder
+        self.log_path = os.path.join(os.path.dirname(__file__), 
+                                    'data', 
+                                    'utils_data',
+                                    'test_species1',
+                                    'input.log')
+        self.spec_path = os.path.join(self.data_path, 'test_species1')
+        os.makedirs(os.path.join(self.spec_path, 'cantherm'))
+        shutil.copy(self.log_path, os.path.join(self.spec_path, 'input.log'))
+        with open(os.path.join(self.spec_path, 'cantherm', 'input.py'), 'w') as f_out:
+            f_out.write('# cantherm input\n')
+
+        self.container_path = autoqm.packer.get_container_path(self.spec_path)
+        autoqm.packer.pack_job_folder(self.spec_path, self.container_path)
+        shutil.rmtree(self.spec_path)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.data_path)
+
+    def test_pack_job_folder(self):
+
+        self.assertTrue(os.path.exists(self.container_path))
+        self.assertFalse(os.path.exists(self.container_path + '.partial'))
+        self.assertTrue(os.path.getsize(self.container_path) < os.path.getsize(self.log_path))
+
+    def test_list_job_files(self):
+
+        job_files = autoqm.packer.list_job_files(self.spec_path)
+
+        self.assertEqual(set(['input.log', 'cantherm/input.py']), job_files)
+        self.assertTrue(autoqm.packer.has_job_files(self.spec_path, ['input.log']))
+        self.assertFalse(autoqm.packer.has_job_files(self.spec_path, ['input.log', 'input.inp']))
+
+    def test_open_job_file(self):
+
+        with open(self.log_path, 'rb') as f_in:
+            expected_content = f_in.read()
+
+        with autoqm.packer.open_job_file(self.spec_path, 'input.log') as f_in:
+            content = f_in.read()
+
+        self.assertEqual(expected_content, content)
+
+    def test_extract_job_file(self):
+
+        dest_file = os.path.join(self.data_path, 'input.log')
+        autoqm.packer.extract_job_file(self.spec_path, 'input.log', dest_file)
+
+        self.assertEqual(os.path.getsize(self.log_path), os.path.getsize(dest_file))
+
+    def test_unpack_job_folder(self):
+
+        autoqm.packer.unpack_job_folder(self.container_path, self.spec_path)
+
+        self.assertFalse(os.path.exists(self.container_path))
+        self.assertTrue(os.path.exists(os.path.join(self.spec_path, 'cantherm', 'input.py')))
+        self.assertEqual(os.path.getsize(self.log_path), 
+                        os.path.getsize(os.path.join(self.spec_path, 'input.log')))
@@ -0,0 +1,78 @@
+import os
+import math
+import unittest
+
+from autoqm.predictor import ResourcePredictor, format_walltime
+
+class TestResourcePredictor(unittest.TestCase):
+
+    model_path = os.path.join(os.path.dirname(__file__),
+                            'data',
+                            'predictor_data',
+                            'resource_model.json')
+
+    def setUp(self):
+
+        model_dir = os.path.dirname(self.model_path)
+        if not os.path.exists(model_dir):
+            os.makedirs(model_dir)
+        if os.path.exists(self.model_path):
+            os.remove(self.model_path)
+
+    def tearDown(self):
+
+        if os.path.exists(self.model_path):
+            os.remove(self.model_path)
+
+    def test_fit(self):
+
+        predictor = ResourcePredictor()
+        self.assertTrue(predictor.get_coefficients() is None)
+
+        # cpu hours doubling with every heavy atom
+        for heavy_atom_count in range(4, 12):
+            predictor.observe(heavy_atom_count, 0.1*2**heavy_atom_count)
+
+        a, b = predictor.get_coefficients()
+        self.assertAlmostEqual(math.log(0.1), a, 6)
+        self.assertAlmostEqual(math.log(2), b, 6)
+        self.assertAlmostEqual(0.1*2**15, predictor.predict_cpu_hours(15), 4)
+
+    def test_predict_resources(self):
+
+        predictor = ResourcePredictor()
+
+        # no fit yet, callers keep their own resources
+        self.assertTrue(predictor.predict_resources(6) is None)
+        self.assertEqual(2.0, predictor.predict_walltime_hours(6, 8))
+
+        predictor.observe(5, 4.0)
+        predictor.observe(10, 32.0)
+
+        walltime, procs_num, memory = predictor.predict_resources(10)
+        # 32 cpu hours on 16 procs at 50% efficiency, doubled
+        self.assertEqual('8:00:00', walltime)
+        self.assertEqual('16', procs_num)
+        self.assertEqual('1000mb', memory)
+
+        walltime, procs_num, memory = predictor.predict_resources(30)
+        self.assertEqual('48:00:00', walltime)
+        self.assertEqual('32', procs_num)
+        self.assertEqual('1500mb', memory)
+
+    def test_save_and_load(self):
+
+        predictor = ResourcePredictor(self.model_path)
+        predictor.observe(5, 4.0)
+        predictor.observe(10, 32.0)
+        predictor.save()
+
+        loaded_predictor = ResourcePredictor(self.model_path)
+        self.assertEqual(2, loaded_predictor.sample_count)
+        self.assertEqual(predictor.get_coefficients(), loaded_predictor.get_coefficients())
+
+    def test_format_walltime(self):
+
+        self.assertEqual('2:30:00', format_walltime(2.5))
+        self.assertEqual('0:31:00', format_walltime(0.51))
+        self.assertEqual('48:00:00', format_walltime(48))
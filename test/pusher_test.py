@@ -58,3 +58,38 @@ class TestPusher(unittest.TestCase):
 
         # check pusher_res_table again
         self.assertEqual(1, pusher_res_table.count())
+
+    def test_run_cantherm_jobs(self):
+
+        utils_data_path = os.path.join(os.path.dirname(__file__), 
+                                        'data', 
+                                        'utils_data')
+        model_chemistry = 'M06-2X/cc-pVTZ'
+        cantherm_jobs = [('test_species1', 
+                        os.path.join(utils_data_path, 'test_species1'), 
+                        model_chemistry, 
+                        'C1=CC2CCC=21'),
+                        ('test_species2', 
+                        os.path.join(utils_data_path, 'test_species2'), 
+                        model_chemistry, 
+                        'C1=CC2C(C1)C1C=CCC21'),
+                        ('missing_species', 
+                        os.path.join(utils_data_path, 'missing_species'), 
+                        model_chemistry, 
+                        'C1=CC2CCC=21')]
+
+        results = list(autoqm.pusher.run_cantherm_jobs(cantherm_jobs, 
+                                                    processes=2, 
+                                                    timeout=600))
+
+        # every job reports back, the bad one with an error
+        results_dict = dict((aug_inchi, (thermo_values, error)) for aug_inchi, thermo_values, error in results)
+        self.assertEqual(3, len(results_dict))
+        self.assertTrue(results_dict['test_species1'][1] is None)
+        self.assertTrue(results_dict['test_species2'][1] is None)
+        self.assertTrue(results_dict['missing_species'][1] is not None)
+        self.assertAlmostEqual(results_dict['test_species2'][0]['Hf298(kcal/mol)'], 87.69, 1)
+
+        # clean up test data folder
+        shutil.rmtree(os.path.join(utils_data_path, 'test_species1', 'cantherm'))
+        shutil.rmtree(os.path.join(utils_data_path, 'test_species2', 'cantherm'))
@@ -0,0 +1,141 @@
+import os
+import time
+import shutil
+import unittest
+
+import autoqm.scheduler
+
+class TestLocalBackend(unittest.TestCase):
+    """
+    Contains unit tests for methods of LocalBackend
+    """
+
+    scheduler_data_path = os.path.join(os.path.dirname(__file__), 
+                                    'data', 
+                                    'scheduler_data')
+
+    def setUp(self):
+
+        if os.path.exists(self.scheduler_data_path):
+            shutil.rmtree(self.scheduler_data_path)
+
+        self.job_paths = []
+        for i in range(2):
+            job_path = os.path.join(self.scheduler_data_path, 'job_{0}'.format(i))
+            os.makedirs(job_path)
+            with open(os.path.join(job_path, 'submit.sl'), 'w') as f_out:
+                f_out.write('#!/bin/bash -l\nsleep 1\necho done\n')
+            self.job_paths.append(job_path)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.scheduler_data_path)
+
+    def wait_until_off_queue(self, backend, job_ids, timeout=30):
+
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            status_map = backend.get_statuses(job_ids)
+            if all(status == 'off_queue' for status in status_map.values()):
+                return status_map
+            time.sleep(0.2)
+        return status_map
+
+    def test_submit_and_check(self):
+
+        state_path = os.path.join(self.scheduler_data_path, 'state', 'state.json')
+        backend = autoqm.scheduler.LocalBackend(state_path, max_jobs=1)
+
+        job_id1 = backend.submit('submit.sl', self.job_paths[0])
+        job_id2 = backend.submit('submit.sl', self.job_paths[1])
+        self.assertNotEqual(job_id1, job_id2)
+
+        # only one job runs at a time
+        status_map = backend.get_statuses([job_id1, job_id2])
+        self.assertEqual('job_running', status_map[job_id1])
+        self.assertEqual('job_launched', status_map[job_id2])
+
+        # job state is shared with another backend instance
+        other_backend = autoqm.scheduler.LocalBackend(state_path, max_jobs=1)
+        status_map = self.wait_until_off_queue(other_backend, [job_id1, job_id2])
+        self.assertEqual('off_queue', status_map[job_id1])
+        self.assertEqual('off_queue', status_map[job_id2])
+
+        for job_path in self.job_paths:
+            with open(os.path.join(job_path, 'out.log'), 'r') as f_in:
+                self.assertEqual('done', f_in.read().strip())
+
+        self.assertEqual('off_queue', backend.get_status('unknown'))
+
+    def test_finished_job_starts_queued_job(self):
+
+        state_path = os.path.join(self.scheduler_data_path, 'state', 'state.json')
+        backend = autoqm.scheduler.LocalBackend(state_path, max_jobs=1)
+
+        backend.submit('submit.sl', self.job_paths[0])
+        backend.submit('submit.sl', self.job_paths[1])
+
+        # the second job is started by the first one
+        # finishing, without any status check
+        out_path = os.path.join(self.job_paths[1], 'out.log')
+        start_time = time.time()
+        while time.time() - start_time < 30:
+            if os.path.exists(out_path):
+                with open(out_path, 'r') as f_in:
+                    if f_in.read().strip() == 'done':
+                        break
+            time.sleep(0.2)
+
+        with open(out_path, 'r') as f_in:
+            self.assertEqual('done', f_in.read().strip())
+
+    def test_is_process_running(self):
+
+        pid = os.getpid()
+        start_time = autoqm.scheduler.get_process_start_time(pid)
+
+        self.assertTrue(autoqm.scheduler.is_process_running(pid, start_time))
+        if start_time is not None:
+            # another process reusing the pid
+            self.assertFalse(autoqm.scheduler.is_process_running(pid, start_time + 1))
+
+class TestSlurmBackend(unittest.TestCase):
+    """
+    Contains unit tests for methods of SlurmBackend
+    """
+
+    bin_path = os.path.join(os.path.dirname(__file__), 
+                            'data', 
+                            'scheduler_bin')
+
+    def setUp(self):
+
+        os.makedirs(self.bin_path)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.bin_path + os.pathsep + self.path
+
+    def tearDown(self):
+
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.bin_path)
+
+    def write_sbatch(self, script_string):
+
+        sbatch_path = os.path.join(self.bin_path, 'sbatch')
+        with open(sbatch_path, 'w') as f_out:
+            f_out.write(script_string)
+        os.chmod(sbatch_path, 0o755)
+
+    def test_submit_with_warning(self):
+
+        self.write_sbatch('#!/bin/bash\necho "sbatch: warning: no account" >&2\necho "Submitted batch job 5022607"\n')
+        backend = autoqm.scheduler.SlurmBackend()
+
+        self.assertEqual('5022607', backend.submit('submit.sl', self.bin_path))
+
+    def test_submit_failure(self):
+
+        self.write_sbatch('#!/bin/bash\necho "sbatch: error: invalid partition" >&2\nexit 1\n')
+        backend = autoqm.scheduler.SlurmBackend()
+
+        self.assertTrue(backend.submit('submit.sl', self.bin_path) is None)
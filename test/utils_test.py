@@ -39,6 +39,16 @@ class TestAuthentication(unittest.TestCase):
 
 class TestQuantumFileParsing(unittest.TestCase):
 
+	truncated_log_path = os.path.join(os.path.dirname(__file__), 
+									'data', 
+									'utils_data',
+									'truncated.log')
+
+	def tearDown(self):
+
+		if os.path.exists(self.truncated_log_path):
+			os.remove(self.truncated_log_path)
+
 	def test_get_level_of_theory(self):
 
 		inp_path = os.path.join(os.path.dirname(__file__), 
@@ -50,6 +60,90 @@ class TestQuantumFileParsing(unittest.TestCase):
 
 		self.assertEqual(level_of_theory, 'um062x/cc-pvtz')
 
+	def test_scan_gaussian_log(self):
+
+		log_path = os.path.join(os.path.dirname(__file__), 
+							'data', 
+							'utils_data',
+							'test_species1',
+							'input.log')
+
+		normal_termination_count, coordinates = autoqm.utils.scan_gaussian_log(log_path)
+
+		self.assertEqual(2, normal_termination_count)
+		self.assertEqual(12, len(coordinates))
+		self.assertEqual((6, 1.531622, 0.664846, -0.109062), coordinates[0])
+		self.assertEqual((1, -2.096517, 1.309762, 0.492343), coordinates[-1])
+
+	def test_scan_gaussian_log_unfinished(self):
+
+		log_path = os.path.join(os.path.dirname(__file__), 
+							'data', 
+							'utils_data',
+							'test_species1',
+							'input.log')
+		truncated_log_path = self.truncated_log_path
+		with open(log_path, 'r') as f_in:
+			lines = f_in.readlines()
+		with open(truncated_log_path, 'w') as f_out:
+			f_out.writelines(lines[:4000])
+
+		normal_termination_count, coordinates = autoqm.utils.scan_gaussian_log(truncated_log_path)
+
+		self.assertEqual(0, normal_termination_count)
+		self.assertTrue(coordinates is None)
+
+	def test_get_xyz_string(self):
+
+		coordinates = [(6, 0.0, 0.0, 0.0), (1, 0.0, 0.0, 1.09)]
+		xyz_string = autoqm.utils.get_xyz_string(coordinates)
+
+		xyz_lines = xyz_string.splitlines()
+		self.assertEqual('2', xyz_lines[0])
+		self.assertEqual(['C', '0.000000', '0.000000', '0.000000'], xyz_lines[2].split())
+		self.assertEqual(['H', '0.000000', '0.000000', '1.090000'], xyz_lines[3].split())
+
+	def test_remove_inchi_stereo_layers(self):
+
+		inchi = 'InChI=1S/C7H14/c1-6-4-3-5-7(6)2/h6-7H,3-5H2,1-2H3/t6-,7-/m1/s1'
+		stereo_free_inchi = autoqm.utils.remove_inchi_stereo_layers(inchi)
+
+		self.assertEqual('InChI=1S/C7H14/c1-6-4-3-5-7(6)2/h6-7H,3-5H2,1-2H3', stereo_free_inchi)
+		self.assertEqual(stereo_free_inchi, autoqm.utils.remove_inchi_stereo_layers(stereo_free_inchi))
+
+	def test_get_formula_from_coordinates(self):
+
+		log_path = os.path.join(os.path.dirname(__file__), 
+							'data', 
+							'utils_data',
+							'test_species2',
+							'input.log')
+
+		_, coordinates = autoqm.utils.scan_gaussian_log(log_path)
+		formula = autoqm.utils.get_formula_from_coordinates(coordinates)
+
+		self.assertEqual('C10H12', formula)
+
+	def test_get_heavy_atom_count_from_formula(self):
+
+		self.assertEqual(10, autoqm.utils.get_heavy_atom_count_from_formula('C10H12'))
+		self.assertEqual(3, autoqm.utils.get_heavy_atom_count_from_formula('C2H6O'))
+		self.assertEqual(3, autoqm.utils.get_heavy_atom_count_from_formula('CH2Cl2'))
+
+	def test_get_job_cpu_times(self):
+
+		log_path = os.path.join(os.path.dirname(__file__),
+							'data',
+							'utils_data',
+							'test_species1',
+							'input.log')
+
+		cpu_times = autoqm.utils.get_job_cpu_times(log_path)
+
+		self.assertEqual(2, len(cpu_times))
+		self.assertAlmostEqual(2 + 20/60.0 + 42.6/3600, cpu_times[0], 6)
+		self.assertAlmostEqual(1 + 26/60.0 + 8.2/3600, cpu_times[1], 6)
+
 class TestRmgSpecies(unittest.TestCase):
 
 	def test_get_atoms_and_bonds_dicts1(self):
@@ -86,6 +180,25 @@ class TestRmgSpecies(unittest.TestCase):
 		self.assertEqual(5, bonds['C-C'])
 		self.assertEqual(6, bonds['C-H'])
 
+	def test_get_resonance_isomers(self):
+
+		cache_path = os.path.join(os.path.dirname(__file__), 
+								'data', 
+								'utils_data',
+								'resonance_cache')
+		aug_inchi = 'InChI=1S/C6H6/c1-2-4-6-5-3-1/h1-6H'
+
+		isomers = autoqm.utils.get_resonance_isomers(aug_inchi, cache_path)
+		self.assertEqual(1, len(os.listdir(cache_path)))
+
+		# second call reads isomers back from cache
+		cached_isomers = autoqm.utils.get_resonance_isomers(aug_inchi, cache_path)
+		self.assertEqual(len(isomers), len(cached_isomers))
+		for isomer, cached_isomer in zip(isomers, cached_isomers):
+			self.assertTrue(isomer.isIsomorphic(cached_isomer))
+
+		shutil.rmtree(cache_path)
+
 class TestCantherm(unittest.TestCase):
 
 	def test_run_cantherm1(self):
@@ -131,5 +244,3 @@ class TestCantherm(unittest.TestCase):
 		self.assertAlmostEqual(thermo.Cpdata.value_si[6]/4.184, 108.02, 1)
 
 		shutil.rmtree(os.path.join(spec_path, 'cantherm'))
-	
-		
\ No newline at end of file
@@ -0,0 +1,74 @@
+import unittest
+
+import autoqm.writer
+from autoqm.connector import connectToTestCentralDatabase
+
+class TestBulkUpdateWriter(unittest.TestCase):
+    """
+    Contains unit tests for methods of BulkUpdateWriter
+    """
+    # connect to testing database
+
+    tcdi = connectToTestCentralDatabase()
+    tcd =  getattr(tcdi.client, 'thermoCentralDB')
+
+    def test_flush(self):
+
+        writer_reg_table = getattr(self.tcd, 'writer_reg_table')
+        writer_reg_table.delete_many({})
+
+        writer = autoqm.writer.BulkUpdateWriter(writer_reg_table, batch_size=10)
+        writer.update({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"status": "job_created"})
+        writer.update({"aug_inchi": "InChI=1S/C2H6/c1-2/h1-2H3"}, {"status": "job_created"})
+
+        # nothing is written before flushing
+        self.assertEqual(0, writer_reg_table.count())
+
+        results = writer.flush()
+
+        self.assertEqual(2, len(results))
+        self.assertTrue(all(result['ok'] for result in results))
+        self.assertEqual(2, writer_reg_table.find({"status": "job_created"}).count())
+
+        # clean up writer_reg_table
+        writer_reg_table.delete_many({})
+
+    def test_flush_by_size(self):
+
+        writer_reg_table = getattr(self.tcd, 'writer_reg_table')
+        writer_reg_table.delete_many({})
+
+        with autoqm.writer.BulkUpdateWriter(writer_reg_table, batch_size=2) as writer:
+            writer.update({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"status": "job_launched"})
+            writer.update({"aug_inchi": "InChI=1S/C2H6/c1-2/h1-2H3"}, {"status": "job_launched"})
+
+            # the buffer is flushed once full
+            self.assertEqual(0, len(writer.requests))
+            self.assertEqual(2, writer_reg_table.count())
+
+            writer.update({"aug_inchi": "InChI=1S/C3H8/c1-3-2/h3H2,1-2H3"}, {"status": "job_launched"})
+            self.assertEqual(1, len(writer.requests))
+
+        # the rest is flushed on exit
+        self.assertEqual(3, writer_reg_table.find({"status": "job_launched"}).count())
+
+        # clean up writer_reg_table
+        writer_reg_table.delete_many({})
+
+    def test_failed_results(self):
+
+        writer_reg_table = getattr(self.tcd, 'writer_reg_table')
+        writer_reg_table.delete_many({})
+        writer_reg_table.insert_one({"aug_inchi": "InChI=1S/CH4/h1H4"})
+
+        with autoqm.writer.BulkUpdateWriter(writer_reg_table, batch_size=2) as writer:
+            # _id can't be changed, so this update fails
+            writer.update({"aug_inchi": "InChI=1S/CH4/h1H4"}, {"_id": "CH4"})
+            writer.update({"aug_inchi": "InChI=1S/C2H6/c1-2/h1-2H3"}, {"status": "job_launched"})
+
+        # failures of flushes by update are kept on writer
+        self.assertEqual(1, len(writer.failed_results))
+        self.assertEqual({"_id": "CH4"}, writer.failed_results[0]['update_field'])
+
+        # clean up writer_reg_table
+        writer_reg_table.delete_many({})